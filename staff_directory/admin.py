@@ -1,17 +1,21 @@
 from django.contrib import admin
 from staff_directory.models import Praise
 
-from core.actions import export_as_csv_action
+from staff_directory import export
 
 
+def export_praise_csv(modeladmin, request, queryset):
+    """
+        streams the selected thanks as CSV, use the filters to export a
+        date range or a value
+    """
+    return export.praise_csv_response(queryset)
+export_praise_csv.short_description = "CSV Export"
+
 
 class PraiseAdmin(admin.ModelAdmin):
     list_display = ('date_added', 'recipient', 'praise_nominator', 'cfpb_value')
-    actions = [export_as_csv_action("CSV Export",
-                                    fields=['date_added',
-                                            'recipient',
-                                            'praise_nominator',
-                                            'cfpb_value',
-                                            'reason'])]
+    list_filter = ('date_added', 'cfpb_value')
+    actions = [export_praise_csv]
 
 admin.site.register(Praise, PraiseAdmin)
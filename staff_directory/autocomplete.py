@@ -0,0 +1,264 @@
+"""
+In-memory prefix index for the person and tag autocomplete inputs.
+
+Every lower cased name, word of a name and stub is kept in a sorted list
+per kind, so the entries starting with what was typed are a contiguous run
+found with a binary search.  Like the org tree, each process keeps its own
+copy.  The receivers record which people and tags changed in a numbered
+log in the shared cache, and each process reloads just those entries on
+its next search.  A process that missed part of the log, or whose copy is
+older than STAFF_DIR_AUTOCOMPLETE_MAX_AGE seconds, reloads everything on a
+background thread while searches are answered from the copy it has; only
+the first search of a process waits for a load.  Searching never touches
+the database.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+
+from core.models import Person
+from core.taggit.models import Tag
+
+AUTOCOMPLETE_MAX_AGE = getattr(settings, 'STAFF_DIR_AUTOCOMPLETE_MAX_AGE',
+                               60 * 60)
+# changes a process applies one by one before it reloads everything
+MAX_CHANGES = 500
+CHANGE_TIMEOUT = 60 * 60 * 24
+
+PERSON = 'person'
+TAG = 'tag'
+
+_SEQ_KEY = 'staff_dir_autocomplete_seq'
+
+_index = {'seq': None, 'built_at': 0, 'data': None}
+# held while the copy is replaced, searches read whichever copy is current
+_lock = threading.Lock()
+_reloading = threading.Lock()
+
+
+def _normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+def _keys(text):
+    """
+        the text and each of its later words, so "data" and "science" both
+        find "data science"
+    """
+    text = _normalize(text)
+    words = text.split(' ')
+    return set([text] + [' '.join(words[i:]) for i in range(1, len(words))])
+
+
+def _entry_keys(kind, entry):
+    if kind == PERSON:
+        return _keys(entry['label']) | set([entry['stub'].lower()])
+    return _keys(entry['label'])
+
+
+def _sorted(keys):
+    keys.sort()
+    return [key for key, pk in keys], [pk for key, pk in keys]
+
+
+def _load_entries(kind, pks=None):
+    """
+        a dict of pk -> entry for every person or tag, or for pks only
+    """
+    entries = {}
+    if kind == PERSON:
+        people = Person.objects.filter(user__is_active=True,
+                                       hide_profile=False)
+        if pks is not None:
+            people = people.filter(pk__in=pks)
+        for pk, stub, first_name, last_name in people.values_list(
+                'pk', 'stub', 'user__first_name', 'user__last_name'):
+            name = ' '.join(part for part in (first_name, last_name) if part)
+            if name and stub:
+                entries[pk] = {'label': name, 'value': name, 'stub': stub}
+    else:
+        tags = Tag.objects.all()
+        if pks is not None:
+            tags = tags.filter(pk__in=pks)
+        for pk, name, slug, count in tags.annotate(
+                count=Sum('staff_directory_counts__count')) \
+                .values_list('pk', 'name', 'slug', 'count'):
+            entries[pk] = {'label': name, 'value': name, 'slug': slug,
+                           'count': count or 0}
+    return entries
+
+
+def _load():
+    entries, keys = {}, {}
+    for kind in (PERSON, TAG):
+        entries[kind] = _load_entries(kind)
+        keys[kind] = _sorted([(key, pk) for pk, entry in
+                              entries[kind].items()
+                              for key in _entry_keys(kind, entry)])
+    return {'entries': entries, 'keys': keys}
+
+
+def _apply(data, changes):
+    """
+        a copy of data with the entries of changes, (kind, pk) pairs,
+        loaded again
+    """
+    data = {'entries': dict(data['entries']), 'keys': dict(data['keys'])}
+    for kind in (PERSON, TAG):
+        pks = set(pk for changed_kind, pk in changes if changed_kind == kind)
+        if not pks:
+            continue
+        entries = data['entries'][kind] = dict(data['entries'][kind])
+        keys, ids = data['keys'][kind]
+        keys, ids = list(keys), list(ids)
+        loaded = _load_entries(kind, pks)
+        for pk in pks:
+            if pk in entries:
+                for key in _entry_keys(kind, entries.pop(pk)):
+                    i = bisect_left(keys, key)
+                    while i < len(keys) and keys[i] == key:
+                        if ids[i] == pk:
+                            del keys[i], ids[i]
+                            break
+                        i += 1
+            if pk in loaded:
+                entries[pk] = loaded[pk]
+                for key in _entry_keys(kind, loaded[pk]):
+                    i = bisect_left(keys, key)
+                    while i < len(keys) and keys[i] == key and ids[i] < pk:
+                        i += 1
+                    keys.insert(i, key)
+                    ids.insert(i, pk)
+        data['keys'][kind] = (keys, ids)
+    return data
+
+
+def _change_key(seq):
+    return 'staff_dir_autocomplete_change_%s' % seq
+
+
+def _current_seq():
+    seq = cache.get(_SEQ_KEY)
+    if seq is None:
+        cache.add(_SEQ_KEY, 0, CHANGE_TIMEOUT)
+        seq = cache.get(_SEQ_KEY) or 0
+    return seq
+
+
+def changed(kind, pks):
+    """
+        records that the people or tags of pks changed, every process
+        reloads their entries on its next search
+    """
+    pks = list(pks)
+    if not pks:
+        return
+    _current_seq()
+    try:
+        last = cache.incr(_SEQ_KEY, len(pks))
+    except ValueError:
+        # the counter was evicted since, the processes reload everything
+        return
+    first = last - len(pks) + 1
+    cache.set_many(dict((_change_key(seq), (kind, pk)) for seq, pk in
+                        zip(range(first, last + 1), pks)), CHANGE_TIMEOUT)
+
+
+def reload_all():
+    """
+        makes every process load its copy again, for writes that send no
+        signals
+    """
+    _current_seq()
+    try:
+        # more changes than a process applies one by one
+        cache.incr(_SEQ_KEY, MAX_CHANGES + 1)
+    except ValueError:
+        pass
+    expire()
+
+
+def _reload():
+    try:
+        seq = _current_seq()
+        data = _load()
+        with _lock:
+            _index.update(seq=seq, built_at=time.time(), data=data)
+    finally:
+        # the thread opened its own connection
+        connection.close()
+        _reloading.release()
+
+
+def _reload_in_background():
+    if _reloading.acquire(False):
+        thread = threading.Thread(target=_reload)
+        thread.daemon = True
+        thread.start()
+
+
+def get_index():
+    seq = _current_seq()
+    if _index['data'] is None:
+        with _lock:
+            if _index['data'] is None:
+                _index.update(seq=seq, built_at=time.time(), data=_load())
+        return _index['data']
+
+    if seq != _index['seq']:
+        with _lock:
+            applied = _index['seq']
+            if applied < seq <= applied + MAX_CHANGES:
+                found = cache.get_many(
+                    [_change_key(n) for n in range(applied + 1, seq + 1)])
+                if len(found) == seq - applied:
+                    _index['data'] = _apply(_index['data'], found.values())
+                    _index['seq'] = seq
+    if _index['seq'] != seq or \
+            time.time() - _index['built_at'] > AUTOCOMPLETE_MAX_AGE:
+        _reload_in_background()
+    return _index['data']
+
+
+def expire():
+    """
+        drops this process's copy, the next search loads it again
+    """
+    with _lock:
+        _index.update(seq=None, built_at=0, data=None)
+
+
+def _rank(entry, kind, term):
+    # whole names starting with the term first, then the most used tags
+    starts = _normalize(entry['label']).startswith(term)
+    if kind == TAG:
+        return (not starts, -entry['count'], entry['label'].lower())
+    return (not starts, entry['label'].lower())
+
+
+def search(term, kind, limit=10):
+    """
+        up to limit entries of kind (PERSON or TAG) with a name, a word of
+        their name or a stub starting with term, best first
+    """
+    term = _normalize(term)
+    if not term:
+        return []
+
+    index = get_index()
+    keys, ids = index['keys'][kind]
+    found = set()
+    i = bisect_left(keys, term)
+    while i < len(keys) and keys[i].startswith(term):
+        found.add(ids[i])
+        i += 1
+
+    entries = index['entries'][kind]
+    return heapq.nsmallest(limit, (entries[pk] for pk in found),
+                           key=lambda entry: _rank(entry, kind, term))
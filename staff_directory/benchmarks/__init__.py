@@ -0,0 +1,8 @@
+"""
+Benchmarks of the staff directory's hot views against generated data.
+
+``data.generate`` fills the database with a deterministic synthetic
+directory and ``harness.run`` times the views against it.  Both are driven
+by the ``generate_benchmark_data`` and ``run_benchmarks`` management
+commands.
+"""
@@ -0,0 +1,231 @@
+"""
+Deterministic synthetic directory for benchmarks.
+
+The same seed and counts always produce the same people, org groups, tags,
+tagged items and thanks, so timings from different runs and branches are
+comparable.  Rows are written with bulk inserts, in chunks, and every
+generated row is recognisable by the ``bench`` prefix so ``clear`` can
+remove them again.
+"""
+import bisect
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from core.models import OrgGroup, Person
+from core.taggit.models import Tag, TagCategory, TaggedItem
+from staff_directory import autocomplete, caching, email_lookup, \
+    org_tree, praise_stats, recent_photos, tag_cooccurrence, tag_counts, \
+    tag_index, thanks
+from staff_directory.helpers import STAFF_DIR_TAG_CATEGORIES
+from staff_directory.models import NOUN, Praise
+
+PREFIX = 'bench'
+PASSWORD = 'bench'
+CHUNK_SIZE = 5000
+
+DEFAULTS = {
+    'people': 1000,
+    'divisions': 5,
+    'offices': 4,
+    'tags': 500,
+    'tagged_items': 20000,
+    'praise': 2000,
+}
+
+
+def username(n):
+    return '%s-%d@example.com' % (PREFIX, n)
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _weighted_picker(rng, count):
+    """
+        picks indexes in range(count) with zipf-like popularity, so a few
+        tags are on many people and most are on a handful
+    """
+    cumulative = []
+    total = 0.0
+    for rank in range(count):
+        total += 1.0 / (rank + 1)
+        cumulative.append(total)
+    return lambda: bisect.bisect(cumulative, rng.random() * total)
+
+
+def _create_users(rng, count):
+    User = get_user_model()
+    password = make_password(PASSWORD)
+    users = (User(username=username(n), email=username(n),
+                  first_name='Bench%d' % n,
+                  last_name=rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') +
+                  'bench%d' % n,
+                  password=password)
+             for n in range(count))
+    for chunk in _chunks(users):
+        User.objects.bulk_create(chunk)
+    return list(User.objects.filter(username__startswith=PREFIX + '-')
+                .order_by('pk').values_list('pk', flat=True))
+
+
+def _create_org_groups(divisions, offices):
+    OrgGroup.objects.bulk_create([
+        OrgGroup(title='%s division %d' % (PREFIX, d))
+        for d in range(divisions)])
+    division_ids = list(OrgGroup.objects
+                        .filter(title__startswith=PREFIX + ' division ')
+                        .order_by('pk').values_list('pk', flat=True))
+    OrgGroup.objects.bulk_create([
+        OrgGroup(title='%s office %d.%d' % (PREFIX, d, o), parent_id=pk)
+        for d, pk in enumerate(division_ids) for o in range(offices)])
+    return division_ids + list(
+        OrgGroup.objects.filter(title__startswith=PREFIX + ' office ')
+        .order_by('pk').values_list('pk', flat=True))
+
+
+def _create_people(rng, user_ids, org_group_ids):
+    people = (Person(user_id=user_id, stub='%s-%d' % (PREFIX, n),
+                     title='Bench title %d' % rng.randint(1, 50),
+                     org_group_id=rng.choice(org_group_ids))
+              for n, user_id in enumerate(user_ids))
+    for chunk in _chunks(people):
+        Person.objects.bulk_create(chunk)
+    return list(Person.objects.filter(stub__startswith=PREFIX + '-')
+                .order_by('pk').values_list('pk', flat=True))
+
+
+def _create_tags(count):
+    for chunk in _chunks(Tag(name='%s tag %d' % (PREFIX, n),
+                             slug='%s-tag-%d' % (PREFIX, n))
+                         for n in range(count)):
+        Tag.objects.bulk_create(chunk)
+    return list(Tag.objects.filter(slug__startswith=PREFIX + '-tag-')
+                .order_by('pk').values_list('pk', flat=True))
+
+
+def _create_tagged_items(rng, count, person_ids, user_ids, tag_ids):
+    category_ids = [TagCategory.objects.get_or_create(
+        slug=slug, defaults={'name': slug})[0].pk
+        for slug in STAFF_DIR_TAG_CATEGORIES]
+    content_type = tag_index.person_content_type()
+    pick_tag = _weighted_picker(rng, len(tag_ids))
+    # a person can only carry a tag once per category
+    count = min(count, len(person_ids) * len(tag_ids) * len(category_ids))
+
+    def items():
+        seen = set()
+        while len(seen) < count:
+            key = (tag_ids[pick_tag()], rng.choice(category_ids),
+                   rng.choice(person_ids))
+            if key in seen:
+                continue
+            seen.add(key)
+            yield TaggedItem(tag_id=key[0], tag_category_id=key[1],
+                             object_id=key[2], content_type=content_type,
+                             tag_creator_id=rng.choice(user_ids))
+
+    for chunk in _chunks(items()):
+        TaggedItem.objects.bulk_create(chunk)
+    return count
+
+
+def _create_praise(rng, count, person_ids, user_ids):
+    values = sorted(NOUN)
+    praise = (Praise(recipient_id=rng.choice(person_ids),
+                     praise_nominator_id=rng.choice(user_ids),
+                     cfpb_value=rng.choice(values),
+                     reason='Bench thanks %d' % n)
+              for n in range(count))
+    # bulk_create skips Praise.save, so no notifications are queued
+    for chunk in _chunks(praise):
+        Praise.objects.bulk_create(chunk)
+    return count
+
+
+def generate(seed=0, **counts):
+    """
+        creates a synthetic directory, e.g.
+        generate(people=50000, tagged_items=1000000), and rebuilds the
+        derived tag counts, co-occurrences, thanks statistics, org tree and
+        caches.  counts not given come from DEFAULTS
+    """
+    counts = dict(DEFAULTS, **counts)
+    rng = random.Random(seed)
+
+    with transaction.atomic():
+        user_ids = _create_users(rng, counts['people'])
+        org_group_ids = _create_org_groups(counts['divisions'],
+                                           counts['offices'])
+        person_ids = _create_people(rng, user_ids, org_group_ids)
+        tag_ids = _create_tags(counts['tags'])
+        created = dict(counts, tagged_items=_create_tagged_items(
+            rng, counts['tagged_items'], person_ids, user_ids, tag_ids))
+        _create_praise(rng, counts['praise'], person_ids, user_ids)
+
+    _rebuild_derived(person_ids, tag_ids, org_group_ids)
+    return created
+
+
+def clear():
+    """
+        deletes everything generate created
+    """
+    with transaction.atomic():
+        people = Person.objects.filter(stub__startswith=PREFIX + '-') \
+            .values_list('pk', flat=True)
+        person_ids = list(people)
+        tag_ids = list(Tag.objects.filter(slug__startswith=PREFIX + '-tag-')
+                       .values_list('pk', flat=True))
+        org_group_ids = list(OrgGroup.objects
+                             .filter(title__startswith=PREFIX + ' ')
+                             .values_list('pk', flat=True))
+        # skips the per row delete receivers, the derived data is
+        # rebuilt below
+        connection.cursor().execute(
+            'DELETE FROM %s WHERE content_type_id = %%s AND object_id IN '
+            '(SELECT id FROM %s WHERE stub LIKE %%s)' % (
+                TaggedItem._meta.db_table, Person._meta.db_table),
+            [tag_index.person_content_type().pk, PREFIX + '-%'])
+        Tag.objects.filter(slug__startswith=PREFIX + '-tag-').delete()
+        Praise.objects.filter(recipient__in=people).delete()
+        Person.objects.filter(stub__startswith=PREFIX + '-').delete()
+        get_user_model().objects \
+            .filter(username__startswith=PREFIX + '-').delete()
+        OrgGroup.objects.filter(title__startswith=PREFIX + ' office ') \
+            .delete()
+        OrgGroup.objects.filter(title__startswith=PREFIX + ' division ') \
+            .delete()
+
+    _rebuild_derived(person_ids, tag_ids, org_group_ids)
+
+
+def _rebuild_derived(person_ids, tag_ids, org_group_ids):
+    # bulk inserts and raw deletes send no signals, so nothing derived
+    # is current.  only what the generated rows affect is expired, the
+    # rest of a shared cache is left alone
+    tag_counts.rebuild()
+    tag_cooccurrence.rebuild()
+    praise_stats.rebuild()
+    org_tree.expire()
+    for tag_id in tag_ids:
+        tag_index.clear(tag_id)
+    caching.expire_groups(
+        [caching.person_group(pk) for pk in person_ids] +
+        [caching.tag_group(pk) for pk in tag_ids] +
+        [caching.org_group_group(pk) for pk in org_group_ids])
+    cache.delete_many([recent_photos.RECENT_PHOTOS_KEY,
+                       thanks.THANKS_COUNT_KEY])
+    email_lookup.expire()
+    autocomplete.reload_all()
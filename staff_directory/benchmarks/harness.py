@@ -0,0 +1,234 @@
+"""
+Timing harness for the staff directory's hot views.
+
+Each view is requested once to warm the caches and then ``runs`` times
+through the test client, logged in as a generated person.  The report has
+the p50/p95 wall time, the query count and the peak memory of every view,
+and can be saved as a JSON baseline and compared against later.
+
+The peak resident memory of a process only ever grows, so each view is
+measured in a forked copy of the process and its peak is what the copy
+held at its highest over what it held when forked.  Where processes
+cannot be forked the views are measured in process, without a peak.
+"""
+import json
+import math
+import os
+import time
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Count
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from core.models import OrgGroup, Person
+from core.taggit.models import TaggedItem
+from staff_directory import tag_index
+from staff_directory.benchmarks import data
+from staff_directory.models import TagCount
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+VIEWS = ('index', 'person_profile', 'org_group', 'show_by_tag',
+         'show_thanks', 'show_tag_emails')
+# peak memory growth below this is allocator noise, not a regression
+PEAK_SLACK_KB = 1024
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def _urls():
+    """
+        the url benchmarked for each view, picked from the generated data:
+        the most tagged person, the biggest division and the most popular
+        tag
+    """
+    person_ids = Person.objects.filter(stub__startswith=data.PREFIX + '-') \
+        .values_list('pk', flat=True)
+    busiest = TaggedItem.objects.filter(
+        content_type=tag_index.person_content_type(),
+        object_id__in=person_ids) \
+        .values('object_id').annotate(items=Count('id')) \
+        .order_by('-items', 'object_id').first()
+    division = OrgGroup.objects.filter(
+        title__startswith=data.PREFIX + ' division ').order_by('pk').first()
+    popular = TagCount.objects.filter(
+        tag__slug__startswith=data.PREFIX + '-tag-') \
+        .order_by('-count', 'tag').select_related('tag').first()
+    if busiest is None or division is None or popular is None:
+        raise BenchmarkError('No benchmark data, run generate_benchmark_data '
+                             'first.')
+
+    stub = Person.objects.get(pk=busiest['object_id']).stub
+    return {
+        'index': reverse('staff_directory:index'),
+        'person_profile': reverse('staff_directory:person', args=(stub,)),
+        'org_group': reverse('staff_directory:org_group',
+                             args=(division.title,)),
+        'show_by_tag': reverse('staff_directory:show_by_tag',
+                               args=(popular.tag.slug,)),
+        'show_thanks': reverse('staff_directory:show_thanks'),
+        'show_tag_emails': reverse('staff_directory:show_tag_emails',
+                                   args=(popular.tag.slug,)),
+    }
+
+
+def _max_rss_kb():
+    # kB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(values, percent):
+    """
+        nearest rank percentile of a non empty list
+    """
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise BenchmarkError('%s returned %s' % (url, response.status_code))
+    if getattr(response, 'streaming', False):
+        # the export is only produced as it is read
+        for chunk in response.streaming_content:
+            pass
+    return response
+
+
+def _measure(client, url, runs):
+    _get(client, url)
+
+    times = []
+    queries = 0
+    for run in range(runs):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.time()
+            _get(client, url)
+            times.append((time.time() - start) * 1000)
+        queries = max(queries, len(captured))
+
+    return {
+        'p50_ms': round(percentile(times, 50), 2),
+        'p95_ms': round(percentile(times, 95), 2),
+        'queries': queries,
+        'peak_kb': None,
+    }
+
+
+def _measure_forked(client, url, runs):
+    """
+        _measure in a forked copy of the process, adding the memory the
+        view needed at its peak.  the copy uses the database connection it
+        inherited while this process waits for it
+    """
+    if resource is None or not hasattr(os, 'fork'):
+        return _measure(client, url, runs)
+
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            start = _max_rss_kb()
+            try:
+                result = _measure(client, url, runs)
+                result['peak_kb'] = _max_rss_kb() - start
+            except BenchmarkError as e:
+                result = {'error': str(e)}
+            with os.fdopen(write_end, 'w') as f:
+                json.dump(result, f)
+        finally:
+            # skips the exit handlers, which would close the connection
+            # this process still uses
+            os._exit(0)
+
+    os.close(write_end)
+    with os.fdopen(read_end) as f:
+        output = f.read()
+    os.waitpid(pid, 0)
+    if not output:
+        raise BenchmarkError('Measuring %s failed.' % url)
+    result = json.loads(output)
+    if 'error' in result:
+        raise BenchmarkError(result['error'])
+    return result
+
+
+def run(runs=20, views=VIEWS):
+    """
+        times the views, returns a dict of view name -> measurements
+    """
+    urls = _urls()
+    # the test client's requests come from "testserver"
+    with override_settings(
+            ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+        client = Client()
+        if not client.login(username=data.username(0),
+                            password=data.PASSWORD):
+            raise BenchmarkError('Could not log in as %s.' %
+                                 data.username(0))
+        return dict((name, _measure_forked(client, urls[name], runs))
+                    for name in views)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+        lists the regressions against baseline: a p95 or a peak memory more
+        than tolerance higher, or any extra query
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append('%s: p95 %.2fms, baseline %.2fms' % (
+                name, result['p95_ms'], before['p95_ms']))
+        if result['queries'] > before['queries']:
+            regressions.append('%s: %d queries, baseline %d' % (
+                name, result['queries'], before['queries']))
+        if result.get('peak_kb') is not None and \
+                before.get('peak_kb') is not None and \
+                result['peak_kb'] > before['peak_kb'] * (1 + tolerance) + \
+                PEAK_SLACK_KB:
+            regressions.append('%s: peak %dkB, baseline %dkB' % (
+                name, result['peak_kb'], before['peak_kb']))
+    return regressions
+
+
+def format_report(results, baseline=None):
+    baseline = baseline or {}
+    lines = ['%-16s %8s %8s %9s %8s %8s %9s %9s' % (
+        'view', 'p50 ms', 'p95 ms', 'base p95', 'queries', 'base q',
+        'peak kB', 'base peak')]
+    for name in VIEWS:
+        if name not in results:
+            continue
+        result = results[name]
+        before = baseline.get(name, {})
+        lines.append('%-16s %8.2f %8.2f %9s %8d %8s %9s %9s' % (
+            name, result['p50_ms'], result['p95_ms'],
+            before.get('p95_ms', ''), result['queries'],
+            before.get('queries', ''), result.get('peak_kb', ''),
+            before.get('peak_kb', '')))
+    return '\n'.join(lines)
@@ -0,0 +1,159 @@
+"""
+Query plan audit of the staff directory's hot views.
+
+Each view benchmarked by the harness is requested once, every SELECT it
+runs is captured with its parameters and explained against the current
+database, and the plans are checked for full table scans and for sorts
+that cannot use an index.  PostgreSQL, MySQL and SQLite plans are
+understood.
+"""
+import re
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from staff_directory.benchmarks import data, harness
+
+# small lookup tables read whole on purpose
+ALLOWED_SCANS = ('django_content_type', 'django_session', 'core_orggroup',
+                 'taggit_tagcategory')
+
+SEQ_SCAN = 'full scan'
+FILESORT = 'sort without index'
+
+
+@contextmanager
+def _capture_queries():
+    """
+        collects the (sql, params) of every query run in the block
+    """
+    queries = []
+    ops = connection.ops
+    last_executed_query = ops.last_executed_query
+
+    def record(cursor, sql, params):
+        queries.append((sql, params))
+        return last_executed_query(cursor, sql, params)
+
+    ops.last_executed_query = record
+    # only the debug cursor asks for the executed query
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        yield queries
+    finally:
+        del ops.last_executed_query
+        connection.use_debug_cursor = use_debug_cursor
+
+
+def _postgresql_issues(plan):
+    issues = []
+    for line in plan:
+        match = re.search(r'Seq Scan on (\w+)', line)
+        if match:
+            issues.append((SEQ_SCAN, match.group(1)))
+        # a sort node, not its "Sort Key:" or "Sort Method:" details
+        elif re.search(r'(^|-> +)Sort +\(', line.strip()):
+            issues.append((FILESORT, ''))
+    return issues
+
+
+def _mysql_issues(rows, columns):
+    issues = []
+    for row in rows:
+        row = dict(zip(columns, row))
+        if row.get('type') == 'ALL':
+            issues.append((SEQ_SCAN, row.get('table') or ''))
+        if 'filesort' in (row.get('Extra') or ''):
+            issues.append((FILESORT, row.get('table') or ''))
+    return issues
+
+
+def _sqlite_issues(plan):
+    issues = []
+    for line in plan:
+        match = re.match(r'SCAN (?:TABLE )?(\w+)', line)
+        if match and 'INDEX' not in line:
+            issues.append((SEQ_SCAN, match.group(1)))
+        elif 'TEMP B-TREE FOR ORDER BY' in line:
+            issues.append((FILESORT, ''))
+    return issues
+
+
+def explain(sql, params):
+    """
+        the plan of a query as a list of lines and the (problem, table)
+        pairs found in it
+    """
+    cursor = connection.cursor()
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = [row[-1] for row in cursor.fetchall()]
+        return plan, _sqlite_issues(plan)
+
+    cursor.execute('EXPLAIN ' + sql, params)
+    rows = cursor.fetchall()
+    if vendor == 'mysql':
+        columns = [column[0] for column in cursor.description]
+        plan = [' '.join(unicode(value) for value in row) for row in rows]
+        return plan, _mysql_issues(rows, columns)
+    plan = [row[0] for row in rows]
+    return plan, _postgresql_issues(plan)
+
+
+def audit(views=harness.VIEWS, allowed=ALLOWED_SCANS):
+    """
+        explains the SELECTs of each view, returns a dict of view name ->
+        list of {'sql', 'plan', 'issues'} for every distinct query
+    """
+    urls = harness._urls()
+    results = {}
+    with override_settings(
+            ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+        client = Client()
+        if not client.login(username=data.username(0),
+                            password=data.PASSWORD):
+            raise harness.BenchmarkError('Could not log in as %s.' %
+                                         data.username(0))
+        for name in views:
+            # the second request shows the plans of a warm cache
+            harness._get(client, urls[name])
+            with _capture_queries() as queries:
+                harness._get(client, urls[name])
+
+            seen, results[name] = set(), []
+            for sql, params in queries:
+                if not sql.lstrip().upper().startswith('SELECT') or \
+                        (sql, tuple(params or ())) in seen:
+                    continue
+                seen.add((sql, tuple(params or ())))
+                plan, issues = explain(sql, params)
+                results[name].append({
+                    'sql': sql, 'plan': plan,
+                    'issues': [(problem, table) for problem, table in issues
+                               if table not in allowed]})
+    return results
+
+
+def format_report(results, show_plans=False):
+    lines = []
+    for name in harness.VIEWS:
+        if name not in results:
+            continue
+        queries = results[name]
+        flagged = [query for query in queries if query['issues']]
+        lines.append('%s: %d queries, %d flagged' % (
+            name, len(queries), len(flagged)))
+        for query in queries:
+            if not (query['issues'] or show_plans):
+                continue
+            for problem, table in query['issues']:
+                lines.append('  %s %s' % (problem, table))
+            lines.append('    ' + query['sql'])
+            if show_plans:
+                lines.extend('      ' + line for line in query['plan'])
+    return '\n'.join(lines)
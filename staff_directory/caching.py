@@ -0,0 +1,217 @@
+"""
+Versioned cache groups for the staff directory's cached pages and fragments.
+
+Every tag, person and org group has its own cache_tools group.  Cached
+fragments include the versions of the groups they depend on in their key,
+and a write bumps only the groups it affects, so unrelated pages stay
+cached.
+
+``get_or_set`` keeps a value past its timeout for STAFF_DIR_CACHE_STALE_TIME
+more seconds.  When it times out, or a little before at random so that
+not every process notices at once, one request takes a lock and computes
+it again while the others keep being served the previous value.  Hits,
+misses, stale reads and refreshes are counted per name for the ``stats``
+view.
+"""
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+
+from cache_tools.tools import TIME_TO_CACHE, expire_cache_group, \
+    get_group_key
+from django.conf import settings
+from django.core.cache import cache
+
+from core.models import Person
+from core.taggit.models import TaggedItem
+from staff_directory import instrumentation, org_tree, tag_index
+
+STALE_TIME = getattr(settings, 'STAFF_DIR_CACHE_STALE_TIME', 60 * 10)
+LOCK_TIMEOUT = getattr(settings, 'STAFF_DIR_CACHE_LOCK_TIMEOUT', 30)
+# how long a request with nothing to serve waits for another to compute
+LOCK_WAIT = getattr(settings, 'STAFF_DIR_CACHE_LOCK_WAIT', 2)
+# higher refreshes earlier
+EARLY_REFRESH_BETA = 1.0
+
+COUNTERS = ('hits', 'misses', 'stale', 'refreshes')
+
+_counters_lock = threading.Lock()
+_counters = defaultdict(lambda: dict((counter, 0) for counter in COUNTERS))
+
+
+def tag_group(tag_id):
+    return 'staff_dir_tag_%s' % tag_id
+
+
+def person_group(person_id):
+    return 'staff_dir_person_%s' % person_id
+
+
+def org_group_group(org_group_id):
+    return 'staff_dir_org_group_%s' % org_group_id
+
+
+def _changed_key(group):
+    return 'staff_dir_changed_%s' % group
+
+
+def expire_groups(groups):
+    """
+        expires the groups and records when they changed
+    """
+    now = time.time()
+    for group in groups:
+        expire_cache_group(group)
+    cache.set_many(dict((_changed_key(group), now) for group in groups),
+                   TIME_TO_CACHE)
+
+
+def last_changed(groups):
+    """
+        unix time at which one of the groups was last expired.  a group
+        never expired, or whose time was evicted, is taken to have changed
+        now and keeps that time until its next change
+    """
+    keys = [_changed_key(group) for group in groups]
+    changed = cache.get_many(keys)
+    missing = [key for key in keys if key not in changed]
+    if missing:
+        now = time.time()
+        for key in missing:
+            cache.add(key, now, TIME_TO_CACHE)
+        # another request may have recorded its own time first
+        changed.update(cache.get_many(missing))
+        for key in missing:
+            changed.setdefault(key, now)
+    return max(changed.values())
+
+
+def group_versions(groups):
+    """
+        a string changing whenever one of the groups is expired, for use
+        in cache keys and {% cache %} vary-on arguments
+    """
+    return '.'.join(get_group_key(group) for group in groups)
+
+
+def expire_person(person_id, tag_ids=(), org_group_ids=()):
+    expire_people([person_id], tag_ids, org_group_ids)
+
+
+def expire_people(person_ids, tag_ids=(), org_group_ids=()):
+    """
+        expires everything showing the people's tags: the people, the pages
+        of tag_ids and of every tag the people carry (their related tag
+        panes list the people's other tags) and the people's offices, the
+        org_group_ids they just left, and the groups above them
+    """
+    org_group_ids = set(org_group_ids)
+    org_group_ids.update(Person.objects.filter(pk__in=person_ids)
+                         .values_list('org_group_id', flat=True))
+    tag_ids = set(tag_ids)
+    tag_ids.update(TaggedItem.objects.filter(
+        content_type=tag_index.person_content_type(),
+        object_id__in=person_ids).values_list('tag_id', flat=True))
+
+    groups = set(person_group(pk) for pk in person_ids)
+    groups.update(tag_group(pk) for pk in tag_ids)
+    for org_group_id in org_group_ids:
+        if org_group_id:
+            groups.update(org_group_group(pk) for pk in
+                          org_tree.ancestor_ids(org_group_id))
+    expire_groups(sorted(groups))
+
+
+def expire_org_group(org_group):
+    """
+        expires the pages of the org group, of the groups above it and of
+        the people in it or below it, whose profiles show its title
+    """
+    groups = [org_group_group(org_group.pk)]
+    groups.extend(person_group(pk) for pk in Person.objects.filter(
+        org_group_id__in=org_tree.descendant_ids(org_group.pk))
+        .values_list('pk', flat=True))
+    if org_group.parent_id:
+        groups.extend(org_group_group(pk) for pk in
+                      org_tree.ancestor_ids(org_group.parent_id))
+    expire_groups(groups)
+
+
+def _count(name, counter):
+    with _counters_lock:
+        _counters[name][counter] += 1
+
+
+def cache_stats():
+    """
+        the hits, misses, stale reads and refreshes of each name passed to
+        get_or_set since the process started
+    """
+    with _counters_lock:
+        return dict((name, dict(counts)) for name, counts in
+                    _counters.items())
+
+
+def reset_cache_stats():
+    with _counters_lock:
+        _counters.clear()
+
+
+def _needs_refresh(entry, now):
+    # the later in its life and the longer it took to compute, the more
+    # likely a value is refreshed before it times out
+    return now - entry['delta'] * EARLY_REFRESH_BETA * \
+        math.log(random.random() or 1e-12) >= entry['expires']
+
+
+def _compute(key, compute, timeout, stale):
+    start = time.time()
+    value = compute()
+    now = time.time()
+    cache.set(key, {'value': value, 'expires': now + timeout,
+                    'delta': now - start}, timeout + stale)
+    return value
+
+
+def get_or_set(key, compute, timeout, name=None, stale=STALE_TIME):
+    """
+        the value cached under key, computed by compute() and kept for
+        timeout seconds.  only one request at a time computes it, the
+        others are served the stale value meanwhile
+    """
+    name = name or key
+    entry = cache.get(key)
+    now = time.time()
+    if entry is not None and not _needs_refresh(entry, now):
+        _count(name, 'hits')
+        instrumentation.record_cache(hits=1)
+        return entry['value']
+
+    lock_key = key + ':lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            _count(name, 'misses' if entry is None else 'refreshes')
+            instrumentation.record_cache(misses=1)
+            return _compute(key, compute, timeout, stale)
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        _count(name, 'stale')
+        instrumentation.record_cache(hits=1)
+        return entry['value']
+
+    # another request is computing a value we do not have at all
+    deadline = now + LOCK_WAIT
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            _count(name, 'hits')
+            instrumentation.record_cache(hits=1)
+            return entry['value']
+    _count(name, 'misses')
+    instrumentation.record_cache(misses=1)
+    return _compute(key, compute, timeout, stale)
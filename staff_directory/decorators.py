@@ -1,16 +1,17 @@
 from core.models import Person
 from core.utils import json_response
 from django.http import HttpResponseRedirect
+from django.utils.cache import patch_cache_control
+
+from staff_directory.request_people import current_person, person_by_stub
 
 
 def registration_required(f):
     def wrap(request, *args, **kwargs):
         # check to see if user has registered
-        try:
-            request.user.get_profile()
-            return f(request, *args, **kwargs)
-        except Exception as e:
-            raise e
+        if current_person(request) is None:
+            raise Person.DoesNotExist('%s has no profile' % request.user)
+        return f(request, *args, **kwargs)
     wrap.__doc__ = f.__doc__
     wrap.__name__ = f.__name__
     return wrap
@@ -18,7 +19,7 @@ def registration_required(f):
 
 def user_allows_tagging(f):
     def wrap(request, *args, **kwargs):
-        person = Person.objects.get(stub=request.POST.get('person_stub'))
+        person = person_by_stub(request, request.POST.get('person_stub'))
 
         if person.user == request.user or person.allow_tagging:
             return f(request, *args, **kwargs)
@@ -29,3 +30,18 @@ def user_allows_tagging(f):
     wrap.__doc__ = f.__doc__
     wrap.__name__ = f.__name__
     return wrap
+
+
+def always_revalidate(f):
+    """
+        like never_cache, but without the Last-Modified of now never_cache
+        adds, which would keep the condition decorator from answering 304
+    """
+    def wrap(request, *args, **kwargs):
+        response = f(request, *args, **kwargs)
+        patch_cache_control(response, no_cache=True, must_revalidate=True,
+                            max_age=0)
+        return response
+    wrap.__doc__ = f.__doc__
+    wrap.__name__ = f.__name__
+    return wrap
@@ -0,0 +1,163 @@
+"""
+Email address to profile stub resolution for the lookup views.
+
+Addresses are matched lower cased against PersonEmail's unique index, and
+the answers, including misses, are remembered in a per-process LRU.  The
+receivers expire the shared version whenever an address or stub changes,
+which empties every process' LRU on its next lookup.  An address shared by
+several users is kept by one profile at a time; when that profile changes
+address or is deleted it passes to the oldest other profile having it.
+"""
+import threading
+from collections import OrderedDict
+
+from cache_tools.tools import expire_cache_group, get_group_key
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from core.models import Person
+from staff_directory import instrumentation
+from staff_directory.models import PersonEmail
+
+EMAIL_GROUP = 'staff_dir_emails'
+EMAIL_CACHE_SIZE = getattr(settings, 'STAFF_DIR_EMAIL_CACHE_SIZE', 10000)
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+        a thread safe mapping keeping the size most recently used keys
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+_cache = LRUCache(EMAIL_CACHE_SIZE)
+_state = {'version': None}
+
+
+def normalize(email):
+    return (email or '').strip().lower()
+
+
+def expire():
+    expire_cache_group(EMAIL_GROUP)
+    _cache.clear()
+
+
+def _check_version():
+    version = get_group_key(EMAIL_GROUP)
+    if _state['version'] != version:
+        _cache.clear()
+        _state['version'] = version
+
+
+def _record(person_id, email, stub):
+    try:
+        with transaction.atomic():
+            PersonEmail.objects.create(person_id=person_id, email=email,
+                                       stub=stub)
+    except IntegrityError:
+        # another profile keeps an address shared by several users
+        pass
+
+
+def release(email):
+    """
+        records a freed address for the oldest other profile having it, and
+        expires the cached lookups
+    """
+    email = normalize(email)
+    if email:
+        other = Person.objects.filter(user__email__iexact=email,
+                                      staff_directory_email__isnull=True) \
+            .exclude(stub='').order_by('pk').values_list('pk', 'stub') \
+            .first()
+        if other is not None:
+            _record(other[0], email, other[1])
+    expire()
+
+
+def recorded_email(person_id):
+    return PersonEmail.objects.filter(person=person_id) \
+        .values_list('email', flat=True).first()
+
+
+def resolve(emails):
+    """
+        a dict of each normalized address in emails to the stub of its
+        profile, or None when no profile has it
+    """
+    _check_version()
+
+    result, misses = {}, []
+    for email in set(normalize(email) for email in emails):
+        if not email:
+            continue
+        stub = _cache.get(email, _MISSING)
+        if stub is _MISSING:
+            misses.append(email)
+        else:
+            result[email] = stub
+    instrumentation.record_cache(hits=len(result), misses=len(misses))
+
+    if misses:
+        found = dict(PersonEmail.objects.filter(email__in=misses)
+                     .values_list('email', 'stub'))
+        for email in misses:
+            result[email] = found.get(email)
+            _cache.set(email, result[email])
+
+    return result
+
+
+def resolve_one(email):
+    return resolve([email]).get(normalize(email))
+
+
+def sync_person(person_id, email, stub):
+    """
+        records a person's current address and stub, expiring the cached
+        lookups when either changed
+    """
+    email = normalize(email)
+    current = PersonEmail.objects.filter(person=person_id) \
+        .values_list('email', 'stub').first()
+    if current == (email, stub) or \
+            (current is None and not (email and stub)):
+        return
+
+    PersonEmail.objects.filter(person=person_id).delete()
+    if email and stub:
+        _record(person_id, email, stub)
+    if current is not None and current[0] != email:
+        release(current[0])
+    else:
+        expire()
@@ -0,0 +1,158 @@
+"""
+Streaming exports of a group of people and of the thanks.
+
+Only the ordered list of person ids is held in memory; the rows are
+fetched chunk by chunk while the response is being written, so memory
+stays flat and the first bytes go out before the whole group is read.
+The thanks are read in (date_added, id) order a chunk at a time, each
+chunk starting after the last row of the previous one, so exporting the
+whole history never holds more than a chunk either.
+"""
+import csv
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.encoding import force_bytes
+
+from core.models import Person
+from core.taggit.models import TaggedItem
+from staff_directory import tag_index
+from staff_directory.helpers import STAFF_DIR_TAG_CATEGORIES
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'STAFF_DIR_EXPORT_CHUNK_SIZE', 500)
+
+# legacy "; " separated list of emails
+EMAILS_FORMAT = 'csv'
+# one row per person with name, email, office and tags
+PEOPLE_CSV_FORMAT = 'people_csv'
+
+PEOPLE_CSV_COLUMNS = ['name', 'email', 'office', 'tags']
+
+PRAISE_CSV_COLUMNS = ['date_added', 'recipient', 'praise_nominator',
+                      'cfpb_value', 'reason']
+
+
+class _Echo(object):
+    """
+        file-like object handing csv.writer rows straight back
+    """
+    def write(self, value):
+        return value
+
+
+def _chunked_ids(people):
+    ids = list(people.values_list('pk', flat=True))
+    for start in range(0, len(ids), EXPORT_CHUNK_SIZE):
+        yield ids[start:start + EXPORT_CHUNK_SIZE]
+
+
+def _in_order(ids, rows):
+    by_id = dict((row[0], row) for row in rows)
+    return [by_id[pk] for pk in ids if pk in by_id]
+
+
+def iter_emails(people):
+    separator = ''
+    for ids in _chunked_ids(people):
+        rows = Person.objects.filter(pk__in=ids) \
+            .values_list('pk', 'user__email')
+        for pk, email in _in_order(ids, rows):
+            yield separator + force_bytes(email)
+            separator = '; '
+
+
+def _tags_by_person(ids):
+    tags = dict((pk, []) for pk in ids)
+    rows = TaggedItem.objects.filter(
+        content_type=tag_index.person_content_type(),
+        object_id__in=ids,
+        tag_category__slug__in=STAFF_DIR_TAG_CATEGORIES) \
+        .order_by('tag__name').values_list('object_id', 'tag__name')
+    for pk, name in rows:
+        if name not in tags[pk]:
+            tags[pk].append(name)
+    return tags
+
+
+def iter_people_csv(people):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(PEOPLE_CSV_COLUMNS)
+    for ids in _chunked_ids(people):
+        rows = Person.objects.filter(pk__in=ids).values_list(
+            'pk', 'user__first_name', 'user__last_name', 'user__email',
+            'org_group__title')
+        tags = _tags_by_person(ids)
+        for pk, first_name, last_name, email, office in _in_order(ids, rows):
+            yield writer.writerow([
+                force_bytes(u'%s %s' % (first_name, last_name)),
+                force_bytes(email),
+                force_bytes(office or ''),
+                force_bytes(', '.join(tags[pk])),
+            ])
+
+
+def export_response(people, format, filename='people'):
+    """
+        streams people in the requested export format
+    """
+    if format == PEOPLE_CSV_FORMAT:
+        response = StreamingHttpResponse(iter_people_csv(people),
+                                         content_type='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename="%s.csv"' % filename
+        return response
+    return StreamingHttpResponse(iter_emails(people))
+
+
+def filter_praise(praise, since=None, until=None, cfpb_value=None):
+    """
+        the thanks given from since until before until with cfpb_value,
+        each when given
+    """
+    if since is not None:
+        praise = praise.filter(date_added__gte=since)
+    if until is not None:
+        praise = praise.filter(date_added__lt=until)
+    if cfpb_value:
+        praise = praise.filter(cfpb_value=cfpb_value)
+    return praise
+
+
+def _praise_rows(praise):
+    rows = praise.order_by('date_added', 'pk').values_list(
+        'pk', 'date_added', 'recipient__user__first_name',
+        'recipient__user__last_name', 'praise_nominator__first_name',
+        'praise_nominator__last_name', 'cfpb_value', 'reason')
+    chunk = list(rows[:EXPORT_CHUNK_SIZE])
+    while chunk:
+        for row in chunk:
+            yield row
+        if len(chunk) < EXPORT_CHUNK_SIZE:
+            return
+        pk, date_added = chunk[-1][:2]
+        chunk = list(rows.filter(
+            Q(date_added__gt=date_added) | Q(date_added=date_added, pk__gt=pk))
+            [:EXPORT_CHUNK_SIZE])
+
+
+def iter_praise_csv(praise):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(PRAISE_CSV_COLUMNS)
+    for (pk, date_added, recipient_first, recipient_last, nominator_first,
+         nominator_last, value, reason) in _praise_rows(praise):
+        yield writer.writerow([
+            force_bytes(date_added),
+            force_bytes(u'%s %s' % (recipient_first, recipient_last)),
+            force_bytes(u'%s %s' % (nominator_first, nominator_last)),
+            force_bytes(value),
+            force_bytes(reason),
+        ])
+
+
+def praise_csv_response(praise, filename='thanks'):
+    response = StreamingHttpResponse(iter_praise_csv(praise),
+                                     content_type='text/csv')
+    response['Content-Disposition'] = \
+        'attachment; filename="%s.csv"' % filename
+    return response
@@ -1,7 +1,9 @@
+from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Count
 
 from core.models import Person
-from core.taggit.models import Tag
+from core.taggit.models import Tag, TaggedItem
+from staff_directory import tag_index
 
 STAFF_DIR_TAG_CATEGORIES = ['staff-directory-my-expertise',
                             'staff-directory-my-projects',
@@ -13,31 +15,48 @@ def _apply_profile_filters(queryset):
     .order_by('user__last_name', 'user__first_name') \
     .select_related('user')
 
-def _set_remove_tag_permission(req, person, tags):
-    user = person.user
-    for tag in tags:
-        for taggeditem in tag.taggit_taggeditem_items.all():
-            tag.can_remove = user.id == req.user.id or \
-                req.user == taggeditem.tag_creator
+def _query_profile_tags(req, person):
+    """
+        loads the person's tags for every staff directory category in a
+        single query, returning a dict of category slug -> list of tags with
+        tag_count, can_remove and taggers already set
+    """
+    items = TaggedItem.objects.filter(
+        content_type=tag_index.person_content_type(),
+        object_id=person.id,
+        tag_category__slug__in=STAFF_DIR_TAG_CATEGORIES) \
+        .select_related('tag', 'tag_category', 'tag_creator',
+                        'tag_creator__person') \
+        .order_by('id')
+
+    is_owner = person.user_id == req.user.id
+    tags = dict((slug, {}) for slug in STAFF_DIR_TAG_CATEGORIES)
+    for item in items:
+        category_tags = tags[item.tag_category.slug]
+        tag = category_tags.get(item.tag_id)
+        if tag is None:
+            tag = category_tags[item.tag_id] = item.tag
+            tag.tag_count = 0
+            tag.can_remove = is_owner
+            tag.tagger_names = []
+        tag.tag_count += 1
+        if item.tag_creator_id is not None:
+            tag.can_remove = tag.can_remove or \
+                item.tag_creator_id == req.user.id
+            try:
+                tag.tagger_names.append(item.tag_creator.person.full_name)
+            except ObjectDoesNotExist:
+                # the tagger has no profile any more
+                pass
+
+    for slug, category_tags in tags.items():
+        for tag in category_tags.values():
+            tag.taggers = ", ".join(tag.tagger_names)
+        tags[slug] = sorted(category_tags.values(),
+                            key=lambda t: (-t.tag_count, t.name))
     return tags
 
 
-def _set_taggers(req, person, tags, slug):
-    for tag in tags:
-        tag.taggers = ", ".join([user.person.full_name for user in
-                                 tag.taggers(slug, person.id, 'person')])
-    return tags
-
-
-def _query_profile_tags(req, slug, profile_id):
-    return Tag.objects.filter(
-        taggit_taggeditem_items__tag_category__slug=slug,
-        taggit_taggeditem_items__object_id=profile_id,
-        taggit_taggeditem_items__content_type__name='person').annotate(
-            tag_count=Count('taggit_taggeditem_items')) \
-        .order_by('-tag_count', 'name')
-
-
 def _query_tags_for_people(people):
     tags = dict()
     for category in STAFF_DIR_TAG_CATEGORIES:
@@ -50,24 +69,26 @@ def _query_tags_for_people(people):
     return tags
 
 
-def _get_emails_for_tag(tags):
-    emails = []
+def _get_people_for_tag(tags):
+    """
+        active people carrying every tag slug in tags
+    """
+    people = Person.objects.filter(user__is_active=True) \
+        .order_by('user__last_name')
 
     if len(tags) == 0:
-        return emails
+        return people.none()
 
-    selected_tag_pks = Tag.objects.filter(
-        slug__in=tags).values_list('pk', flat=True)
-    if selected_tag_pks.count() == 0:
-        return emails
+    selected_tag_pks = list(Tag.objects.filter(
+        slug__in=tags).values_list('pk', flat=True))
+    if len(selected_tag_pks) == 0:
+        return people.none()
+
+    return tag_index.filter_people(people, all_of=selected_tag_pks)
 
-    people = Person.objects.filter(user__is_active=True) \
-        .order_by('user__last_name')
-    for pk in selected_tag_pks:
-        people = people.filter(tags__pk=pk).distinct()
 
-    emails = people.values_list('user__email', flat=True)
-    return emails
+def _get_emails_for_tag(tags):
+    return _get_people_for_tag(tags).values_list('user__email', flat=True)
 
 
 def _get_emails_for_people(people):
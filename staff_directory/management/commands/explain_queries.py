@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from staff_directory.benchmarks import harness, plans
+
+
+class Command(BaseCommand):
+    help = ('Explains the queries of the staff directory views against the '
+            'data made by generate_benchmark_data and flags full table '
+            'scans and sorts without an index.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--view', action='append', dest='views',
+                    choices=harness.VIEWS,
+                    help='Only explain this view, can be repeated.'),
+        make_option('--allow', action='append', dest='allowed', default=[],
+                    help='Table allowed to be scanned, can be repeated.'),
+        make_option('--show-plans', action='store_true', default=False,
+                    help='Print the plan of every query.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            results = plans.audit(
+                options['views'] or harness.VIEWS,
+                plans.ALLOWED_SCANS + tuple(options['allowed']))
+        except harness.BenchmarkError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(plans.format_report(results,
+                                              options['show_plans']))
+
+        flagged = sum(1 for queries in results.values()
+                      for query in queries if query['issues'])
+        if flagged:
+            raise CommandError('%d queries scan a table or sort without an '
+                               'index.' % flagged)
@@ -0,0 +1,51 @@
+from datetime import datetime, time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from staff_directory import export
+from staff_directory.models import NOUN, Praise
+
+
+def _start_of(value, option):
+    day = parse_date(value)
+    if day is None:
+        raise CommandError('%s must be a date like 2014-01-31.' % option)
+    start = datetime.combine(day, time())
+    if settings.USE_TZ:
+        start = timezone.make_aware(start, timezone.get_current_timezone())
+    return start
+
+
+class Command(BaseCommand):
+    help = 'Writes the thanks as CSV, a chunk at a time.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--since',
+                    help='Only thanks given on or after this date.'),
+        make_option('--until',
+                    help='Only thanks given before this date.'),
+        make_option('--value', choices=sorted(NOUN),
+                    help='Only thanks for this value.'),
+        make_option('--output',
+                    help='File to write, standard output by default.'),
+    )
+
+    def handle(self, *args, **options):
+        praise = export.filter_praise(
+            Praise.objects.all(),
+            options['since'] and _start_of(options['since'], '--since'),
+            options['until'] and _start_of(options['until'], '--until'),
+            options['value'])
+
+        out = open(options['output'], 'wb') if options['output'] \
+            else self.stdout
+        try:
+            for row in export.iter_praise_csv(praise):
+                out.write(row)
+        finally:
+            if options['output']:
+                out.close()
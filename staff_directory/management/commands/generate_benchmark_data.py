@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from staff_directory.benchmarks import data
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with a deterministic synthetic staff '
+            'directory for run_benchmarks.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--people', type='int', default=data.DEFAULTS['people']),
+        make_option('--divisions', type='int',
+                    default=data.DEFAULTS['divisions']),
+        make_option('--offices', type='int', default=data.DEFAULTS['offices'],
+                    help='Number of offices in each division.'),
+        make_option('--tags', type='int', default=data.DEFAULTS['tags']),
+        make_option('--tagged-items', type='int',
+                    default=data.DEFAULTS['tagged_items']),
+        make_option('--praise', type='int', default=data.DEFAULTS['praise']),
+        make_option('--seed', type='int', default=0),
+        make_option('--clear', action='store_true', default=False,
+                    help='Delete previously generated data first.'),
+        make_option('--delete', action='store_true', default=False,
+                    help='Only delete previously generated data.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['clear'] or options['delete']:
+            data.clear()
+        if options['delete']:
+            return
+        created = data.generate(
+            seed=options['seed'],
+            **dict((name, options[name]) for name in data.DEFAULTS))
+        self.stdout.write(', '.join('%d %s' % (created[name], name)
+                                    for name in sorted(created)))
@@ -0,0 +1,36 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from staff_directory import outbox
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued staff directory notifications and emails.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=4,
+                    help='Number of notifications sent concurrently.'),
+        make_option('--batch-size', type='int', default=50,
+                    help='Number of notifications claimed at a time.'),
+        make_option('--loop', action='store_true', default=False,
+                    help='Keep polling the queue instead of exiting once '
+                         'it is empty.'),
+        make_option('--interval', type='float', default=5,
+                    help='Seconds to wait between polls of an empty queue '
+                         'with --loop.'),
+    )
+
+    def handle(self, *args, **options):
+        sent = 0
+        while True:
+            claimed = outbox.process_batch(options['batch_size'],
+                                           options['threads'])
+            sent += claimed
+            if claimed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write('Processed %d queued notifications.' % sent)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from staff_directory import praise_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the staff thanks statistics from the thanks given.'
+
+    def handle(self, *args, **options):
+        total = praise_stats.rebuild()
+        self.stdout.write('Counted %d staff thanks.' % total)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from staff_directory import tag_cooccurrence
+
+
+class Command(BaseCommand):
+    help = ('Recounts the staff directory tag co-occurrence matrix from the '
+            'tagged items.')
+
+    def handle(self, *args, **options):
+        rows = tag_cooccurrence.rebuild()
+        self.stdout.write('Rebuilt %d tag co-occurrence rows.' % rows)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from staff_directory import tag_counts
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the staff directory tag counts from the tagged items.'
+
+    def handle(self, *args, **options):
+        rows = tag_counts.rebuild()
+        self.stdout.write('Rebuilt %d tag counts.' % rows)
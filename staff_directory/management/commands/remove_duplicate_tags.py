@@ -0,0 +1,39 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from core.taggit.models import TaggedItem
+from staff_directory import tagging
+
+DELETE_CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ('Deletes the tagged items repeating a tag a person already '
+            'carries in the same category, keeping the first of each, as '
+            'migration 0011 requires.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', default=False,
+                    help='Only list the tagged items that would be deleted.'),
+    )
+
+    def handle(self, *args, **options):
+        duplicates = tagging.duplicate_items()
+        for start in range(0, len(duplicates), DELETE_CHUNK_SIZE):
+            items = TaggedItem.objects.filter(
+                pk__in=duplicates[start:start + DELETE_CHUNK_SIZE]) \
+                .select_related('tag', 'tag_category')
+            for item in items:
+                self.stdout.write(
+                    'Tagged item %d repeats tag "%s" in %s on person %d.' % (
+                        item.pk, item.tag.name,
+                        item.tag_category.slug if item.tag_category_id
+                        else 'no category', item.object_id))
+            if not options['dry_run']:
+                # the receivers update the counts, the matrix, the tag
+                # index and the pages for each item
+                items.delete()
+
+        self.stdout.write('%s %d duplicate tagged items.' % (
+            'Found' if options['dry_run'] else 'Deleted', len(duplicates)))
@@ -0,0 +1,47 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from staff_directory.benchmarks import harness
+
+
+class Command(BaseCommand):
+    help = ('Times the staff directory views against the data made by '
+            'generate_benchmark_data.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--runs', type='int', default=20,
+                    help='Timed requests per view.'),
+        make_option('--view', action='append', dest='views',
+                    choices=harness.VIEWS,
+                    help='Only time this view, can be repeated.'),
+        make_option('--baseline',
+                    help='JSON baseline to compare the results with.'),
+        make_option('--save-baseline',
+                    help='Write the results as a JSON baseline.'),
+        make_option('--tolerance', type='float', default=0.25,
+                    help='Allowed p95 slowdown and peak memory growth '
+                         'against the baseline.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            results = harness.run(options['runs'],
+                                  options['views'] or harness.VIEWS)
+        except harness.BenchmarkError as e:
+            raise CommandError(str(e))
+
+        baseline = None
+        if options['baseline']:
+            baseline = harness.load_baseline(options['baseline'])
+        self.stdout.write(harness.format_report(results, baseline))
+
+        if options['save_baseline']:
+            harness.save_baseline(options['save_baseline'], results)
+
+        if baseline is not None:
+            regressions = harness.compare(results, baseline,
+                                          options['tolerance'])
+            if regressions:
+                raise CommandError('Worse than the baseline:\n' +
+                                   '\n'.join(regressions))
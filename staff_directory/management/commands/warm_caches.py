@@ -0,0 +1,45 @@
+from optparse import make_option
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from staff_directory import warming
+
+
+class Command(BaseCommand):
+    help = ('Renders the directory index, every division and office page '
+            'and the most popular tag pages so their caches are warm.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=warming.WARM_THREADS,
+                    help='Number of pages rendered concurrently.'),
+        make_option('--rate', type='float', default=warming.WARM_RATE,
+                    help='Most pages rendered a second, 0 for no limit.'),
+        make_option('--tags', type='int', default=warming.WARM_TAGS,
+                    help='Number of the most popular tag pages to warm.'),
+        make_option('--username',
+                    help='User the pages are rendered as, by default the '
+                         'first active user without staff or superuser '
+                         'rights.'),
+    )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['username']:
+            try:
+                user = get_user_model().objects.get(
+                    username=options['username'])
+            except get_user_model().DoesNotExist:
+                raise CommandError('No user %s.' % options['username'])
+
+        try:
+            result = warming.warm(user, options['threads'], options['rate'],
+                                  options['tags'])
+        except warming.WarmingError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('Warmed %d pages in %.1f seconds.' % (
+            result['pages'], result['seconds']))
+        if result['failed']:
+            raise CommandError('Could not warm:\n' + '\n'.join(
+                '%s returned %s' % failure for failure in result['failed']))
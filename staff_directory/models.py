@@ -1,8 +1,10 @@
 from collab.settings import AUTH_USER_MODEL
+from django.conf import settings
+from django.contrib.contenttypes import generic
+from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 from django.db import models
 
-from core.notifications.models import Notification
 from core.notifications.email import EmailInfo
 
 NOUN = {
@@ -19,9 +21,13 @@ class Praise(models.Model):
     reason = models.TextField()
     date_added = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # keyset pagination of the thanks list and a profile's thanks,
+        # newest first
+        index_together = [['date_added', 'id'], ['recipient', 'date_added']]
+
     def save(self, *args, **kwargs):
 
-        url = reverse('staff_directory:show_thanks', args=())
         email_info = EmailInfo(
             subject="You were thanked in the staff directory!",
             text_template='staff_directory/email/user_thanked.txt',
@@ -34,8 +40,231 @@ class Praise(models.Model):
         title ="%s thanked you for %s" %\
             (self.praise_nominator.person.full_name,
                 NOUN[self.cfpb_value])
-        Notification.set_notification(self.praise_nominator,
+
+        # saved first so the queued notification can point at the praise
+        saved = super(Praise, self).save(*args, **kwargs)
+        QueuedNotification.objects.enqueue(self.praise_nominator,
             self.praise_nominator, "thanked", self, self.recipient.user,
                 title, url, email_info)
 
-        return super(Praise, self).save(*args, **kwargs)
+        return saved
+
+
+class QueuedNotificationManager(models.Manager):
+
+    def build(self, from_user, owner, verb, target, to_user, title, url,
+              email_info=None):
+        """
+            an unsaved queue entry for the arguments of
+            Notification.set_notification
+        """
+        notification = self.model(from_user=from_user, owner=owner,
+                                  verb=verb, to_user=to_user, title=title,
+                                  url=url)
+        if isinstance(target, models.Model):
+            notification.target_content_type = \
+                ContentType.objects.get_for_model(target)
+            notification.target_object_id = target.pk
+        else:
+            notification.target_text = target or ''
+        if email_info is not None:
+            notification.email_subject = email_info.subject
+            notification.email_text_template = email_info.text_template
+            notification.email_html_template = email_info.html_template
+            notification.email_to_address = email_info.to_address or ''
+        return notification
+
+    def enqueue(self, *args, **kwargs):
+        notification = self.build(*args, **kwargs)
+        notification.save()
+        self._send_if_eager()
+        return notification
+
+    def enqueue_many(self, notifications):
+        """
+            queues entries made by build() with a single insert
+        """
+        if notifications:
+            self.bulk_create(notifications)
+            self._send_if_eager()
+
+    def _send_if_eager(self):
+        if getattr(settings, 'STAFF_DIR_NOTIFICATIONS_EAGER', False):
+            from staff_directory import outbox
+            outbox.drain()
+
+
+class QueuedNotification(models.Model):
+    """
+        a notification waiting to be handed to
+        Notification.set_notification by the process_notification_queue
+        worker, so rendering and sending its email stays out of the request
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    from_user = models.ForeignKey(AUTH_USER_MODEL, related_name='+')
+    owner = models.ForeignKey(AUTH_USER_MODEL, related_name='+')
+    verb = models.CharField(max_length=50)
+    target_text = models.CharField(max_length=255, blank=True)
+    target_content_type = models.ForeignKey(ContentType, null=True,
+                                            blank=True)
+    target_object_id = models.PositiveIntegerField(null=True, blank=True)
+    target = generic.GenericForeignKey('target_content_type',
+                                       'target_object_id')
+    to_user = models.ForeignKey(AUTH_USER_MODEL, related_name='+')
+    title = models.TextField()
+    url = models.CharField(max_length=255)
+    email_subject = models.CharField(max_length=255, blank=True)
+    email_text_template = models.CharField(max_length=255, blank=True)
+    email_html_template = models.CharField(max_length=255, blank=True)
+    email_to_address = models.CharField(max_length=254, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+                              default=PENDING)
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = QueuedNotificationManager()
+
+    class Meta:
+        # the worker polls pending entries in id order
+        index_together = [['status', 'id']]
+
+    def __unicode__(self):
+        return u'%s %s (%s)' % (self.verb, self.to_user_id, self.status)
+
+    def email_info(self):
+        if not self.email_subject:
+            return None
+        return EmailInfo(
+            subject=self.email_subject,
+            text_template=self.email_text_template,
+            html_template=self.email_html_template,
+            to_address=self.email_to_address,
+        )
+
+
+class TagCount(models.Model):
+    """
+        number of people tagged with a tag in a category, kept current by
+        the receivers on TaggedItem writes so the tag cloud can be read
+        without aggregating the tagged items
+    """
+    tag = models.ForeignKey('taggit.Tag',
+                            related_name='staff_directory_counts')
+    tag_category = models.ForeignKey('taggit.TagCategory', null=True)
+    count = models.IntegerField(default=0, db_index=True)
+
+    class Meta:
+        unique_together = ('tag', 'tag_category')
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.tag_id, self.count)
+
+
+class TagCooccurrence(models.Model):
+    """
+        number of people carrying both tag and other_tag, stored in both
+        directions so the tags related to a tag are one indexed lookup of
+        its row
+    """
+    tag = models.ForeignKey('taggit.Tag',
+                            related_name='staff_directory_cooccurrences')
+    other_tag = models.ForeignKey('taggit.Tag', related_name='+')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('tag', 'other_tag')
+        index_together = [['tag', 'count']]
+
+    def __unicode__(self):
+        return u'%s & %s: %s' % (self.tag_id, self.other_tag_id, self.count)
+
+
+class OrgGroupClosure(models.Model):
+    """
+        one row per (ancestor, descendant) pair of the org group hierarchy,
+        including each group paired with itself at depth 0, rebuilt by the
+        receivers whenever an OrgGroup changes
+    """
+    ancestor = models.ForeignKey('core.OrgGroup',
+                                 related_name='staff_directory_descendants')
+    descendant = models.ForeignKey('core.OrgGroup',
+                                   related_name='staff_directory_ancestors')
+    depth = models.IntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+    def __unicode__(self):
+        return u'%s > %s' % (self.ancestor_id, self.descendant_id)
+
+
+class PraiseCount(models.Model):
+    """
+        number of thanks given for a value in a month to people of an org
+        group, kept current by the receivers on Praise writes.  per value,
+        per office and per month totals are sums over these few rows
+    """
+    period = models.DateField()
+    cfpb_value = models.CharField(max_length=100)
+    org_group = models.ForeignKey('core.OrgGroup', null=True,
+                                  on_delete=models.SET_NULL,
+                                  related_name='staff_directory_praise_counts')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('period', 'cfpb_value', 'org_group')
+
+    def __unicode__(self):
+        return u'%s %s %s: %s' % (self.period, self.cfpb_value,
+                                  self.org_group_id, self.count)
+
+
+class PraiseRecipientCount(models.Model):
+    """
+        number of thanks a person received for a value, for the top
+        recipients leaderboard
+    """
+    recipient = models.ForeignKey('core.Person',
+                                  related_name='staff_directory_praise_counts')
+    cfpb_value = models.CharField(max_length=100)
+    count = models.IntegerField(default=0, db_index=True)
+
+    class Meta:
+        unique_together = ('recipient', 'cfpb_value')
+
+    def __unicode__(self):
+        return u'%s %s: %s' % (self.recipient_id, self.cfpb_value,
+                               self.count)
+
+
+class PersonEmail(models.Model):
+    """
+        a person's lower cased email address and stub, kept current by the
+        receivers so email lookups are an exact match on a unique index
+        instead of a case insensitive scan of the users
+    """
+    person = models.OneToOneField('core.Person',
+                                  related_name='staff_directory_email')
+    email = models.CharField(max_length=254, unique=True)
+    stub = models.CharField(max_length=128)
+
+    def __unicode__(self):
+        return self.email
+
+
+# connect the signal receivers once the models are loaded
+import staff_directory.receivers
@@ -0,0 +1,103 @@
+"""
+The org group hierarchy, kept as a closure table and as an in-memory tree.
+
+OrgGroupClosure lets a division page find the offices below it, at any
+depth, with one indexed lookup.  The tree resolves page titles and slugs to
+org groups without touching the database; each process keeps its own copy
+and reloads it when the shared version is expired by an OrgGroup change.
+"""
+from cache_tools.tools import expire_cache_group, get_group_key
+from django.db import transaction
+from django.template.defaultfilters import slugify
+
+from core.models import OrgGroup
+from staff_directory.models import OrgGroupClosure
+
+ORG_TREE_GROUP = 'staff_dir_org_tree'
+
+_tree = {'version': None}
+
+
+def rebuild_closure():
+    """
+        recomputes the closure table, returns the number of rows written
+    """
+    parents = dict(OrgGroup.objects.values_list('pk', 'parent_id'))
+    rows = []
+    for pk in parents:
+        ancestor, depth, seen = pk, 0, set()
+        while ancestor is not None and ancestor not in seen:
+            seen.add(ancestor)
+            rows.append(OrgGroupClosure(ancestor_id=ancestor,
+                                        descendant_id=pk, depth=depth))
+            ancestor, depth = parents.get(ancestor), depth + 1
+
+    with transaction.atomic():
+        OrgGroupClosure.objects.all().delete()
+        OrgGroupClosure.objects.bulk_create(rows)
+    return len(rows)
+
+
+def expire():
+    rebuild_closure()
+    expire_cache_group(ORG_TREE_GROUP)
+
+
+def _load():
+    groups = dict((group.pk, group) for group in
+                  OrgGroup.objects.select_related('parent').order_by('pk'))
+    links = list(OrgGroupClosure.objects.values_list('ancestor_id',
+                                                     'descendant_id'))
+    if groups and not links:
+        rebuild_closure()
+        links = list(OrgGroupClosure.objects.values_list('ancestor_id',
+                                                         'descendant_id'))
+
+    descendants = dict((pk, []) for pk in groups)
+    for ancestor_id, descendant_id in links:
+        if ancestor_id in descendants:
+            descendants[ancestor_id].append(descendant_id)
+
+    by_title, by_slug = {}, {}
+    for group in groups.values():
+        by_title.setdefault(group.title, group)
+        by_slug.setdefault(slugify(group.title), group)
+
+    return {'groups': groups, 'descendants': descendants,
+            'by_title': by_title, 'by_slug': by_slug}
+
+
+def get_tree():
+    version = get_group_key(ORG_TREE_GROUP)
+    if _tree['version'] != version:
+        _tree.update(_load())
+        _tree['version'] = version
+    return _tree
+
+
+def get_by_title(title):
+    """
+        the org group with this title or slug, None if there is none
+    """
+    tree = get_tree()
+    return tree['by_title'].get(title) or tree['by_slug'].get(slugify(title))
+
+
+def descendant_ids(org_group_id):
+    """
+        ids of the org group and every group below it
+    """
+    return get_tree()['descendants'].get(org_group_id, [org_group_id])
+
+
+def ancestor_ids(org_group_id):
+    """
+        ids of the org group and every group above it
+    """
+    groups = get_tree()['groups']
+    ids = []
+    while org_group_id is not None and org_group_id not in ids:
+        ids.append(org_group_id)
+        group = groups.get(org_group_id)
+        org_group_id = group.parent_id if group else None
+    return ids
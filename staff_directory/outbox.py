@@ -0,0 +1,134 @@
+"""
+Dispatch of the QueuedNotification outbox.
+
+Views and models only enqueue; ``process_batch`` claims pending entries
+and hands each to Notification.set_notification on a thread pool.  It is
+run by the ``process_notification_queue`` command, and ``drain`` empties
+the queue synchronously for tests and for STAFF_DIR_NOTIFICATIONS_EAGER.
+Entries claimed by a worker that died before sending them are pending
+again once their claim is STAFF_DIR_NOTIFICATION_CLAIM_TIMEOUT seconds
+old.
+"""
+import logging
+import uuid
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from core.notifications.models import Notification
+from staff_directory.models import QueuedNotification
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'STAFF_DIR_NOTIFICATION_MAX_ATTEMPTS', 5)
+CLAIM_TIMEOUT = getattr(settings, 'STAFF_DIR_NOTIFICATION_CLAIM_TIMEOUT',
+                        60 * 10)
+
+
+def release_stale_claims():
+    """
+        makes the entries claimed more than CLAIM_TIMEOUT seconds ago
+        pending again, returns how many there were
+    """
+    cutoff = timezone.now() - timedelta(seconds=CLAIM_TIMEOUT)
+    # entries claimed before claimed_at was recorded have none
+    return QueuedNotification.objects.filter(
+        Q(claimed_at__lt=cutoff) | Q(claimed_at__isnull=True),
+        status=QueuedNotification.SENDING) \
+        .update(status=QueuedNotification.PENDING, claim_token='',
+                claimed_at=None)
+
+
+def claim_batch(batch_size):
+    """
+        marks up to batch_size pending entries as sending for this worker
+        and returns them; concurrent workers never claim the same entry
+    """
+    released = release_stale_claims()
+    if released:
+        logger.warning('Released %s stale queued notification claims',
+                       released)
+    ids = list(QueuedNotification.objects
+               .filter(status=QueuedNotification.PENDING)
+               .order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+
+    token = uuid.uuid4().hex
+    QueuedNotification.objects.filter(
+        pk__in=ids, status=QueuedNotification.PENDING) \
+        .update(status=QueuedNotification.SENDING, claim_token=token,
+                claimed_at=timezone.now())
+    return list(QueuedNotification.objects.filter(claim_token=token)
+                .select_related('from_user', 'owner', 'to_user')
+                .order_by('id'))
+
+
+def dispatch(notification):
+    """
+        sends one claimed entry, returns True when it was delivered
+    """
+    try:
+        target = notification.target if notification.target_content_type_id \
+            else notification.target_text
+        Notification.set_notification(
+            notification.from_user, notification.owner, notification.verb,
+            target, notification.to_user, notification.title,
+            notification.url, notification.email_info())
+    except Exception as e:
+        logger.exception('Could not send queued notification %s',
+                         notification.pk)
+        attempts = notification.attempts + 1
+        status = QueuedNotification.PENDING if attempts < MAX_ATTEMPTS \
+            else QueuedNotification.FAILED
+        QueuedNotification.objects.filter(pk=notification.pk).update(
+            status=status, attempts=attempts, last_error=repr(e),
+            claim_token='')
+        return False
+
+    QueuedNotification.objects.filter(pk=notification.pk).update(
+        status=QueuedNotification.SENT, sent_at=timezone.now(),
+        claim_token='')
+    return True
+
+
+def _dispatch_in_thread(notification):
+    try:
+        return dispatch(notification)
+    finally:
+        # each pool thread opens its own connection
+        connection.close()
+
+
+def process_batch(batch_size=50, threads=1):
+    """
+        claims and sends one batch, returns the number of entries claimed
+    """
+    batch = claim_batch(batch_size)
+    if threads > 1 and len(batch) > 1:
+        pool = ThreadPool(min(threads, len(batch)))
+        try:
+            pool.map(_dispatch_in_thread, batch)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for notification in batch:
+            dispatch(notification)
+    return len(batch)
+
+
+def drain(batch_size=50):
+    """
+        sends everything pending in this thread, in queue order
+    """
+    total = 0
+    while True:
+        claimed = process_batch(batch_size)
+        if not claimed:
+            return total
+        total += claimed
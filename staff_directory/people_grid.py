@@ -0,0 +1,74 @@
+"""
+Page by page loading of the people grid of org group and tag pages.
+
+A group page renders only the first page of its people; the rest is
+fetched as JSON by "load more" as the reader scrolls.  Pages are ordered
+by last name, first name and id and continue from a cursor holding the
+last of those seen, so each page is one indexed range read no matter how
+deep into a division it is, and only the columns shown are selected.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+from core.models import Person
+
+PEOPLE_PAGE_SIZE = getattr(settings, 'STAFF_DIR_PEOPLE_PAGE_SIZE', 60)
+
+# page of people as JSON, on the URL of the group page itself
+PEOPLE_JSON_FORMAT = 'people_json'
+
+ORDER = ('user__last_name', 'user__first_name', 'pk')
+FIELDS = ORDER + ('stub', 'photo_file')
+
+
+def encode_cursor(last_name, first_name, pk):
+    return base64.urlsafe_b64encode(
+        json.dumps([last_name, first_name, pk]))
+
+
+def decode_cursor(cursor):
+    """
+        the (last name, first name, id) of a cursor, ValueError when it
+        was not made by encode_cursor
+    """
+    try:
+        last_name, first_name, pk = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor %r' % cursor)
+    if not isinstance(pk, int):
+        raise ValueError('invalid cursor %r' % cursor)
+    return last_name, first_name, pk
+
+
+def _after(last_name, first_name, pk):
+    return Q(user__last_name__gt=last_name) | \
+        Q(user__last_name=last_name, user__first_name__gt=first_name) | \
+        Q(user__last_name=last_name, user__first_name=first_name, pk__gt=pk)
+
+
+def _photo_url(name):
+    # an unsaved instance gives the thumbnail urls of the stored name
+    return Person(photo_file=name).photo_file.url_125x125
+
+
+def page(people, cursor=None, size=PEOPLE_PAGE_SIZE):
+    """
+        the size people of the people queryset following cursor, as a JSON
+        ready dict with the cursor of the next page, None on the last one
+    """
+    if cursor:
+        people = people.filter(_after(*decode_cursor(cursor)))
+    rows = list(people.order_by(*ORDER).values_list(*FIELDS)[:size + 1])
+
+    entries = [
+        {'stub': stub, 'first_name': first_name, 'last_name': last_name,
+         'photo_url': _photo_url(photo_file)}
+        for last_name, first_name, pk, stub, photo_file in rows[:size]]
+    next_cursor = None
+    if len(rows) > size:
+        next_cursor = encode_cursor(*rows[size - 1][:3])
+    return {'people': entries, 'next': next_cursor}
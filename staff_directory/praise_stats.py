@@ -0,0 +1,162 @@
+"""
+Rollups of staff thanks for the stats page.
+
+PraiseCount keeps one row per month, value and org group of the recipient,
+and PraiseRecipientCount one row per recipient and value.  The receivers
+adjust them inside the transaction of each Praise write, and ``rebuild``
+recomputes both from the Praise table for the ``rebuild_praise_stats``
+management command.  A thanks is counted under the current office of its
+recipient: when a person moves, ``recipient_moved`` moves their thanks to
+the rows of the new office, as a rebuild would.
+"""
+from collections import defaultdict
+from datetime import date
+
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from core.models import Person
+from staff_directory.models import NOUN, Praise, PraiseCount, \
+    PraiseRecipientCount
+
+
+def period(value):
+    """
+        the first day of the month of a datetime
+    """
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return date(value.year, value.month, 1)
+
+
+def praise_key(praise):
+    """
+        what a thanks is counted under: (period, value, current org group
+        id of the recipient, recipient id)
+    """
+    org_group_id = Person.objects.filter(pk=praise.recipient_id) \
+        .values_list('org_group_id', flat=True).first()
+    return (period(praise.date_added), praise.cfpb_value, org_group_id,
+            praise.recipient_id)
+
+
+def _add(model, lookup, delta):
+    updated = model.objects.filter(**lookup).update(count=F('count') + delta)
+    if not updated and delta > 0:
+        row, created = model.objects.get_or_create(
+            defaults={'count': delta}, **lookup)
+        if not created:
+            model.objects.filter(pk=row.pk).update(count=F('count') + delta)
+
+
+def adjust(key, delta):
+    month, value, org_group_id, recipient_id = key
+    _add(PraiseCount, {'period': month, 'cfpb_value': value,
+                       'org_group': org_group_id}, delta)
+    _add(PraiseRecipientCount, {'recipient': recipient_id,
+                                'cfpb_value': value}, delta)
+
+
+def recipient_moved(recipient_id, old_org_group_id, new_org_group_id):
+    """
+        moves the counts of a person's thanks from their old office to
+        their new one
+    """
+    counts = defaultdict(int)
+    rows = Praise.objects.filter(recipient=recipient_id).order_by() \
+        .values_list('date_added', 'cfpb_value')
+    for date_added, value in rows.iterator():
+        counts[(period(date_added), value)] += 1
+
+    with transaction.atomic():
+        for (month, value), count in counts.items():
+            _add(PraiseCount, {'period': month, 'cfpb_value': value,
+                               'org_group': old_org_group_id}, -count)
+            _add(PraiseCount, {'period': month, 'cfpb_value': value,
+                               'org_group': new_org_group_id}, count)
+
+
+def rebuild():
+    """
+        recomputes both rollups, returns the number of thanks counted
+    """
+    counts = defaultdict(int)
+    recipients = defaultdict(int)
+    total = 0
+    rows = Praise.objects.order_by().values_list(
+        'date_added', 'cfpb_value', 'recipient__org_group', 'recipient')
+    for date_added, value, org_group_id, recipient_id in rows.iterator():
+        counts[(period(date_added), value, org_group_id)] += 1
+        recipients[(recipient_id, value)] += 1
+        total += 1
+
+    with transaction.atomic():
+        PraiseCount.objects.all().delete()
+        PraiseCount.objects.bulk_create([
+            PraiseCount(period=month, cfpb_value=value,
+                        org_group_id=org_group_id, count=count)
+            for (month, value, org_group_id), count in counts.items()])
+        PraiseRecipientCount.objects.all().delete()
+        PraiseRecipientCount.objects.bulk_create([
+            PraiseRecipientCount(recipient_id=recipient_id,
+                                 cfpb_value=value, count=count)
+            for (recipient_id, value), count in recipients.items()])
+    return total
+
+
+def _value_counts(rows):
+    by_value = dict((value, 0) for value in NOUN)
+    for row in rows:
+        by_value[row['cfpb_value']] = \
+            by_value.get(row['cfpb_value'], 0) + row['count']
+    return by_value
+
+
+def stats(since=None, top=10):
+    """
+        totals by value, office and month, from the month of since (a date)
+        on when given, and the top recipients of all time, as a JSON ready
+        dict
+    """
+    counts = PraiseCount.objects.filter(count__gt=0)
+    if since is not None:
+        counts = counts.filter(
+            period__gte=date(since.year, since.month, 1))
+
+    by_value = _value_counts(
+        counts.values('cfpb_value').annotate(count=Sum('count')).order_by())
+
+    by_office = [
+        {'office': row['org_group__title'] or '', 'count': row['count']}
+        for row in counts.values('org_group__title')
+        .annotate(count=Sum('count')).order_by('-count', 'org_group__title')]
+
+    months = defaultdict(list)
+    for row in counts.values('period', 'cfpb_value') \
+            .annotate(count=Sum('count')).order_by():
+        months[row['period']].append(row)
+    by_period = [
+        {'period': month.strftime('%Y-%m'),
+         'count': sum(row['count'] for row in rows),
+         'by_value': _value_counts(rows)}
+        for month, rows in sorted(months.items())]
+
+    leaders = PraiseRecipientCount.objects.filter(count__gt=0) \
+        .exclude(recipient__stub=None) \
+        .values('recipient', 'recipient__stub', 'recipient__user__first_name',
+                'recipient__user__last_name') \
+        .annotate(total=Sum('count')).order_by('-total', 'recipient')[:top]
+    top_recipients = [
+        {'name': ('%s %s' % (row['recipient__user__first_name'],
+                             row['recipient__user__last_name'])).strip(),
+         'stub': row['recipient__stub'],
+         'url': reverse('staff_directory:person',
+                        args=(row['recipient__stub'],)),
+         'count': row['total']}
+        for row in leaders]
+
+    return {'total': sum(by_value.values()), 'by_value': by_value,
+            'by_office': by_office, 'by_period': by_period,
+            'top_recipients': top_recipients}
@@ -0,0 +1,201 @@
+"""
+Signal receivers keeping the staff directory's derived data current when
+the core models it is computed from change.
+"""
+from django.db.models.signals import post_delete, post_save, pre_delete, \
+    pre_save
+from django.dispatch import receiver
+
+from core.models import OrgGroup, Person
+from core.taggit.models import Tag, TaggedItem
+from staff_directory import autocomplete, caching, email_lookup, org_tree, \
+    praise_stats, recent_photos, tag_cooccurrence, tag_counts, tag_index
+from staff_directory.models import Praise
+from staff_directory.thanks import adjust_thanks_count
+
+# get_user_model() cannot be used while the models are still loading
+USER_MODEL = Person._meta.get_field('user').rel.to
+
+
+def _is_person_item(taggeditem):
+    return taggeditem.content_type_id == \
+        tag_index.person_content_type().id
+
+
+def expire_tagged(tag_id, person_ids):
+    """
+        expires the cached data showing who carries the tag.  the receivers
+        run inside the write's transaction, so tagging calls this again
+        once it commits: a request reading in between caches the rows from
+        before the write under the new versions
+    """
+    tag_index.clear(tag_id)
+    caching.expire_people(person_ids, [tag_id])
+
+
+def tagged_items_added(tag_id, tag_category_id, person_ids):
+    """
+        updates the derived data for people newly tagged with one tag in
+        one category; bulk inserts send no signals and call this directly
+    """
+    counted = tag_index.counted_ids(person_ids)
+    if counted:
+        tag_counts.adjust(tag_id, tag_category_id, len(counted))
+        autocomplete.changed(autocomplete.TAG, [tag_id])
+    tag_cooccurrence.tag_added(tag_id, person_ids)
+    expire_tagged(tag_id, person_ids)
+
+
+@receiver(post_save, sender=TaggedItem)
+def tagged_item_saved(sender, instance, created, **kwargs):
+    if created and _is_person_item(instance):
+        tagged_items_added(instance.tag_id, instance.tag_category_id,
+                           [instance.object_id])
+
+
+@receiver(post_delete, sender=TaggedItem)
+def tagged_item_deleted(sender, instance, **kwargs):
+    if _is_person_item(instance):
+        if tag_index.counted_ids([instance.object_id]):
+            tag_counts.adjust(instance.tag_id, instance.tag_category_id, -1)
+            autocomplete.changed(autocomplete.TAG, [instance.tag_id])
+        tag_cooccurrence.tag_removed(instance.tag_id, instance.object_id)
+        expire_tagged(instance.tag_id, [instance.object_id])
+
+
+def counted_changed(person_id, counted):
+    """
+        adds or removes all of a person's tags to the counts when they
+        start or stop being counted, see tag_index.counted_people
+    """
+    delta = 1 if counted else -1
+    # the autocomplete ranks tags by their counts
+    autocomplete.changed(autocomplete.TAG,
+                         tag_counts.person_counted(person_id, delta))
+    tag_cooccurrence.person_counted(person_id, delta)
+
+
+@receiver(pre_save, sender=Person)
+def person_saving(sender, instance, **kwargs):
+    instance._staff_dir_saved_state = None
+    if instance.pk is not None and not kwargs.get('raw'):
+        instance._staff_dir_saved_state = Person.objects \
+            .filter(pk=instance.pk) \
+            .values_list('photo_file', 'hide_profile', 'org_group_id') \
+            .first()
+
+
+@receiver(post_save, sender=Person)
+def person_saved(sender, instance, **kwargs):
+    old_state = getattr(instance, '_staff_dir_saved_state', None)
+    # names and photos are shown on the person's tag and group pages,
+    # including those of the office they moved out of
+    moved_from = [old_state[2]] if old_state is not None and \
+        old_state[2] != instance.org_group_id else []
+    caching.expire_person(instance.pk, org_group_ids=moved_from)
+    autocomplete.changed(autocomplete.PERSON, [instance.pk])
+    # fixtures are loaded raw, the user may not have been loaded yet
+    email, is_active = USER_MODEL.objects.filter(pk=instance.user_id) \
+        .values_list('email', 'is_active').first() or (None, False)
+    email_lookup.sync_person(instance.pk, email, instance.stub)
+    if old_state is not None:
+        if is_active and old_state[1] != instance.hide_profile:
+            counted_changed(instance.pk, not instance.hide_profile)
+        if old_state[2] != instance.org_group_id:
+            praise_stats.recipient_moved(instance.pk, old_state[2],
+                                         instance.org_group_id)
+    photo_state = (instance.photo_file.name, instance.hide_profile)
+    if not kwargs.get('raw') and \
+            (old_state is None or old_state[:2] != photo_state):
+        recent_photos.photo_changed(instance)
+
+
+@receiver(pre_save, sender=USER_MODEL)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    instance._staff_dir_was_active = None
+    if instance.pk is not None and not kwargs.get('raw') and \
+            (update_fields is None or 'is_active' in update_fields):
+        instance._staff_dir_was_active = USER_MODEL.objects \
+            .filter(pk=instance.pk) \
+            .values_list('is_active', flat=True).first()
+
+
+@receiver(post_save, sender=USER_MODEL)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # logins save the user with update_fields=['last_login']
+    if update_fields is not None and set(update_fields) <= set(['last_login']):
+        return
+    was_active = getattr(instance, '_staff_dir_was_active', None)
+    for person in Person.objects.filter(user=instance):
+        person.user = instance
+        if was_active is not None and was_active != instance.is_active \
+                and not person.hide_profile:
+            counted_changed(person.pk, instance.is_active)
+        caching.expire_person(person.pk)
+        autocomplete.changed(autocomplete.PERSON, [person.pk])
+        recent_photos.user_changed(person, was_active is not False)
+        if update_fields is None or 'email' in update_fields:
+            email_lookup.sync_person(person.pk, instance.email, person.stub)
+
+    # the name is also shown on the profiles of the people the user thanked
+    # and tagged
+    shown_on = set(Praise.objects.filter(praise_nominator=instance)
+                   .values_list('recipient_id', flat=True))
+    shown_on.update(TaggedItem.objects.filter(
+        tag_creator=instance, content_type=tag_index.person_content_type())
+        .values_list('object_id', flat=True))
+    caching.expire_groups([caching.person_group(pk) for pk in shown_on])
+
+
+@receiver(pre_delete, sender=Person)
+def person_deleting(sender, instance, **kwargs):
+    # the PersonEmail row is deleted with the person
+    instance._staff_dir_email = email_lookup.recorded_email(instance.pk)
+
+
+@receiver(post_delete, sender=Person)
+def person_deleted(sender, instance, **kwargs):
+    email_lookup.release(getattr(instance, '_staff_dir_email', None))
+    recent_photos.remove(instance.pk)
+    autocomplete.changed(autocomplete.PERSON, [instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    autocomplete.changed(autocomplete.TAG, [instance.pk])
+
+
+@receiver(pre_save, sender=Praise)
+def praise_saving(sender, instance, **kwargs):
+    # an edited thanks moves from the rollup rows it was counted under
+    instance._staff_dir_stats_key = None
+    if instance.pk is not None:
+        old = Praise.objects.filter(pk=instance.pk).first()
+        if old is not None:
+            instance._staff_dir_stats_key = praise_stats.praise_key(old)
+
+
+@receiver(post_save, sender=Praise)
+def praise_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_thanks_count(1)
+    old_key = getattr(instance, '_staff_dir_stats_key', None)
+    if old_key is not None:
+        praise_stats.adjust(old_key, -1)
+    praise_stats.adjust(praise_stats.praise_key(instance), 1)
+    caching.expire_groups([caching.person_group(instance.recipient_id)])
+
+
+@receiver(post_delete, sender=Praise)
+def praise_deleted(sender, instance, **kwargs):
+    adjust_thanks_count(-1)
+    praise_stats.adjust(praise_stats.praise_key(instance), -1)
+    caching.expire_groups([caching.person_group(instance.recipient_id)])
+
+
+@receiver(post_save, sender=OrgGroup)
+@receiver(post_delete, sender=OrgGroup)
+def org_group_changed(sender, instance, **kwargs):
+    org_tree.expire()
+    caching.expire_org_group(instance)
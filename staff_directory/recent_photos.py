@@ -0,0 +1,100 @@
+"""
+Feed of the people whose profile photo changed most recently, shown on the
+directory index.
+
+The feed is a short list of display ready entries kept in the shared cache.
+The receivers move a person to its front when their photo changes, update
+their entry when their name changes and drop them when their photo goes
+back to the default, their profile is hidden or their user is deactivated,
+so the index reads it with one cache get.  When the feed is missing it is
+rebuilt from the most recently updated profiles with a photo.
+"""
+from django.core.cache import cache
+
+from core.models import Person
+from staff_directory import instrumentation
+
+RECENT_PHOTOS_KEY = 'staff_dir_recent_photos'
+RECENT_PHOTOS_SIZE = 20
+RECENT_PHOTOS_TIMEOUT = 60 * 60 * 24
+DEFAULT_PHOTO = 'avatars/default.jpg'
+
+
+def has_photo(person):
+    return bool(person.photo_file) and \
+        person.photo_file.name != DEFAULT_PHOTO
+
+
+def _shown(person):
+    return has_photo(person) and not person.hide_profile and \
+        person.user.is_active
+
+
+def _entry(person):
+    return {'pk': person.pk, 'stub': person.stub,
+            'first_name': person.user.first_name,
+            'last_name': person.user.last_name,
+            'photo_url': person.photo_file.url_125x125}
+
+
+def _build():
+    people = Person.objects.filter(user__is_active=True, hide_profile=False) \
+        .exclude(photo_file=DEFAULT_PHOTO).select_related('user') \
+        .order_by('-updated_at')[:RECENT_PHOTOS_SIZE]
+    return [_entry(person) for person in people]
+
+
+def get_feed():
+    feed = cache.get(RECENT_PHOTOS_KEY)
+    instrumentation.record_cache(hits=int(feed is not None),
+                                 misses=int(feed is None))
+    if feed is None:
+        feed = _build()
+        cache.set(RECENT_PHOTOS_KEY, feed, RECENT_PHOTOS_TIMEOUT)
+    return feed
+
+
+def photo_changed(person):
+    """
+        moves the person to the front of the feed, or out of it when they
+        no longer show a photo
+    """
+    if not _shown(person):
+        remove(person.pk)
+        return
+    feed = cache.get(RECENT_PHOTOS_KEY)
+    if feed is None:
+        return
+    feed = [_entry(person)] + \
+        [entry for entry in feed if entry['pk'] != person.pk]
+    cache.set(RECENT_PHOTOS_KEY, feed[:RECENT_PHOTOS_SIZE],
+              RECENT_PHOTOS_TIMEOUT)
+
+
+def user_changed(person, was_active):
+    """
+        updates the person's entry in place after a change of their user,
+        drops it when they were deactivated and rebuilds the feed when
+        they were activated again, so they take their place by photo date
+    """
+    if not _shown(person):
+        remove(person.pk)
+        return
+    feed = cache.get(RECENT_PHOTOS_KEY)
+    if feed is None:
+        return
+    if not was_active:
+        cache.delete(RECENT_PHOTOS_KEY)
+        return
+    if person.pk in [entry['pk'] for entry in feed]:
+        feed = [_entry(person) if entry['pk'] == person.pk else entry
+                for entry in feed]
+        cache.set(RECENT_PHOTOS_KEY, feed, RECENT_PHOTOS_TIMEOUT)
+
+
+def remove(person_id):
+    feed = cache.get(RECENT_PHOTOS_KEY)
+    if feed is None or person_id not in [entry['pk'] for entry in feed]:
+        return
+    # rebuilt on next read so the feed is back to its full length
+    cache.delete(RECENT_PHOTOS_KEY)
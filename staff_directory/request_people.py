@@ -0,0 +1,41 @@
+"""
+People looked up once per request.
+
+The decorators, the views and the templates of a request all ask for the
+requesting user's profile and for the profiles addressed by stub.  These
+loaders keep each Person, with its user, on the request the first time
+it is read, and hand the viewer's profile to ``user.get_profile()`` so
+code outside the app shares it too.
+"""
+from core.models import Person
+
+
+def current_person(request):
+    """
+        the requesting user's Person, None when they have not registered
+    """
+    if not hasattr(request, '_staff_dir_person'):
+        person = None
+        if request.user.is_authenticated():
+            person = Person.objects.filter(user=request.user.pk).first()
+        if person is not None:
+            person.user = request.user
+            request.user._profile_cache = person
+        request._staff_dir_person = person
+    return request._staff_dir_person
+
+
+def person_by_stub(request, stub):
+    """
+        the Person with this stub, raises Person.DoesNotExist like
+        Person.objects.get when there is none
+    """
+    people = request.__dict__.setdefault('_staff_dir_people', {})
+    if stub not in people:
+        viewer = getattr(request, '_staff_dir_person', None)
+        if viewer is not None and viewer.stub == stub:
+            people[stub] = viewer
+        else:
+            people[stub] = Person.objects.select_related('user') \
+                .get(stub=stub)
+    return people[stub]
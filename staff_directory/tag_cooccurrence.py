@@ -0,0 +1,198 @@
+"""
+Maintenance and lookups of the sparse tag co-occurrence matrix.
+
+TagCooccurrence holds, for every pair of tags carried by the same person,
+how many people carry both, counting the people of
+``tag_index.counted_people`` only.  ``rebuild`` counts the pairs over the
+person x tag incidence in one pass and backs the
+``rebuild_tag_cooccurrence`` management command; the receivers adjust the
+rows of the tag being added or removed as counted people are tagged, and
+the rows of every pair of a person who starts or stops being counted.  The
+related tags pane of a tag page is then a top-k read of the selected tags'
+rows.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from core.taggit.models import Tag, TaggedItem
+from staff_directory import tag_index
+from staff_directory.models import TagCooccurrence
+
+
+def _tags_by_person(person_ids=None):
+    """
+        a dict of person id -> list of tag ids, one entry per tagged item
+    """
+    items = TaggedItem.objects.filter(
+        content_type=tag_index.person_content_type())
+    if person_ids is None:
+        items = items.filter(
+            object_id__in=tag_index.counted_people().values('pk'))
+    else:
+        items = items.filter(object_id__in=person_ids)
+
+    tags = defaultdict(list)
+    for person_id, tag_id in items.order_by() \
+            .values_list('object_id', 'tag_id'):
+        tags[person_id].append(tag_id)
+    return tags
+
+
+def _create_missing(tag_id, other_ids, delta):
+    existing = set(TagCooccurrence.objects.filter(
+        tag=tag_id, other_tag__in=other_ids)
+        .values_list('other_tag_id', flat=True))
+    rows = []
+    for other_id in set(other_ids) - existing:
+        rows.append(TagCooccurrence(tag_id=tag_id, other_tag_id=other_id,
+                                    count=delta))
+        rows.append(TagCooccurrence(tag_id=other_id, other_tag_id=tag_id,
+                                    count=delta))
+    if not rows:
+        return
+    try:
+        with transaction.atomic():
+            TagCooccurrence.objects.bulk_create(rows)
+    except IntegrityError:
+        # created by a concurrent write, add to the rows one at a time
+        for row in rows:
+            pair, created = TagCooccurrence.objects.get_or_create(
+                tag_id=row.tag_id, other_tag_id=row.other_tag_id,
+                defaults={'count': delta})
+            if not created:
+                TagCooccurrence.objects.filter(pk=pair.pk) \
+                    .update(count=F('count') + delta)
+
+
+def _adjust(tag_id, deltas):
+    """
+        adds deltas, a dict of other tag id -> change, to both directions
+        of each pair with tag_id
+    """
+    by_delta = defaultdict(list)
+    for other_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(other_id)
+
+    for delta, other_ids in by_delta.items():
+        TagCooccurrence.objects.filter(tag=tag_id, other_tag__in=other_ids) \
+            .update(count=F('count') + delta)
+        TagCooccurrence.objects.filter(tag__in=other_ids, other_tag=tag_id) \
+            .update(count=F('count') + delta)
+        if delta > 0:
+            _create_missing(tag_id, other_ids, delta)
+
+
+def tag_added(tag_id, person_ids):
+    """
+        counts the pairs of tag_id with the other tags of people just
+        tagged with it, skipping people who already had it in another
+        category and people who are not counted
+    """
+    deltas = defaultdict(int)
+    counted = tag_index.counted_ids(person_ids)
+    for person_id, tag_ids in _tags_by_person(counted).items():
+        if tag_ids.count(tag_id) != 1:
+            continue
+        for other_id in set(tag_ids) - set([tag_id]):
+            deltas[other_id] += 1
+    _adjust(tag_id, deltas)
+
+
+def tag_removed(tag_id, person_id):
+    if not tag_index.counted_ids([person_id]):
+        return
+    tag_ids = _tags_by_person([person_id]).get(person_id, [])
+    if tag_id in tag_ids:
+        return
+    _adjust(tag_id, dict((other_id, -1) for other_id in set(tag_ids)))
+
+
+def person_counted(person_id, delta):
+    """
+        adds the pairs of the person's tags, delta 1, or removes them,
+        delta -1, when they start or stop being counted
+    """
+    tag_ids = sorted(set(_tags_by_person([person_id]).get(person_id, [])))
+    for i, tag_id in enumerate(tag_ids):
+        _adjust(tag_id, dict((other_id, delta)
+                             for other_id in tag_ids[i + 1:]))
+
+
+def rebuild():
+    """
+        recounts every pair over the tags of counted people, returns the
+        number of rows written
+    """
+    counts = defaultdict(int)
+    for tag_ids in _tags_by_person().values():
+        tag_ids = sorted(set(tag_ids))
+        for i, tag_id in enumerate(tag_ids):
+            for other_id in tag_ids[i + 1:]:
+                counts[(tag_id, other_id)] += 1
+
+    def rows():
+        for (tag_id, other_id), count in counts.iteritems():
+            yield TagCooccurrence(tag_id=tag_id, other_tag_id=other_id,
+                                  count=count)
+            yield TagCooccurrence(tag_id=other_id, other_tag_id=tag_id,
+                                  count=count)
+
+    with transaction.atomic():
+        TagCooccurrence.objects.all().delete()
+        batch = []
+        for row in rows():
+            batch.append(row)
+            if len(batch) == 5000:
+                TagCooccurrence.objects.bulk_create(batch)
+                batch = []
+        TagCooccurrence.objects.bulk_create(batch)
+    return len(counts) * 2
+
+
+def related_tags(tag_ids, limit, person_ids=None):
+    """
+        the limit tags most often carried together with all of tag_ids,
+        with tag_count set to the number of people carrying them all.
+        for several tag_ids the candidates are counted exactly against
+        person_ids, the people carrying tag_ids, best upper bound (their
+        smallest count) first, until no candidate left can make the limit
+    """
+    tag_ids = set(tag_ids)
+    rows = TagCooccurrence.objects.filter(tag__in=tag_ids, count__gt=0) \
+        .exclude(other_tag__in=tag_ids) \
+        .values_list('tag_id', 'other_tag_id', 'count')
+    if len(tag_ids) == 1:
+        rows = rows.order_by('-count', 'other_tag')[:limit]
+
+    bounds = defaultdict(list)
+    for tag_id, other_id, count in rows:
+        bounds[other_id].append(count)
+    counts = dict((other_id, min(found)) for other_id, found in
+                  bounds.items() if len(found) == len(tag_ids))
+
+    if len(tag_ids) > 1:
+        candidates = sorted(counts, key=lambda pk: (-counts[pk], pk))
+        if person_ids is None:
+            person_ids = tag_index.person_ids(all_of=tag_ids)
+        people = set(person_ids)
+        exact = {}
+        for start in range(0, len(candidates), limit):
+            batch = candidates[start:start + limit]
+            if len(exact) >= limit and sorted(
+                    exact.values(), reverse=True)[limit - 1] > \
+                    counts[batch[0]]:
+                break
+            exact.update(
+                (pk, len(people.intersection(entry))) for pk, entry in
+                tag_index.get_entries(batch).items())
+        counts = exact
+
+    tags = list(Tag.objects.filter(pk__in=[pk for pk in counts
+                                           if counts[pk] > 0]))
+    for tag in tags:
+        tag.tag_count = counts[tag.pk]
+    tags.sort(key=lambda tag: (-tag.tag_count, tag.slug))
+    return tags[:limit]
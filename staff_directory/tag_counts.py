@@ -0,0 +1,76 @@
+"""
+Maintenance of the denormalized TagCount table.
+
+Only the people of ``tag_index.counted_people`` are counted.  The
+receivers adjust a single row per tagged item write, inside the same
+transaction as the write, and every row of a person who starts or stops
+being counted.  ``rebuild`` recomputes the whole table and backs the
+``rebuild_tag_counts`` management command.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from core.taggit.models import Tag, TaggedItem
+from staff_directory import tag_index
+from staff_directory.models import TagCount
+
+
+def adjust(tag_id, tag_category_id, delta):
+    updated = TagCount.objects.filter(
+        tag=tag_id, tag_category=tag_category_id) \
+        .update(count=F('count') + delta)
+    if not updated and delta > 0:
+        tag_count, created = TagCount.objects.get_or_create(
+            tag_id=tag_id, tag_category_id=tag_category_id,
+            defaults={'count': delta})
+        if not created:
+            TagCount.objects.filter(pk=tag_count.pk) \
+                .update(count=F('count') + delta)
+
+
+def _counts(people):
+    return TaggedItem.objects.filter(
+        content_type=tag_index.person_content_type(),
+        object_id__in=people) \
+        .values('tag', 'tag_category') \
+        .annotate(count=Count('id')) \
+        .order_by()
+
+
+def person_counted(person_id, delta):
+    """
+        adds the person's tagged items to the counts, delta 1, or removes
+        them, delta -1, when they start or stop being counted.  returns the
+        ids of the tags adjusted
+    """
+    tag_ids = set()
+    for row in _counts([person_id]):
+        adjust(row['tag'], row['tag_category'], delta * row['count'])
+        tag_ids.add(row['tag'])
+    return tag_ids
+
+
+def rebuild():
+    """
+        recomputes every count, returns the number of rows written
+    """
+    rows = _counts(tag_index.counted_people().values('pk'))
+
+    counts = [TagCount(tag_id=row['tag'],
+                       tag_category_id=row['tag_category'],
+                       count=row['count']) for row in rows]
+    with transaction.atomic():
+        TagCount.objects.all().delete()
+        TagCount.objects.bulk_create(counts)
+    return len(counts)
+
+
+def popular_tags(min_count):
+    """
+        tags carried by at least min_count people across all categories,
+        most popular first, with tag_count set
+    """
+    return Tag.objects.filter(staff_directory_counts__count__gt=0) \
+        .annotate(tag_count=Sum('staff_directory_counts__count')) \
+        .filter(tag_count__gte=min_count) \
+        .order_by('-tag_count', 'name')
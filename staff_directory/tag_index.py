@@ -0,0 +1,143 @@
+"""
+Inverted index from tag id to the sorted ids of the people tagged with it.
+
+Multi-tag pages used to chain one ``filter(tags__pk=pk).distinct()`` per
+selected tag.  The index lets AND/OR/NOT combinations of tags be resolved as
+set operations so only the final list of person ids goes to the database.
+
+Entries live in the shared cache and are built lazily, one query for all
+missing tags.  ``receivers`` clears the entry of a tag when tagged items
+are saved or deleted rather than editing it in place, so concurrent
+writers cannot overwrite each other's changes; the next read rebuilds it.
+The index only records who carries a tag; the active/visible profile
+filters are applied by the final query.  Lists of more than MAX_BOUND_IDS
+ids are not bound as query parameters, SQLite allows 999 of them; the
+final query then joins the tagged items itself.
+"""
+from array import array
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+
+from core.models import Person
+from core.taggit.models import TaggedItem
+from staff_directory import instrumentation
+
+TAG_INDEX_TIMEOUT = getattr(settings, 'STAFF_DIR_TAG_INDEX_TIMEOUT',
+                            60 * 60 * 24)
+MAX_BOUND_IDS = 500
+
+
+def _key(tag_id):
+    return 'staff_dir_tag_index_%s' % tag_id
+
+
+def person_content_type():
+    return ContentType.objects.get_for_model(Person)
+
+
+def counted_people():
+    """
+        the people TagCount and TagCooccurrence count: active and listed
+        in the directory
+    """
+    return Person.objects.filter(user__is_active=True, hide_profile=False)
+
+
+def counted_ids(person_ids):
+    """
+        the ids among person_ids of people who are counted
+    """
+    return list(counted_people().filter(pk__in=person_ids)
+                .values_list('pk', flat=True))
+
+
+def get_entries(tag_ids):
+    """
+        returns a dict of tag id -> sorted array of person ids, building
+        the entries missing from the cache with a single query
+    """
+    keys = dict((_key(pk), pk) for pk in tag_ids)
+    cached = cache.get_many(keys.keys())
+    entries = dict((keys[key], value) for key, value in cached.items())
+
+    missing = [pk for pk in keys.values() if pk not in entries]
+    instrumentation.record_cache(hits=len(entries), misses=len(missing))
+    if missing:
+        built = dict((pk, set()) for pk in missing)
+        rows = TaggedItem.objects.filter(
+            tag__in=missing, content_type=person_content_type()) \
+            .order_by().values_list('tag_id', 'object_id')
+        for tag_id, person_id in rows:
+            built[tag_id].add(person_id)
+        for pk, person_ids in built.items():
+            entries[pk] = array('l', sorted(person_ids))
+        cache.set_many(dict((_key(pk), entries[pk]) for pk in missing),
+                       TAG_INDEX_TIMEOUT)
+
+    return entries
+
+
+def person_ids(all_of=(), any_of=()):
+    """
+        ids of people carrying every tag in all_of and, when given, at
+        least one tag in any_of
+    """
+    entries = get_entries(set(all_of) | set(any_of))
+
+    result = None
+    for pk in sorted(all_of, key=lambda pk: len(entries[pk])):
+        if result is None:
+            result = set(entries[pk])
+        else:
+            result.intersection_update(entries[pk])
+        if not result:
+            return []
+
+    if any_of:
+        union = set()
+        for pk in any_of:
+            union.update(entries[pk])
+        result = union if result is None else result & union
+
+    return sorted(result or ())
+
+
+def _tagged(tag_ids):
+    # a subquery, for id lists too long to bind
+    return TaggedItem.objects.filter(
+        tag__in=tag_ids, content_type=person_content_type()) \
+        .values('object_id')
+
+
+def filter_people(people, all_of=(), any_of=(), none_of=()):
+    """
+        restricts a Person queryset using the index, e.g.
+        filter_people(people, all_of=[1, 2], none_of=[3])
+    """
+    if all_of or any_of:
+        ids = person_ids(all_of, any_of)
+        if len(ids) <= MAX_BOUND_IDS:
+            people = people.filter(pk__in=ids)
+        else:
+            for pk in all_of:
+                people = people.filter(pk__in=_tagged([pk]))
+            if any_of:
+                people = people.filter(pk__in=_tagged(any_of))
+    if none_of:
+        excluded = set()
+        for entry in get_entries(none_of).values():
+            excluded.update(entry)
+        if len(excluded) > MAX_BOUND_IDS:
+            people = people.exclude(pk__in=_tagged(none_of))
+        elif excluded:
+            people = people.exclude(pk__in=sorted(excluded))
+    return people
+
+
+def clear(tag_id):
+    """
+        drops the entry of tag_id, it is built from the database on next use
+    """
+    cache.delete(_key(tag_id))
@@ -0,0 +1,140 @@
+"""
+Tag write paths for people.
+
+A person carries a tag at most once per category, which migration 0011
+enforces with a unique index on the tagged items; ``duplicate_items``
+finds what would break it in an older database.  The writes rely on it
+rather than on a prior read, so a tag submitted twice at the same time
+is stored once, and each write tells whether it changed anything.
+
+The receivers expire the cached pages and tag index inside the write's
+transaction, before other connections can see it.  Each write expires
+them again once its transaction commits; a caller wrapping a write in a
+transaction of its own calls receivers.expire_tagged after committing.
+"""
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+
+from core.taggit.models import Tag, TagCategory, TaggedItem
+from staff_directory import receivers, tag_index
+
+
+def _expire_after_commit(tag_id, person_ids):
+    # django 1.6 has no commit hooks, only the outermost block commits
+    if person_ids and not transaction.get_connection().in_atomic_block:
+        receivers.expire_tagged(tag_id, person_ids)
+
+
+def get_or_create_tag(name):
+    tag = Tag.objects.filter(name__iexact=name).order_by('pk').first()
+    if tag is None:
+        try:
+            with transaction.atomic():
+                tag = Tag.objects.create(name=name)
+        except IntegrityError:
+            # created by a concurrent request
+            tag = Tag.objects.filter(name__iexact=name).order_by('pk')[0]
+    return tag
+
+
+def add_tag(person, tag_name, category_slug, creator):
+    """
+        tags person with tag_name in the category unless they already carry
+        it there. returns the tagged item and whether it was created
+    """
+    category = TagCategory.objects.get(slug=category_slug)
+    with transaction.atomic():
+        tag = get_or_create_tag(tag_name)
+        lookup = {'tag': tag, 'tag_category': category,
+                  'content_type': tag_index.person_content_type(),
+                  'object_id': person.pk}
+        item = TaggedItem.objects.filter(**lookup).first()
+        if item is not None:
+            return item, False
+        try:
+            with transaction.atomic():
+                item = TaggedItem.objects.create(tag_creator=creator,
+                                                 **lookup)
+        except IntegrityError:
+            # added by a concurrent request
+            return TaggedItem.objects.get(**lookup), False
+    _expire_after_commit(tag.pk, [person.pk])
+    return item, True
+
+
+def remove_tag(person, tag_slug, category_slug, remover):
+    """
+        removes the tag from person in the category. returns the removed
+        tagged item, None when they did not carry it.  only the person and
+        whoever tagged them may remove a tag, PermissionDenied otherwise
+    """
+    with transaction.atomic():
+        item = TaggedItem.objects.select_for_update() \
+            .select_related('tag').filter(
+                tag__slug=tag_slug, tag_category__slug=category_slug,
+                content_type=tag_index.person_content_type(),
+                object_id=person.pk).first()
+        if item is None:
+            return None
+        if remover.pk not in (person.user_id, item.tag_creator_id):
+            raise PermissionDenied
+        item.delete()
+    _expire_after_commit(item.tag_id, [person.pk])
+    return item
+
+
+def duplicate_items():
+    """
+        ids of the people's tagged items repeating an earlier one with the
+        same tag and category
+    """
+    duplicates, last = [], None
+    items = TaggedItem.objects.filter(
+        content_type=tag_index.person_content_type()) \
+        .order_by('tag', 'tag_category', 'object_id', 'pk') \
+        .values_list('pk', 'tag_id', 'tag_category_id', 'object_id')
+    for item in items.iterator():
+        if item[1:] == last:
+            duplicates.append(item[0])
+        last = item[1:]
+    return duplicates
+
+
+def bulk_add_tag(people, tag_name, category_slug, creator):
+    """
+        tags every person in people with tag_name in one transaction,
+        inserting the missing tagged items with a single bulk insert.
+        returns the tag and the people who did not already have it
+    """
+    category = TagCategory.objects.get(slug=category_slug)
+    content_type = tag_index.person_content_type()
+
+    with transaction.atomic():
+        tag = get_or_create_tag(tag_name)
+        tagged = set(TaggedItem.objects.filter(
+            tag=tag, tag_category=category, content_type=content_type,
+            object_id__in=[person.pk for person in people])
+            .values_list('object_id', flat=True))
+        new_people = [person for person in people if person.pk not in tagged]
+        if not new_people:
+            return tag, []
+
+        try:
+            with transaction.atomic():
+                TaggedItem.objects.bulk_create([
+                    TaggedItem(tag=tag, tag_category=category,
+                               tag_creator=creator, content_type=content_type,
+                               object_id=person.pk)
+                    for person in new_people])
+        except IntegrityError:
+            # some were tagged by a concurrent request, add the rest one by
+            # one; the saves update the derived data themselves
+            new_people = [person for person in new_people if
+                          add_tag(person, tag.name, category_slug, creator)[1]]
+        else:
+            # bulk_create sends no post_save signals
+            receivers.tagged_items_added(tag.pk, category.pk,
+                                         [person.pk for person in new_people])
+
+    _expire_after_commit(tag.pk, [person.pk for person in new_people])
+    return tag, new_people
@@ -10,7 +10,7 @@ $("#person_name").keypress(function(event) {
 });
 
 $(".person_autocomplete").autocomplete({
-    source: "{% url "search:persons_json" %}",
+    source: "{% url "staff_directory:autocomplete" "people" %}",
     select: function(event, ui) {
         $("#person_name").attr("value", ui.item.label);
         $("#person_stub").attr("value", ui.item.stub);
@@ -53,3 +53,43 @@ $('.tag_name').click(function(e) {
     }
 });
 
+
+var personUrl = "{% url "staff_directory:person" "-stub-" %}";
+var loadMore = $('#load_more_people');
+var loadingPeople = false;
+
+function loadMorePeople() {
+    if (loadingPeople || !loadMore.data('cursor')) {
+        return;
+    }
+    loadingPeople = true;
+    $.getJSON(window.location.pathname,
+              {format: 'people_json', cursor: loadMore.data('cursor')},
+              function(data) {
+        $.each(data.people, function(i, person) {
+            var link = $('<a>').attr('href', personUrl.replace('-stub-', person.stub));
+            link.append($('<img alt="">').attr('src', person.photo_url));
+            link.append(document.createTextNode(' ' + person.first_name + ' ' + person.last_name));
+            $('#people_grid').append(link);
+        });
+        loadMore.data('cursor', data.next);
+        if (!data.next) {
+            loadMore.remove();
+        }
+    }).always(function() {
+        loadingPeople = false;
+    });
+}
+
+loadMore.click(function(e) {
+    e.preventDefault();
+    loadMorePeople();
+});
+
+// keep loading as the reader scrolls near the end of the grid
+$(window).scroll(function() {
+    if (loadMore.data('cursor') && $(window).scrollTop() + $(window).height() >
+            loadMore.offset().top - 200) {
+        loadMorePeople();
+    }
+});
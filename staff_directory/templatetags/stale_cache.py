@@ -0,0 +1,48 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from staff_directory import caching
+
+register = template.Library()
+
+
+class StaleCacheNode(template.Node):
+    def __init__(self, nodelist, expire_time_var, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.expire_time_var = expire_time_var
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        try:
+            expire_time = int(self.expire_time_var.resolve(context))
+        except (template.VariableDoesNotExist, ValueError, TypeError):
+            raise template.TemplateSyntaxError(
+                '"stale_cache" tag got an invalid timeout: %r' %
+                self.expire_time_var.var)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        key = 'staff_dir_stale.' + \
+            make_template_fragment_key(self.fragment_name, vary_on)
+        return caching.get_or_set(key, lambda: self.nodelist.render(context),
+                                  expire_time, name=self.fragment_name)
+
+
+@register.tag
+def stale_cache(parser, token):
+    """
+        like {% cache %}, but the fragment is rendered again by one request
+        at a time while the others are served the previous rendering:
+
+            {% stale_cache 600 fragment_name var1 var2 %}
+                ...
+            {% endstale_cache %}
+    """
+    nodelist = parser.parse(('endstale_cache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(
+            '%r tag requires at least 2 arguments.' % tokens[0])
+    return StaleCacheNode(nodelist, parser.compile_filter(tokens[1]),
+                          tokens[2],
+                          [parser.compile_filter(t) for t in tokens[3:]])
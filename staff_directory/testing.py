@@ -0,0 +1,26 @@
+"""
+Test helpers for apps and tests built on the staff directory.
+"""
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin(object):
+    """
+        TestCase mixin failing a test when a block runs more queries than
+        its budget, so reintroduced N+1 queries are caught:
+
+            with self.assertQueryBudget(10):
+                self.client.get(url)
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, max_queries):
+        with CaptureQueriesContext(connection) as queries:
+            yield queries
+        if len(queries) > max_queries:
+            self.fail('%d queries executed, budget is %d:\n%s' % (
+                len(queries), max_queries,
+                '\n'.join(query['sql'] for query in queries)))
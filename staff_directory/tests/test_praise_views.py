@@ -1,11 +1,19 @@
+import csv
+import json
+from datetime import timedelta
+
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
 
 from exam.cases import Exam
 from exam.decorators import before
-from core.models import Person
+from core.models import OrgGroup, Person
 from core.notifications.models import Notification
-from staff_directory.models import Praise
+from staff_directory import export, outbox, praise_stats
+from staff_directory.models import Praise, QueuedNotification
 
 
 class PraiseTest(Exam, TestCase):
@@ -36,3 +44,198 @@ class PraiseTest(Exam, TestCase):
         self.assertTrue(Praise.objects.filter(recipient=recipient)\
             .filter(cfpb_value='serve').filter(reason='because!'))
         self.assertContains(resp, 'because!', status_code=200)
+
+    def test_praise_notification_is_queued(self):
+        """
+            Tests that praising queues the recipient's notification and
+            draining the queue sends it
+        """
+
+        self.client.post(
+            reverse('staff_directory:thanks', args=('admin', )), data={
+                'value_type': 'serve', 'reason': 'because!',
+                })
+
+        recipient = Person.objects.filter(stub='admin')[0]
+        queued = QueuedNotification.objects.get(to_user=recipient.user)
+        self.assertEqual(queued.status, QueuedNotification.PENDING)
+        self.assertEqual(queued.verb, 'thanked')
+
+        self.assertEqual(outbox.drain(), 1)
+        queued = QueuedNotification.objects.get(pk=queued.pk)
+        self.assertEqual(queued.status, QueuedNotification.SENT)
+        self.assertEqual(outbox.drain(), 0)
+
+    def test_stale_claims_are_sent(self):
+        """
+            Tests that an entry claimed by a worker that died is sent by the
+            next drain once its claim times out, and a fresh claim is not
+        """
+
+        for reason in ['first', 'second']:
+            self.client.post(
+                reverse('staff_directory:thanks', args=('admin', )), data={
+                    'value_type': 'serve', 'reason': reason})
+        stale, fresh = outbox.claim_batch(2)
+        QueuedNotification.objects.filter(pk=stale.pk).update(
+            claimed_at=timezone.now() - timedelta(
+                seconds=outbox.CLAIM_TIMEOUT + 1))
+
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(QueuedNotification.objects.get(pk=stale.pk).status,
+                         QueuedNotification.SENT)
+        self.assertEqual(QueuedNotification.objects.get(pk=fresh.pk).status,
+                         QueuedNotification.SENDING)
+
+
+class ShowThanksTest(Exam, TestCase):
+    """
+        Tests the cursor links of the staff thanks list page through the
+        same items as the numbered pages.
+    """
+
+    fixtures = ['core-test-fixtures']
+
+    @before
+    def login(self):
+        self.assertTrue(self.client.login(username='test1@example.com',
+            password='1'))
+        cache.clear()
+
+    @override_settings(STAFF_THANKS_PAGINATION_LIMIT=1)
+    def test_cursor_pages_match_numbered_pages(self):
+        for reason in ['first', 'second', 'third']:
+            self.client.post(
+                reverse('staff_directory:thanks', args=('admin', )), data={
+                    'value_type': 'serve', 'reason': reason})
+
+        url = reverse('staff_directory:show_thanks')
+        resp = self.client.get(url)
+        newest = list(resp.context['thanks_list'])
+        self.assertEqual(len(newest), 1)
+
+        resp = self.client.get(url, {'before': resp.context['next_cursor'],
+                                     'page_num': 2})
+        by_cursor = list(resp.context['thanks_list'])
+        self.assertEqual(resp.context['thanks_list'].number, 2)
+
+        resp = self.client.get(url, {'page_num': 2})
+        self.assertEqual(by_cursor, list(resp.context['thanks_list']))
+
+        resp = self.client.get(url, {'after': by_cursor[0].pk,
+                                     'page_num': 1})
+        self.assertEqual(newest, list(resp.context['thanks_list']))
+        self.assertFalse(resp.context['thanks_list'].has_previous())
+
+
+class ThanksStatsTest(Exam, TestCase):
+    fixtures = ['core-test-fixtures']
+
+    @before
+    def login(self):
+        self.assertTrue(self.client.login(username='test1@example.com',
+            password='1'))
+
+    def stats(self):
+        resp = self.client.get(reverse('staff_directory:thanks_stats'),
+                               {'format': 'json'})
+        return json.loads(resp.content)
+
+    def test_stats_follow_praise_writes(self):
+        """
+            Tests the rollups count each thanks once and match a rebuild
+        """
+        before = self.stats()
+        for value in ['serve', 'serve', 'lead']:
+            self.client.post(
+                reverse('staff_directory:thanks', args=('admin', )), data={
+                    'value_type': value, 'reason': 'because!',
+                    })
+
+        after = self.stats()
+        self.assertEqual(after['total'], before['total'] + 3)
+        self.assertEqual(after['by_value']['serve'],
+                         before['by_value']['serve'] + 2)
+        self.assertEqual(after['by_value']['lead'],
+                         before['by_value']['lead'] + 1)
+        self.assertEqual(after['top_recipients'][0]['stub'], 'admin')
+
+        Praise.objects.filter(cfpb_value='lead')[0].delete()
+        self.assertEqual(self.stats()['by_value']['lead'],
+                         before['by_value']['lead'])
+
+        counted = self.stats()
+        praise_stats.rebuild()
+        self.assertEqual(self.stats(), counted)
+
+    def test_stats_follow_recipient_moves(self):
+        """
+            Tests a person's thanks are counted under their new office
+            after a move, as a rebuild counts them
+        """
+        self.client.post(
+            reverse('staff_directory:thanks', args=('admin', )), data={
+                'value_type': 'serve', 'reason': 'because!'})
+        recipient = Person.objects.get(stub='admin')
+        recipient.org_group = OrgGroup.objects.create(title='Moved Office')
+        recipient.save()
+
+        counted = self.stats()
+        moved = [row for row in counted['by_office']
+                 if row['office'] == 'Moved Office']
+        self.assertEqual(moved, [{'office': 'Moved Office',
+                                  'count': recipient.recepient.count()}])
+        praise_stats.rebuild()
+        self.assertEqual(self.stats(), counted)
+
+    def test_stats_page(self):
+        resp = self.client.get(reverse('staff_directory:thanks_stats'))
+        self.assertContains(resp, 'Staff thanks statistics', status_code=200)
+
+    def test_stats_months_are_clamped(self):
+        url = reverse('staff_directory:thanks_stats')
+        for months in ['30000', '-5', 'many']:
+            resp = self.client.get(url, {'months': months})
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['months'], 12)
+        resp = self.client.get(url, {'months': '30000'})
+        self.assertEqual(resp.context['months'], 120)
+
+
+class PraiseExportTest(Exam, TestCase):
+    fixtures = ['core-test-fixtures']
+
+    @before
+    def login(self):
+        self.assertTrue(self.client.login(username='test1@example.com',
+            password='1'))
+
+    def test_export_reads_every_chunk(self):
+        """
+            Tests each thanks is exported once across chunks, and filtered
+        """
+        for n, value in enumerate(['serve', 'lead', 'serve', 'innovate',
+                                   'serve']):
+            self.client.post(
+                reverse('staff_directory:thanks', args=('admin', )), data={
+                    'value_type': value, 'reason': 'reason %d' % n})
+
+        chunk_size = export.EXPORT_CHUNK_SIZE
+        export.EXPORT_CHUNK_SIZE = 2
+        try:
+            rows = list(csv.reader(
+                export.iter_praise_csv(Praise.objects.all())))
+            served = list(csv.reader(export.iter_praise_csv(
+                export.filter_praise(Praise.objects.all(),
+                                     cfpb_value='serve'))))
+        finally:
+            export.EXPORT_CHUNK_SIZE = chunk_size
+
+        self.assertEqual(rows[0], export.PRAISE_CSV_COLUMNS)
+        self.assertEqual(len(rows) - 1, Praise.objects.count())
+        reasons = [row[4] for row in rows[1:]]
+        for n in range(5):
+            self.assertEqual(reasons.count('reason %d' % n), 1)
+        self.assertEqual(len(served) - 1,
+                         Praise.objects.filter(cfpb_value='serve').count())
+        self.assertTrue(all(row[3] == 'serve' for row in served[1:]))
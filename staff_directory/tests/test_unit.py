@@ -1,10 +1,23 @@
-from django.test import TestCase
+import time
+from array import array
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models.signals import post_save, pre_save
+from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
 
 from collab.django_factories import UserF
 from core.taggit.utils import add_tags
-from core.models import Person
-from core.taggit.models import TagCategory
-from staff_directory.helpers import _get_emails_for_tag
+from core.models import OrgGroup, Person
+from core.taggit.models import Tag, TagCategory, TaggedItem
+from south.models import MigrationHistory
+from staff_directory import caching, request_people, tag_cooccurrence, \
+    tag_counts, tag_index, tagging, warming
+from staff_directory.benchmarks import data, harness, plans
+from staff_directory.helpers import _get_emails_for_tag, \
+    _query_profile_tags
+from staff_directory.models import TagCooccurrence, TagCount
 
 
 class HelperTest(TestCase):
@@ -26,6 +39,10 @@ class HelperTest(TestCase):
 
 class TagEmailExportTest(TestCase):
 
+    def setUp(self):
+        # the tag index outlives the rolled back rows of earlier tests
+        cache.clear()
+
     def test_single_tag_single_user(self):
         user = UserF(username="jack@example.org")
         person = Person(user=user)
@@ -168,3 +185,577 @@ class TagEmailExportTest(TestCase):
 
         emails = _get_emails_for_tag(tags)
         self.assertEqual(len(emails), 0)
+
+
+class TagIndexTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        TagCategory(name='Test Category',
+                    slug='staff-directory-test-category').save()
+
+        self.people = []
+        for name in ['jack', 'jill', 'janice']:
+            user = UserF(username="%s@example.org" % name)
+            person = Person(user=user)
+            person.save()
+            self.people.append(person)
+
+        jack, jill, janice = self.people
+        self.tag_a = add_tags(jack, 'TagA', 'staff-directory-test-category',
+                              jack.user, 'person').tag
+        add_tags(jill, 'TagA', 'staff-directory-test-category',
+                 jack.user, 'person')
+        self.tag_b = add_tags(jill, 'TagB', 'staff-directory-test-category',
+                              jack.user, 'person').tag
+        add_tags(janice, 'TagB', 'staff-directory-test-category',
+                 jack.user, 'person')
+
+    def test_set_operations(self):
+        jack, jill, janice = self.people
+        a, b = self.tag_a.pk, self.tag_b.pk
+
+        self.assertEqual(tag_index.person_ids(all_of=[a, b]), [jill.pk])
+        self.assertEqual(tag_index.person_ids(any_of=[a, b]),
+                         sorted([jack.pk, jill.pk, janice.pk]))
+
+        people = tag_index.filter_people(Person.objects, any_of=[a, b],
+                                         none_of=[b])
+        self.assertEqual(list(people), [jack])
+
+    def test_index_follows_tag_writes(self):
+        jack, jill, janice = self.people
+        a = self.tag_a.pk
+        self.assertEqual(tag_index.person_ids(all_of=[a]),
+                         sorted([jack.pk, jill.pk]))
+
+        add_tags(janice, 'TagA', 'staff-directory-test-category',
+                 jack.user, 'person')
+        self.assertEqual(tag_index.person_ids(all_of=[a]),
+                         sorted([jack.pk, jill.pk, janice.pk]))
+
+        TaggedItem.objects.filter(tag=a, object_id=jack.pk).delete()
+        self.assertEqual(tag_index.person_ids(all_of=[a]),
+                         sorted([jill.pk, janice.pk]))
+
+
+    def test_long_id_lists_are_not_bound(self):
+        """
+            Tests tags carried by more people than SQLite binds parameters
+            filter the same people
+        """
+        data.generate(people=1500, divisions=1, offices=1, tags=1,
+                      tagged_items=4500, praise=0)
+        tag = Tag.objects.get(slug='bench-tag-0')
+        tagged = tag_index.person_ids(all_of=[tag.pk])
+        self.assertTrue(len(tagged) > 999)
+
+        people = tag_index.filter_people(Person.objects, all_of=[tag.pk])
+        self.assertEqual(sorted(people.values_list('pk', flat=True)), tagged)
+        people = tag_index.filter_people(
+            Person.objects.filter(stub__startswith='bench-'),
+            none_of=[tag.pk])
+        self.assertEqual(people.count(), 1500 - len(tagged))
+
+
+class ProfileTagsTest(TestCase):
+
+    def test_profile_tags_single_query(self):
+        owner = UserF(username="jack@example.org")
+        person = Person(user=owner)
+        person.save()
+
+        taggers = []
+        for name in ['jill', 'janice']:
+            user = UserF(username="%s@example.org" % name)
+            Person(user=user).save()
+            taggers.append(user)
+        jill, janice = taggers
+
+        for slug, name in [('staff-directory-my-expertise', 'Expertise'),
+                           ('staff-directory-my-projects', 'Projects')]:
+            TagCategory(name=name, slug=slug).save()
+            # a person carries a tag once per category, whoever tagged them
+            add_tags(person, 'TagA', slug, jill, 'person')
+            add_tags(person, 'TagB', slug, janice, 'person')
+
+        req = RequestFactory().get('/')
+        req.user = jill
+        tag_index.person_content_type()
+
+        with self.assertNumQueries(1):
+            tags = _query_profile_tags(req, person)
+
+        expertise = tags['staff-directory-my-expertise']
+        self.assertEqual([t.name for t in expertise], ['TagA', 'TagB'])
+        self.assertEqual(expertise[0].tag_count, 1)
+        self.assertTrue(expertise[0].can_remove)
+        self.assertFalse(expertise[1].can_remove)
+        self.assertEqual(expertise[1].taggers, janice.person.full_name)
+        self.assertEqual(len(tags['staff-directory-my-projects']), 2)
+        self.assertEqual(tags['staff-directory-other-things'], [])
+
+
+def _migrate(target, fake=False):
+    call_command('migrate', 'staff_directory', target, fake=fake,
+                 interactive=False, verbosity=0)
+
+
+class TaggedItemUniqueTest(TransactionTestCase):
+    """
+        the test database is built by syncdb, without the constraint
+        migration 0011 adds on core's table.  the class records every
+        migration as applied and runs that one for real, once; each test
+        flushes the history, so it is recorded again to migrate back
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(TaggedItemUniqueTest, cls).setUpClass()
+        call_command('migrate', fake=True, interactive=False, verbosity=0)
+        _migrate('0010', fake=True)
+        _migrate('0011')
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            call_command('migrate', fake=True, interactive=False,
+                         verbosity=0)
+            _migrate('0011', fake=True)
+            _migrate('0010')
+        finally:
+            MigrationHistory.objects.all().delete()
+            super(TaggedItemUniqueTest, cls).tearDownClass()
+
+    def test_concurrent_add_tag_is_not_created_twice(self):
+        """
+            Tests a tag added by a concurrent request between the lookup and
+            the insert is stored once
+        """
+        user = UserF(username="jack@example.org")
+        person = Person(user=user)
+        person.save()
+        category = TagCategory(name='Test Category',
+                               slug='staff-directory-test-category')
+        category.save()
+        tag = tagging.get_or_create_tag('TagA')
+
+        def concurrent_request(sender, instance, **kwargs):
+            # another request stores the item between the lookup and the
+            # insert, without sending signals
+            pre_save.disconnect(concurrent_request, sender=TaggedItem)
+            TaggedItem.objects.bulk_create([TaggedItem(
+                tag=tag, tag_category=category, object_id=person.pk,
+                content_type=tag_index.person_content_type())])
+
+        pre_save.connect(concurrent_request, sender=TaggedItem)
+        try:
+            item, created = tagging.add_tag(
+                person, 'TagA', 'staff-directory-test-category', user)
+        finally:
+            pre_save.disconnect(concurrent_request, sender=TaggedItem)
+
+        self.assertFalse(created)
+        self.assertEqual(person.tags.filter(name='TagA').count(), 1)
+        self.assertEqual(item.tag_id, tag.pk)
+
+
+class RequestPeopleTest(TestCase):
+
+    def test_people_are_loaded_once_per_request(self):
+        viewer = UserF(username="jack@example.org")
+        Person(user=viewer).save()
+        other = UserF(username="jill@example.org")
+        Person(user=other).save()
+        stub = Person.objects.get(user=other).stub
+
+        req = RequestFactory().get('/')
+        req.user = viewer
+        with self.assertNumQueries(2):
+            person = request_people.current_person(req)
+            self.assertEqual(request_people.current_person(req), person)
+            self.assertEqual(viewer.get_profile(), person)
+            found = request_people.person_by_stub(req, stub)
+            self.assertEqual(request_people.person_by_stub(req, stub), found)
+            self.assertEqual(found.user.username, "jill@example.org")
+            self.assertEqual(
+                request_people.person_by_stub(req, person.stub), person)
+
+        self.assertRaises(Person.DoesNotExist, request_people.person_by_stub,
+                          req, 'not-a-stub')
+
+
+class TagCountTest(TestCase):
+
+    def test_counts_follow_tag_writes(self):
+        category = TagCategory(name='Test Category',
+                               slug='staff-directory-test-category')
+        category.save()
+
+        people = []
+        for name in ['jack', 'jill']:
+            user = UserF(username="%s@example.org" % name)
+            person = Person(user=user)
+            person.save()
+            people.append(person)
+        jack, jill = people
+
+        tag = add_tags(jack, 'TagA', 'staff-directory-test-category',
+                       jack.user, 'person').tag
+        add_tags(jill, 'TagA', 'staff-directory-test-category',
+                 jack.user, 'person')
+
+        count = TagCount.objects.get(tag=tag, tag_category=category)
+        self.assertEqual(count.count, 2)
+        self.assertEqual(list(tag_counts.popular_tags(2)), [tag])
+        self.assertEqual(list(tag_counts.popular_tags(3)), [])
+
+        TaggedItem.objects.filter(tag=tag, object_id=jack.pk).delete()
+        count = TagCount.objects.get(tag=tag, tag_category=category)
+        self.assertEqual(count.count, 1)
+
+        TagCount.objects.all().delete()
+        self.assertEqual(tag_counts.rebuild(), 1)
+        count = TagCount.objects.get(tag=tag, tag_category=category)
+        self.assertEqual(count.count, 1)
+
+    def test_counts_follow_counted_people(self):
+        category = TagCategory(name='Test Category',
+                               slug='staff-directory-test-category')
+        category.save()
+        user = UserF(username="jack@example.org")
+        person = Person(user=user)
+        person.save()
+        tag = add_tags(person, 'TagA', 'staff-directory-test-category',
+                       user, 'person').tag
+
+        def count():
+            return TagCount.objects.get(tag=tag, tag_category=category).count
+
+        user.is_active = False
+        user.save()
+        self.assertEqual(count(), 0)
+        # an inactive person's tags are not counted
+        add_tags(person, 'TagB', 'staff-directory-test-category', user,
+                 'person')
+        self.assertFalse(TagCount.objects.filter(count__gt=0).exists())
+
+        user.is_active = True
+        user.save()
+        self.assertEqual(count(), 1)
+        self.assertEqual(TagCount.objects.get(tag__name='TagB').count, 1)
+        person.hide_profile = True
+        person.save()
+        self.assertEqual(count(), 0)
+
+        adjusted = sorted(TagCount.objects.filter(count__gt=0)
+                          .values_list('tag', 'tag_category', 'count'))
+        tag_counts.rebuild()
+        self.assertEqual(sorted(TagCount.objects.values_list(
+            'tag', 'tag_category', 'count')), adjusted)
+
+
+class TagCooccurrenceTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def pairs(self):
+        return sorted(TagCooccurrence.objects.filter(count__gt=0)
+                      .values_list('tag__name', 'other_tag__name', 'count'))
+
+    def test_matrix_follows_tag_writes(self):
+        TagCategory(name='Test Category',
+                    slug='staff-directory-test-category').save()
+        TagCategory(name='Other Category',
+                    slug='staff-directory-other-category').save()
+
+        people = []
+        for name in ['jack', 'jill']:
+            user = UserF(username="%s@example.org" % name)
+            person = Person(user=user)
+            person.save()
+            people.append(person)
+        jack, jill = people
+
+        for person in people:
+            add_tags(person, 'TagA', 'staff-directory-test-category',
+                     jack.user, 'person')
+            add_tags(person, 'TagB', 'staff-directory-test-category',
+                     jack.user, 'person')
+        add_tags(jack, 'TagC', 'staff-directory-test-category',
+                 jack.user, 'person')
+        # a second category does not count the pair twice
+        add_tags(jack, 'TagC', 'staff-directory-other-category',
+                 jack.user, 'person')
+
+        expected = [('TagA', 'TagB', 2), ('TagA', 'TagC', 1),
+                    ('TagB', 'TagA', 2), ('TagB', 'TagC', 1),
+                    ('TagC', 'TagA', 1), ('TagC', 'TagB', 1)]
+        self.assertEqual(self.pairs(), expected)
+
+        tag_a = Tag.objects.get(name='TagA')
+        related = tag_cooccurrence.related_tags([tag_a.pk], 30)
+        self.assertEqual([(t.name, t.tag_count) for t in related],
+                         [('TagB', 2), ('TagC', 1)])
+
+        tag_b = Tag.objects.get(name='TagB')
+        related = tag_cooccurrence.related_tags([tag_a.pk, tag_b.pk], 30)
+        self.assertEqual([(t.name, t.tag_count) for t in related],
+                         [('TagC', 1)])
+
+        TaggedItem.objects.filter(tag__name='TagC', object_id=jack.pk,
+                                  tag_category__slug=
+                                  'staff-directory-test-category').delete()
+        self.assertEqual(self.pairs(), expected)
+        TaggedItem.objects.filter(tag__name='TagC').delete()
+        self.assertEqual(self.pairs(), expected[:1] + expected[2:3])
+
+        TagCooccurrence.objects.all().delete()
+        self.assertEqual(tag_cooccurrence.rebuild(), 2)
+        self.assertEqual(self.pairs(), expected[:1] + expected[2:3])
+
+    def test_related_tags_are_ranked_exactly(self):
+        """
+            Tests tags paired often with each selected tag, but never with
+            all of them, do not push out the tags carried with all of them
+        """
+        TagCategory(name='Test Category',
+                    slug='staff-directory-test-category').save()
+        people = []
+        for n in range(8):
+            user = UserF(username="person%d@example.org" % n)
+            person = Person(user=user)
+            person.save()
+            people.append(person)
+
+        tags = dict((person.pk, ['TagA', 'TagB', 'TagY'])
+                    for person in people[:2])
+        tags.update((person.pk, ['TagA', 'TagX1', 'TagX2', 'TagX3'])
+                    for person in people[2:5])
+        tags.update((person.pk, ['TagB', 'TagX1', 'TagX2', 'TagX3'])
+                    for person in people[5:])
+        for person in people:
+            for name in tags[person.pk]:
+                add_tags(person, name, 'staff-directory-test-category',
+                         person.user, 'person')
+
+        selected = Tag.objects.filter(name__in=['TagA', 'TagB'])
+        related = tag_cooccurrence.related_tags(
+            [tag.pk for tag in selected], 1)
+        self.assertEqual([(t.name, t.tag_count) for t in related],
+                         [('TagY', 2)])
+
+    def test_matrix_follows_counted_people(self):
+        TagCategory(name='Test Category',
+                    slug='staff-directory-test-category').save()
+        user = UserF(username="jack@example.org")
+        person = Person(user=user)
+        person.save()
+        add_tags(person, 'TagA', 'staff-directory-test-category', user,
+                 'person')
+
+        person.hide_profile = True
+        person.save()
+        # a hidden person's tags are not paired
+        add_tags(person, 'TagB', 'staff-directory-test-category', user,
+                 'person')
+        self.assertEqual(self.pairs(), [])
+
+        person.hide_profile = False
+        person.save()
+        expected = [('TagA', 'TagB', 1), ('TagB', 'TagA', 1)]
+        self.assertEqual(self.pairs(), expected)
+
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.pairs(), [])
+        tag_cooccurrence.rebuild()
+        self.assertEqual(self.pairs(), [])
+
+
+class CacheVersionTest(TestCase):
+
+    def test_tag_write_expires_only_affected_groups(self):
+        TagCategory(name='Test Category',
+                    slug='staff-directory-test-category').save()
+
+        people = []
+        for name in ['jack', 'jill']:
+            user = UserF(username="%s@example.org" % name)
+            person = Person(user=user)
+            person.save()
+            people.append(person)
+        jack, jill = people
+
+        tag_a = add_tags(jack, 'TagA', 'staff-directory-test-category',
+                         jack.user, 'person').tag
+        tag_b = add_tags(jill, 'TagB', 'staff-directory-test-category',
+                         jack.user, 'person').tag
+
+        groups = [caching.tag_group(tag_a.pk), caching.tag_group(tag_b.pk),
+                  caching.person_group(jack.pk),
+                  caching.person_group(jill.pk)]
+        before = [caching.group_versions([group]) for group in groups]
+
+        add_tags(jack, 'TagC', 'staff-directory-test-category',
+                 jack.user, 'person')
+
+        after = [caching.group_versions([group]) for group in groups]
+        self.assertNotEqual(before[0], after[0])
+        self.assertEqual(before[1], after[1])
+        self.assertNotEqual(before[2], after[2])
+        self.assertEqual(before[3], after[3])
+
+
+class TagWriteCommitTest(TransactionTestCase):
+
+    def test_reads_before_commit_are_expired(self):
+        """
+            Tests what a request reads between a tag write and its commit is
+            not served once the write commits
+        """
+        cache.clear()
+        user = UserF(username="jack@example.org")
+        person = Person(user=user)
+        person.save()
+        TagCategory(name='Test Category',
+                    slug='staff-directory-test-category').save()
+
+        def fragment_key():
+            return 'fragment_%s' % caching.group_versions(
+                [caching.person_group(person.pk)])
+
+        def read_before_commit(sender, instance, created, **kwargs):
+            # runs after the receivers expired the caches.  a request on
+            # another connection cannot see the new item yet and caches
+            # what it sees under the new versions
+            cache.set(tag_index._key(instance.tag_id), array('l'))
+            cache.set(fragment_key(), 'untagged')
+
+        post_save.connect(read_before_commit, sender=TaggedItem)
+        try:
+            item, created = tagging.add_tag(
+                person, 'TagA', 'staff-directory-test-category', user)
+        finally:
+            post_save.disconnect(read_before_commit, sender=TaggedItem)
+
+        self.assertTrue(created)
+        self.assertEqual(tag_index.person_ids(all_of=[item.tag_id]),
+                         [person.pk])
+        self.assertIsNone(cache.get(fragment_key()))
+
+
+class StaleCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.reset_cache_stats()
+
+    def test_stale_value_served_while_locked(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(caching.get_or_set('k', compute, 60, 'test'), 1)
+        self.assertEqual(caching.get_or_set('k', compute, 60, 'test'), 1)
+
+        # timed out while another request holds the lock
+        entry = cache.get('k')
+        entry['expires'] = time.time() - 1
+        cache.set('k', entry, 60)
+        cache.add('k:lock', 1, 30)
+        self.assertEqual(caching.get_or_set('k', compute, 60, 'test'), 1)
+
+        cache.delete('k:lock')
+        self.assertEqual(caching.get_or_set('k', compute, 60, 'test'), 2)
+        self.assertEqual(caching.cache_stats()['test'], {
+            'hits': 1, 'misses': 1, 'stale': 1, 'refreshes': 1})
+
+
+class WarmingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_are_warmed(self):
+        data.generate(people=10, divisions=1, offices=2, tags=5,
+                      tagged_items=30, praise=5)
+        urls = warming.urls(tags=3)
+        self.assertEqual(len(urls), 1 + OrgGroup.objects.count() + 3)
+
+        user = warming._default_user()
+        self.assertFalse(user.is_superuser)
+        result = warming.warm(threads=1, rate=0, tags=3)
+        self.assertEqual(result['failed'], [])
+        self.assertEqual(result['pages'], len(urls))
+        # warming does not count as the user logging in
+        self.assertEqual(Person.objects.get(user=user).user.last_login,
+                         user.last_login)
+
+    def test_rate_limiter_spaces_calls(self):
+        limiter = warming.RateLimiter(50)
+        start = time.time()
+        for i in range(5):
+            limiter.wait()
+        self.assertTrue(time.time() - start >= 4 / 50.0)
+
+
+class BenchmarkTest(TestCase):
+
+    def test_generated_data_can_be_benchmarked(self):
+        created = data.generate(people=20, divisions=2, offices=2, tags=10,
+                                tagged_items=100, praise=30)
+        self.assertEqual(created['tagged_items'], 100)
+        self.assertEqual(Person.objects.filter(stub__startswith='bench-')
+                         .count(), 20)
+
+        results = harness.run(runs=2)
+        self.assertEqual(set(results), set(harness.VIEWS))
+        self.assertEqual(harness.compare(results, results), [])
+
+        slower = dict(results)
+        slower['index'] = dict(results['index'],
+                               queries=results['index']['queries'] + 1)
+        self.assertEqual(len(harness.compare(slower, results)), 1)
+        if results['index']['peak_kb'] is not None:
+            bigger = dict(results)
+            bigger['index'] = dict(results['index'], peak_kb=(
+                results['index']['peak_kb'] * 2 + harness.PEAK_SLACK_KB + 1))
+            self.assertEqual(len(harness.compare(bigger, results)), 1)
+
+        data.clear()
+        self.assertFalse(Person.objects.filter(stub__startswith='bench-')
+                         .exists())
+
+    def test_plans_are_explained(self):
+        data.generate(people=10, divisions=1, offices=2, tags=5,
+                      tagged_items=30, praise=5)
+        results = plans.audit(views=('person_profile',))
+        self.assertTrue(results['person_profile'])
+        for query in results['person_profile']:
+            self.assertTrue(query['plan'])
+
+    def test_plan_issues(self):
+        self.assertEqual(plans._postgresql_issues([
+            'Sort  (cost=1.0..2.0 rows=1 width=4)',
+            '  Sort Key: core_person.stub',
+            '  ->  Seq Scan on core_person  (cost=0.0..1.0 rows=1 width=4)']),
+            [(plans.FILESORT, ''), (plans.SEQ_SCAN, 'core_person')])
+        self.assertEqual(plans._sqlite_issues([
+            'SEARCH TABLE core_person USING INDEX person_stub (stub=?)',
+            'SCAN TABLE staff_directory_praise',
+            'USE TEMP B-TREE FOR ORDER BY']),
+            [(plans.SEQ_SCAN, 'staff_directory_praise'), (plans.FILESORT, '')])
+        self.assertEqual(plans._mysql_issues(
+            [(1, 'SIMPLE', 'core_person', 'ALL', 'Using filesort')],
+            ['id', 'select_type', 'table', 'type', 'Extra']),
+            [(plans.SEQ_SCAN, 'core_person'), (plans.FILESORT, 'core_person')])
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(harness.percentile(values, 50), 50)
+        self.assertEqual(harness.percentile(values, 95), 95)
+        self.assertEqual(harness.percentile([7], 95), 7)
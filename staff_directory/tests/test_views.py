@@ -1,13 +1,23 @@
+import json
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
 from django.utils.html import escape
 from urllib import urlencode
 
 from core.taggit.utils import add_tags
-from core.taggit.models import TagCategory
+from core.taggit.models import Tag, TagCategory
 from core.models import Person, OrgGroup
 from exam.cases import Exam
+from staff_directory import autocomplete, email_lookup, instrumentation, org_tree, \
+    people_grid, recent_photos
+from staff_directory.models import Praise, QueuedNotification
+from staff_directory.testing import QueryBudgetMixin
 from exam.decorators import before
 
 
@@ -32,6 +42,24 @@ class TagPageTests(Exam, TestCase):
         resp = self.client.get(reverse('staff_directory:show_by_tag', kwargs={'tag_slugs': 'wonderful/outstanding'} ))
         self.assertContains(resp, 'Tagged with Outstanding,Wonderful', status_code=200)
 
+    def test_tag_emails_export(self):
+        """
+            Tests the legacy email list and the CSV export stream the same people.
+        """
+        url = reverse('staff_directory:show_tag_emails', kwargs={'tag_slugs': 'wonderful'})
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        emails = ''.join(resp.streaming_content).split('; ')
+        self.assertTrue(len(emails) > 0)
+
+        resp = self.client.get(url + '?format=people_csv')
+        self.assertEqual(resp['Content-Type'], 'text/csv')
+        rows = ''.join(resp.streaming_content).splitlines()
+        self.assertEqual(rows[0], 'name,email,office,tags')
+        self.assertEqual(len(rows), len(emails) + 1)
+        for email in emails:
+            self.assertIn(email, ''.join(rows))
+
 
 class SmokeTests(Exam, TestCase):
     fixtures = ['core-test-fixtures']
@@ -77,6 +105,356 @@ class SmokeTests(Exam, TestCase):
         self.assertEqual(resp.status_code, 404)
 
 
+class ConditionalGetTests(Exam, TestCase):
+    fixtures = ['core-test-fixtures']
+
+    @before
+    def login(self):
+        self.assertTrue(self.client.login(username='test1@example.com', password='1'))
+
+    def test_profile_page_not_modified(self):
+        """
+            Tests a revalidated profile page is a 304 until the person is tagged.
+        """
+        person = Person.objects.all()[1]
+        url = reverse('staff_directory:person', args=(person.stub,))
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp['ETag']
+
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        add_tags(person, 'TagA', 'staff-directory-my-expertise',
+                 person.user, 'person')
+
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_profile_page_not_modified_with_both_validators(self):
+        """
+            Tests a browser sending If-None-Match and If-Modified-Since
+            together gets a 304, also for a person never expired.
+        """
+        cache.clear()
+        person = Person.objects.all()[1]
+        url = reverse('staff_directory:person', args=(person.stub,))
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('no-cache', resp['Cache-Control'])
+
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'],
+                               HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(resp.status_code, 304)
+
+
+class ProfileCacheTests(Exam, TestCase):
+    fixtures = ['core-test-fixtures']
+
+    @before
+    def login(self):
+        self.assertTrue(self.client.login(username='test1@example.com', password='1'))
+        cache.clear()
+        self.person = Person.objects.exclude(stub='test1').filter(allow_tagging=True)[0]
+        self.url = reverse('staff_directory:person', args=(self.person.stub,))
+
+    def test_shared_fragments_are_cached(self):
+        """
+            Tests a second view of a profile reuses its cached fragments
+        """
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as second:
+            resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(len(second) < len(first))
+
+    def test_tagging_expires_fragments(self):
+        """
+            Tests a new tag is shown on a profile whose fragments were cached
+        """
+        self.client.get(self.url)
+        viewer = get_user_model().objects.get(username='test1@example.com')
+        add_tags(self.person, 'Fresh Tag', 'staff-directory-my-expertise',
+                 viewer, 'person')
+        resp = self.client.get(self.url)
+        self.assertContains(resp, 'Fresh Tag')
+        # the viewer tagged the person, so the overlay lets them remove it
+        self.assertContains(resp, '["fresh-tag", "staff-directory-my-expertise"]')
+
+    def test_user_change_expires_fragments(self):
+        """
+            Tests a renamed user's new name is shown on their cached profile
+        """
+        self.client.get(self.url)
+        user = self.person.user
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertContains(self.client.get(self.url), 'Renamed')
+
+    def test_giver_change_expires_thanks_fragments(self):
+        """
+            Tests a renamed user's new name is shown on the thanks they gave
+        """
+        self.client.post(
+            reverse('staff_directory:thanks', args=(self.person.stub,)),
+            data={'value_type': 'serve', 'reason': 'because!'})
+        self.client.get(self.url)
+        viewer = get_user_model().objects.get(username='test1@example.com')
+        viewer.first_name = 'Renamed'
+        viewer.save()
+        self.assertContains(self.client.get(self.url), 'Renamed')
+
+    def test_office_rename_expires_member_fragments(self):
+        """
+            Tests a renamed office's new title is shown on its members' profiles
+        """
+        org_group = OrgGroup.objects.create(title='Old Office Title')
+        self.person.org_group = org_group
+        self.person.save()
+        self.client.get(self.url)
+        org_group.title = 'New Office Title'
+        org_group.save()
+        self.assertContains(self.client.get(self.url), 'New Office Title')
+
+
+class IndexTests(Exam, TestCase):
+    fixtures = ['core-test-fixtures']
+
+    @before
+    def login(self):
+        self.assertTrue(self.client.login(username='test1@example.com', password='1'))
+        cache.clear()
+
+    def test_index_is_shared_between_viewers(self):
+        """
+            Tests the cached index is reused for another viewer
+        """
+        self.client.get(reverse('staff_directory:index'))
+        self.client.logout()
+        self.assertTrue(self.client.login(username='test2@example.com', password='1'))
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('staff_directory:index'))
+        self.assertEqual(resp.status_code, 200)
+        # neither the photos nor the office lists are read again
+        self.assertFalse([q for q in queries.captured_queries
+                          if 'updated_at" DESC' in q['sql'] or 'core_orggroup' in q['sql']])
+
+    def test_hidden_profile_leaves_recent_photos(self):
+        """
+            Tests a hidden profile is taken out of the recent photos
+        """
+        person = Person.objects.exclude(photo_file=recent_photos.DEFAULT_PHOTO) \
+            .filter(hide_profile=False, user__is_active=True)[0]
+        self.assertIn(person.pk, [entry['pk'] for entry in recent_photos.get_feed()])
+        person.hide_profile = True
+        person.save()
+        self.assertNotIn(person.pk, [entry['pk'] for entry in recent_photos.get_feed()])
+
+    def test_user_changes_update_recent_photos(self):
+        """
+            Tests user changes update the recent photos feed
+        """
+        person = Person.objects.exclude(photo_file=recent_photos.DEFAULT_PHOTO) \
+            .filter(hide_profile=False, user__is_active=True)[0]
+        recent_photos.get_feed()
+        user = person.user
+        user.first_name = 'Renamed'
+        user.save()
+        entry = [entry for entry in recent_photos.get_feed() if entry['pk'] == person.pk]
+        self.assertEqual(entry[0]['first_name'], 'Renamed')
+
+        user.is_active = False
+        user.save()
+        self.assertNotIn(person.pk, [entry['pk'] for entry in recent_photos.get_feed()])
+        user.is_active = True
+        user.save()
+        self.assertIn(person.pk, [entry['pk'] for entry in recent_photos.get_feed()])
+
+
+class QueryBudgetTests(QueryBudgetMixin, Exam, TestCase):
+    fixtures = ['core-test-fixtures']
+
+    @before
+    def login(self):
+        self.assertTrue(self.client.login(username='test1@example.com', password='1'))
+
+    @before
+    def tag_people(self):
+        cache.clear()
+        for person in Person.objects.all():
+            add_tags(person, 'TagA', 'staff-directory-my-expertise',
+                     person.user, 'person')
+
+    def new_people(self, count, **fields):
+        people = []
+        for n in range(count):
+            user = get_user_model().objects.create(
+                username='budget%d@example.com' % n, first_name='Budget',
+                last_name=str(n))
+            people.append(Person.objects.create(user=user,
+                                                stub='budget%d' % n,
+                                                **fields))
+        return people
+
+    def assertQueriesDoNotGrow(self, url, grow):
+        """
+            the budget of url is the count measured before grow adds rows
+            to the page, both times rendered from an empty cache
+        """
+        self.client.get(url)
+        cache.clear()
+        with CaptureQueriesContext(connection) as measured:
+            self.client.get(url)
+        grow()
+        cache.clear()
+        with self.assertQueryBudget(len(measured)):
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_profile_page_budget(self):
+        """
+            Tests the profile page runs as many queries with more tags and
+            thanks from more people
+        """
+        person = Person.objects.all()[1]
+
+        def grow():
+            for n, other in enumerate(self.new_people(3)):
+                add_tags(person, 'Budget Tag %d' % n,
+                         'staff-directory-my-expertise', other.user,
+                         'person')
+                Praise.objects.create(recipient=person,
+                                      praise_nominator=other.user,
+                                      cfpb_value='serve', reason='budget')
+
+        self.assertQueriesDoNotGrow(
+            reverse('staff_directory:person', args=(person.stub,)), grow)
+
+    def test_tag_page_budget(self):
+        """
+            Tests the tag page runs as many queries with more people tagged
+        """
+        def grow():
+            for person in self.new_people(3):
+                add_tags(person, 'TagA', 'staff-directory-my-expertise',
+                         person.user, 'person')
+
+        self.assertQueriesDoNotGrow(
+            reverse('staff_directory:show_by_tag', args=('taga',)), grow)
+
+    def test_org_group_page_budget(self):
+        """
+            Tests the org group page runs as many queries with more people
+            in the group
+        """
+        org_group = OrgGroup.objects.all()[0]
+
+        def grow():
+            for person in self.new_people(3, org_group=org_group):
+                add_tags(person, 'TagA', 'staff-directory-my-expertise',
+                         person.user, 'person')
+
+        self.assertQueriesDoNotGrow(
+            reverse('staff_directory:org_group', args=(org_group.title,)),
+            grow)
+
+    def test_instrumented_views_record_stats(self):
+        """
+            Tests instrumented views record their queries and time
+        """
+        instrumentation.reset_stats()
+        person = Person.objects.all()[1]
+        with self.settings(STAFF_DIR_INSTRUMENTATION=True):
+            self.client.get(
+                reverse('staff_directory:person', args=(person.stub,)))
+        stats = instrumentation.get_stats()['person_profile']
+        self.assertEqual(stats['requests'], 1)
+        self.assertTrue(stats['queries'] > 0)
+
+
+class AutocompleteTests(Exam, TestCase):
+    fixtures = ['core-test-fixtures']
+
+    @before
+    def login(self):
+        self.assertTrue(self.client.login(username='test1@example.com', password='1'))
+
+    @before
+    def expire_index(self):
+        autocomplete.expire()
+
+    def test_tag_autocomplete(self):
+        """
+            Tests tags are suggested by a prefix of their name
+        """
+        resp = self.client.get(reverse('staff_directory:autocomplete', args=('tags',)),
+                               {'term': 'wond'})
+        labels = [tag['label'] for tag in json.loads(resp.content)]
+        self.assertIn('Wonderful', labels)
+
+    def test_person_autocomplete(self):
+        """
+            Tests people are suggested by a prefix of their name
+        """
+        person = Person.objects.filter(user__is_active=True).exclude(user__first_name='')[0]
+        resp = self.client.get(reverse('staff_directory:autocomplete', args=('people',)),
+                               {'term': person.user.first_name[:3]})
+        stubs = [p['stub'] for p in json.loads(resp.content)]
+        self.assertIn(person.stub, stubs)
+
+    def test_search_is_answered_from_memory(self):
+        """
+            Tests a search runs no query once the index is loaded
+        """
+        autocomplete.search('w', autocomplete.TAG)
+        with self.assertNumQueries(0):
+            autocomplete.search('wo', autocomplete.TAG)
+
+    def test_new_tags_are_found(self):
+        """
+            Tests a tag created after the index was loaded is suggested
+        """
+        person = Person.objects.all()[1]
+        self.assertEqual(autocomplete.search('zebra', autocomplete.TAG), [])
+        add_tags(person, 'Zebra Taming', 'staff-directory-my-expertise',
+                 person.user, 'person')
+        labels = [tag['label'] for tag in
+                  autocomplete.search('tam', autocomplete.TAG)]
+        self.assertEqual(labels, ['Zebra Taming'])
+
+    def test_changes_are_applied_without_reloading(self):
+        """
+            Tests changed entries are loaded without reloading the index
+        """
+        person = Person.objects.filter(user__is_active=True,
+                                       hide_profile=False)[0]
+        autocomplete.search('w', autocomplete.TAG)
+        user = person.user
+        user.first_name = 'Quixotic'
+        user.save()
+        # only the changed person is loaded again
+        with self.assertNumQueries(1):
+            stubs = [p['stub'] for p in
+                     autocomplete.search('quix', autocomplete.PERSON)]
+        self.assertEqual(stubs, [person.stub])
+
+    def test_popular_tags_rank_first_among_all_matches(self):
+        """
+            Tests the most used tags come first among every match
+        """
+        person = Person.objects.all()[1]
+        for n in range(15):
+            Tag.objects.create(name='Yak %02d' % n)
+        add_tags(person, 'Yak Shaving', 'staff-directory-my-expertise',
+                 person.user, 'person')
+        labels = [tag['label'] for tag in
+                  autocomplete.search('yak', autocomplete.TAG, limit=3)]
+        self.assertEqual(labels, ['Yak Shaving', 'Yak 00', 'Yak 01'])
+
+
 class TaggingTests(Exam, TestCase):
     fixtures = ['core-test-fixtures']
 
@@ -104,6 +482,71 @@ class TaggingTests(Exam, TestCase):
         self.assertContains(resp, person.full_name, status_code=200)
 
 
+    def test_bulk_add_tag(self):
+        """
+            Tests many people are tagged in one request, skipping people who
+            do not allow tagging and people already tagged.
+        """
+        people = list(Person.objects.exclude(stub='test1')[:3])
+        blocked = people[2]
+        blocked.allow_tagging = False
+        blocked.save()
+
+        add_tags(people[0], 'TagBulk', 'staff-directory-my-expertise',
+                 people[0].user, 'person')
+
+        resp = self.client.post(reverse('staff_directory:bulk_add_tag'), {
+            'tag': 'TagBulk',
+            'tag_category': 'staff-directory-my-expertise',
+            'person_stubs': ','.join([p.stub for p in people] + ['nobody']),
+        })
+        result = json.loads(resp.content)
+
+        self.assertEqual(result['tagged'], [people[1].stub])
+        self.assertEqual(result['already_tagged'], [people[0].stub])
+        self.assertEqual(result['not_allowed'], [blocked.stub])
+        self.assertEqual(result['not_found'], ['nobody'])
+        for person, count in [(people[0], 1), (people[1], 1), (blocked, 0)]:
+            self.assertEqual(
+                person.tags.filter(name='TagBulk').count(), count)
+
+    def test_add_and_remove_tag_are_idempotent(self):
+        """
+            Tests a tag submitted twice is stored and notified once, and
+            removing a tag twice is a no-op the second time.
+        """
+        person = Person.objects.exclude(stub='test1').filter(allow_tagging=True)[0]
+        url = reverse('staff_directory:add_tag', args=(person.stub,))
+        data = {'person_stub': person.stub, 'tag': 'TagTwice',
+                'tag_category_slug': 'staff-directory-my-expertise'}
+        queued = QueuedNotification.objects.count()
+
+        self.client.post(url, data)
+        self.client.post(url, data)
+        self.assertEqual(person.tags.filter(name='TagTwice').count(), 1)
+        self.assertEqual(QueuedNotification.objects.count(), queued + 1)
+
+        url = reverse('staff_directory:remove_tag', args=(
+            person.stub, 'tagtwice', 'staff-directory-my-expertise'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.assertEqual(person.tags.filter(name='TagTwice').count(), 0)
+        self.assertEqual(QueuedNotification.objects.count(), queued + 2)
+
+    def test_only_owner_or_tagger_removes_tag(self):
+        """
+            Tests a viewer cannot remove a tag someone else gave a person.
+        """
+        person = Person.objects.exclude(stub='test1')[0]
+        add_tags(person, 'TagOwn', 'staff-directory-my-expertise',
+                 person.user, 'person')
+
+        resp = self.client.get(reverse('staff_directory:remove_tag', args=(
+            person.stub, 'tagown', 'staff-directory-my-expertise')))
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(person.tags.filter(name='TagOwn').count(), 1)
+
+
 class OrgGroupTest(Exam, TestCase):
     fixtures = ['core-test-fixtures']
 
@@ -111,6 +554,11 @@ class OrgGroupTest(Exam, TestCase):
     def login(self):
         self.assertTrue(self.client.login(username='test1@example.com', password='1'))
 
+    @before
+    def clear_cache(self):
+        # the tag index outlives the rolled back rows of earlier tests
+        cache.clear()
+
     def test_org_group_page(self):
         """
             Tests the org group page appears with no errors.
@@ -138,6 +586,68 @@ class OrgGroupTest(Exam, TestCase):
         self.assertNotContains(resp, escape(
             person_not_tagged.full_name), status_code=200)
 
+    def test_moved_person_leaves_old_office_page(self):
+        """
+            Tests a person who moved is no longer listed on their old office's page
+        """
+        org = OrgGroup.objects.filter(pk=69)[0]
+        person = org.person_set.all()[0]
+        url = reverse('staff_directory:org_group', args=(org.title, ))
+        self.assertContains(self.client.get(url), escape(person.full_name))
+
+        person.org_group = OrgGroup.objects.create(title='New Office')
+        person.save()
+        self.assertNotContains(self.client.get(url),
+                               escape(person.full_name))
+
+    def test_people_grid_pages(self):
+        """
+            Tests paging through a group with the cursor returns everyone once.
+        """
+        org = OrgGroup.objects.filter(pk=69)[0]
+        people = org.person_set.all()
+        stubs, cursor = [], None
+        while True:
+            grid = people_grid.page(people, cursor, size=1)
+            stubs.extend(person['stub'] for person in grid['people'])
+            cursor = grid['next']
+            if cursor is None:
+                break
+        self.assertEqual(sorted(stubs), sorted(p.stub for p in people))
+
+        url = reverse('staff_directory:org_group', args=(org.title, ))
+        resp = self.client.get(url, {'format': 'people_json'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(json.loads(resp.content)['people']),
+                         min(len(stubs), people_grid.PEOPLE_PAGE_SIZE))
+        resp = self.client.get(url, {'format': 'people_json', 'cursor': 'x'})
+        self.assertIn('error', json.loads(resp.content))
+
+
+    def test_division_page_includes_nested_offices(self):
+        """
+            Tests a division lists people from offices at any depth below it.
+        """
+        division = OrgGroup(title='Nested Division')
+        division.save()
+        office = OrgGroup(title='Nested Office', parent=division)
+        office.save()
+        team = OrgGroup(title='Nested Team', parent=office)
+        team.save()
+
+        person = Person.objects.all()[1]
+        person.org_group = team
+        person.save()
+
+        self.assertEqual(sorted(org_tree.descendant_ids(division.pk)),
+                         sorted([division.pk, office.pk, team.pk]))
+
+        profile_url = reverse('staff_directory:person', args=(person.stub,))
+        for org in [division, office, team]:
+            resp = self.client.get(reverse('staff_directory:org_group',
+                                           args=(org.title, )))
+            self.assertContains(resp, profile_url, status_code=200)
+
 
 class StaffThanksTest(Exam, TestCase):
     fixtures = ['core-test-fixtures']
@@ -194,6 +704,10 @@ class LookupTest(Exam, TestCase):
         self.url = reverse('staff_directory:lookup')
         self.root = 'http://testserver'
 
+    @before
+    def expire_lookups(self):
+        email_lookup.expire()
+
     def test_post_forbidden(self):
         resp = self.client.post(self.url)
         self.assertEqual(resp.status_code, 405)
@@ -231,3 +745,70 @@ class LookupTest(Exam, TestCase):
             resp['Location'],
             self.root + reverse('staff_directory:person', args=('test1',))
         )
+
+    def test_email_change_is_picked_up(self):
+        """
+            Tests a changed email address is looked up to its profile
+        """
+        self.assertEqual(self.client.get(self.url + '?email=test1.1@example.com').status_code, 302)
+        user = Person.objects.get(stub='test1').user
+        user.email = 'renamed@example.com'
+        user.save()
+        self.assertEqual(self.client.get(self.url + '?email=test1.1@example.com').status_code, 404)
+        self.assertEqual(self.client.get(self.url + '?email=Renamed@example.com').status_code, 302)
+
+    def test_shared_email_passes_on(self):
+        """
+            Tests a shared address passes to another profile when it is given up
+        """
+        user = get_user_model().objects.create(username='shared@example.com',
+                                               email='TEST1.1@example.com')
+        Person.objects.create(user=user, stub='shared')
+        other = get_user_model().objects.create(username='other@example.com',
+                                                email='test1.1@example.com')
+        Person.objects.create(user=other, stub='other')
+        self.assertEqual(email_lookup.resolve_one('test1.1@example.com'),
+                         'test1')
+
+        user = Person.objects.get(stub='test1').user
+        user.email = 'renamed@example.com'
+        user.save()
+        self.assertEqual(email_lookup.resolve_one('test1.1@example.com'),
+                         'shared')
+
+        Person.objects.get(stub='shared').delete()
+        self.assertEqual(email_lookup.resolve_one('test1.1@example.com'),
+                         'other')
+
+    def test_lookup_many(self):
+        """
+            Tests many addresses are resolved in one request
+        """
+        resp = self.client.post(reverse('staff_directory:lookup_many'),
+                                {'emails': 'TEST1.1@example.com, nobody@example.com'})
+        people = json.loads(resp.content)['people']
+        self.assertEqual(people, {
+            'TEST1.1@example.com': reverse('staff_directory:person', args=('test1',)),
+            'nobody@example.com': None,
+        })
+
+    def test_lookup_many_checks_csrf(self):
+        """
+            Tests a POST without the CSRF token is refused
+        """
+        client = Client(enforce_csrf_checks=True)
+        self.assertTrue(client.login(username='test1@example.com',
+                                     password='1'))
+        resp = client.post(reverse('staff_directory:lookup_many'),
+                           {'emails': 'test1.1@example.com'})
+        self.assertEqual(resp.status_code, 403)
+
+    def test_lookup_many_is_cached(self):
+        """
+            Tests resolved addresses are answered from memory
+        """
+        url = reverse('staff_directory:lookup_many')
+        self.client.get(url, {'email': 'test1.1@example.com'})
+        with self.assertNumQueries(0):
+            self.assertEqual(email_lookup.resolve(['test1.1@example.com']),
+                             {'test1.1@example.com': 'test1'})
@@ -0,0 +1,122 @@
+"""
+Pagination of the staff thanks list.
+
+Pages are addressed by a keyset cursor on (date_added, id) so deep pages
+cost the same as the first one, and the total used for the page links is a
+cached count kept current by the Praise receivers instead of a COUNT(*) per
+request.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+from staff_directory import instrumentation
+from staff_directory.models import Praise
+
+THANKS_COUNT_KEY = 'staff_dir_thanks_count'
+THANKS_COUNT_TIMEOUT = 60 * 60 * 24
+
+THANKS_ORDER = ('-date_added', '-id')
+
+
+def thanks_count():
+    count = cache.get(THANKS_COUNT_KEY)
+    instrumentation.record_cache(hits=int(count is not None),
+                                 misses=int(count is None))
+    if count is None:
+        count = Praise.objects.count()
+        cache.set(THANKS_COUNT_KEY, count, THANKS_COUNT_TIMEOUT)
+    return count
+
+
+def adjust_thanks_count(delta):
+    try:
+        cache.incr(THANKS_COUNT_KEY, delta)
+    except ValueError:
+        # not cached, the next read counts the table
+        pass
+
+
+class CachedCountPaginator(Paginator):
+    """
+        Paginator using the cached thanks count instead of COUNT(*)
+    """
+    @property
+    def count(self):
+        return thanks_count()
+
+
+class KeysetPage(object):
+    """
+        a page of thanks fetched relative to a cursor; number is carried
+        along in the links so it is approximate once new thanks arrive
+    """
+    def __init__(self, object_list, number, has_next, has_previous):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return max(self.number - 1, 1)
+
+
+def thanks_page(queryset, per_page, before=None, after=None, number=1):
+    """
+        the page of thanks older than the praise with pk before, or newer
+        than the praise with pk after; None when the cursor is unknown
+    """
+    cursor = before or after
+    cursor_date = Praise.objects.filter(pk=cursor) \
+        .values_list('date_added', flat=True)[:1]
+    if not cursor_date:
+        return None
+    cursor_date = cursor_date[0]
+
+    if before:
+        rows = list(queryset.filter(
+            Q(date_added__lt=cursor_date) |
+            Q(date_added=cursor_date, id__lt=cursor))
+            .order_by(*THANKS_ORDER)[:per_page + 1])
+        return KeysetPage(rows[:per_page], number,
+                          has_next=len(rows) > per_page, has_previous=True)
+
+    rows = list(queryset.filter(
+        Q(date_added__gt=cursor_date) |
+        Q(date_added=cursor_date, id__gt=cursor))
+        .order_by('date_added', 'id')[:per_page + 1])
+    rows.reverse()
+    has_previous = len(rows) > per_page
+    return KeysetPage(rows[-per_page:], number if has_previous else 1,
+                      has_next=True, has_previous=has_previous)
+
+
+def flex_page_range(mypage, total_pages, bottom_limit=15):
+    """
+        an array of bottom_limit (or less) numbers centered around the
+        current page.  For example, if there are 100 pages and the current
+        page is 35, the range will be [28 ... 42]
+    """
+    if mypage <= bottom_limit // 2:
+        return range(1, min(bottom_limit, total_pages) + 1)
+    elif mypage > (total_pages - bottom_limit // 2):
+        return range(max(total_pages - bottom_limit, 1), total_pages + 1)
+    else:
+        return range(mypage - bottom_limit // 2,
+                     mypage + bottom_limit // 2 + 1)
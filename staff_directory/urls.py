@@ -11,9 +11,18 @@ urlpatterns = patterns('staff_directory.views',
                        url(r'^person/(?P<stub>.*)/$',
                            'person_profile', name='person'),
                        url(r'^lookup/$', 'lookup', name='lookup'),
+                       url(r'^lookup/many/$', 'lookup_many',
+                           name='lookup_many'),
+                       url(r'^stats/$', 'stats', name='stats'),
+                       url(r'^autocomplete/(?P<kind>people|tags)/$',
+                           'autocomplete_json', name='autocomplete'),
                        url(r'^thanks/$', 'show_thanks', name='show_thanks'),
+                       url(r'^thanks/stats/$', 'thanks_stats',
+                           name='thanks_stats'),
                        url(r'^add-person-to-tag/(?P<tag>[^/]+)/', 'add_person_to_tag',
                            name='add_person_to_tag'),
+                       url(r'^add-people-to-tag/$', 'bulk_add_tag',
+                           name='bulk_add_tag'),
                        url(r'^add/tag/(?P<person_stub>[^/]+)/$', 'add_tag',
                            name='add_tag'),
                        url(r'^add/tag/(?P<person_stub>[^/]+)/(?P<tag>[^/]+)/$',
@@ -0,0 +1,106 @@
+"""
+ETag and Last-Modified functions for django.views.decorators.http.condition.
+
+They are computed from cheap version stamps (Person.updated_at and the
+cache group versions bumped by the receivers) so a revalidating browser
+gets its 304 before the view runs any of its heavy queries.  Pages carry
+viewer specific bits, so the viewer, their CSRF token and the query string
+are part of every ETag.
+"""
+import calendar
+import hashlib
+import time
+from datetime import datetime
+
+from django.middleware.csrf import get_token
+from django.utils import timezone
+
+from core.models import Person
+from core.taggit.models import Tag
+from staff_directory import org_tree
+from staff_directory.caching import group_versions, last_changed, \
+    org_group_group, person_group, tag_group
+from staff_directory.request_people import person_by_stub
+
+
+def _etag(req, *parts):
+    parts = parts + (req.user.pk, get_token(req), req.GET.urlencode())
+    return hashlib.md5(
+        ':'.join(unicode(part) for part in parts).encode('utf-8')) \
+        .hexdigest()
+
+
+def _timestamp(value):
+    if timezone.is_aware(value):
+        return calendar.timegm(value.utctimetuple())
+    return time.mktime(value.timetuple())
+
+
+def _last_modified(groups, updated_at=None):
+    changed = last_changed(groups)
+    if updated_at is not None:
+        changed = max(changed, _timestamp(updated_at))
+    return datetime.utcfromtimestamp(changed)
+
+
+def _profile_state(req, stub):
+    # the person is kept on the request for the view that follows
+    try:
+        person = person_by_stub(req, stub)
+    except Person.DoesNotExist:
+        return None
+    return (person.pk, person.updated_at, person.hide_profile,
+            person.user.is_active)
+
+
+def profile_etag(req, stub):
+    state = _profile_state(req, stub)
+    if state is None:
+        return None
+    return _etag(req, 'profile', group_versions([person_group(state[0])]),
+                 *state)
+
+
+def profile_last_modified(req, stub):
+    state = _profile_state(req, stub)
+    if state is None:
+        return None
+    return _last_modified([person_group(state[0])], state[1])
+
+
+def _tag_groups(req, tag_slugs):
+    if not hasattr(req, '_staff_dir_tag_groups'):
+        slugs = [t for t in tag_slugs.split('/') if t]
+        req._staff_dir_tag_groups = [
+            tag_group(pk) for pk in
+            Tag.objects.filter(slug__in=slugs).values_list('pk', flat=True)]
+    return req._staff_dir_tag_groups
+
+
+def tag_page_etag(req, tag_slugs='', new_tag_slug=''):
+    groups = _tag_groups(req, tag_slugs)
+    if not groups:
+        return None
+    return _etag(req, 'tags', tag_slugs, group_versions(groups))
+
+
+def tag_page_last_modified(req, tag_slugs='', new_tag_slug=''):
+    groups = _tag_groups(req, tag_slugs)
+    if not groups:
+        return None
+    return _last_modified(groups)
+
+
+def org_group_etag(req, title, tag_slugs=''):
+    org_group = org_tree.get_by_title(title)
+    if org_group is None:
+        return None
+    return _etag(req, 'org_group', title, tag_slugs,
+                 group_versions([org_group_group(org_group.pk)]))
+
+
+def org_group_last_modified(req, title, tag_slugs=''):
+    org_group = org_tree.get_by_title(title)
+    if org_group is None:
+        return None
+    return _last_modified([org_group_group(org_group.pk)])
@@ -1,39 +1,50 @@
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
-from django.db.models import Count, Q
+from django.db.models import Count
 from django.http import (
     Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect
 )
-from django.shortcuts import render_to_response, get_object_or_404
+from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.template.defaultfilters import slugify
 from django.core.context_processors import csrf
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.paginator import EmptyPage, PageNotAnInteger
 from django.views.decorators.csrf import csrf_protect
 from django.conf import settings
-from django.views.decorators.cache import cache_page
 from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
 from urllib import urlencode
-
-from cache_tools.tools import expire_cache_group
+from datetime import date
+from functools import partial
+import json
 
 from core.utils import json_response
-from core.taggit.utils import add_tags
-from core.helpers import user_has_profile
 from core.models import Person, OrgGroup
-from core.notifications.models import Notification
 from core.notifications.email import EmailInfo
-from core.taggit.models import Tag, TaggedItem
+from core.taggit.models import Tag, TagCategory, TaggedItem
 from staff_directory.helpers import _apply_profile_filters, \
-    _get_emails_for_tag, _query_profile_tags, _query_tags_for_people, \
-    _set_remove_tag_permission, _set_taggers, STAFF_DIR_TAG_CATEGORIES
+    _get_people_for_tag, _query_profile_tags, _query_tags_for_people, \
+    STAFF_DIR_TAG_CATEGORIES
+from staff_directory import autocomplete, caching, email_lookup, export, \
+    instrumentation, org_tree, people_grid, praise_stats, recent_photos, \
+    tag_cooccurrence, tag_counts, tag_index, tagging, validators
+from staff_directory.caching import group_versions, org_group_group, \
+    person_group, tag_group
+from staff_directory.instrumentation import instrumented
+from staff_directory.request_people import current_person, person_by_stub
+from staff_directory.thanks import CachedCountPaginator, THANKS_ORDER, \
+    flex_page_range, thanks_page
 
-from decorators import registration_required, user_allows_tagging
-from models import Praise
+from decorators import always_revalidate, registration_required, \
+    user_allows_tagging
+from models import Praise, QueuedNotification
 
 
 
 TEMPLATE_PATH = 'staff_directory/'
+LOOKUP_BATCH_LIMIT = getattr(settings, 'STAFF_DIR_LOOKUP_BATCH_LIMIT', 500)
+# ten years of monthly thanks stats
+THANKS_STATS_MAX_MONTHS = 120
 
 
 def _create_params(req):
@@ -47,82 +58,88 @@ def _create_params(req):
     return p
 
 
+def _render(req, template_name, p):
+    with instrumentation.template_timer():
+        return render_to_response(template_name, p,
+                                  context_instance=RequestContext(req))
+
+
 def _add_person_data(req, p, person):
     p['person'] = person
-    p['what_i_do_tags'] = _query_profile_what_i_do_tags(req, person)
-    p['current_projects_tags'] = \
-        _query_profile_current_projects_tags(req, person)
-    p['other_tags'] = _query_profile_other_tags(req, person)
+    p['is_owner'] = person.user_id == req.user.id
+    p['person_version'] = group_versions([person_group(person.pk)])
+
+    # the tags and thanks are only loaded when a cached fragment of the
+    # profile has to be rendered again
+    loaded = {}
+
+    def category_tags(slug):
+        def load():
+            if 'tags' not in loaded:
+                loaded['tags'] = _query_profile_tags(req, person)
+            return loaded['tags'][slug]
+        return load
+
+    p['what_i_do_tags'] = category_tags('staff-directory-my-expertise')
+    p['current_projects_tags'] = category_tags('staff-directory-my-projects')
+    p['other_tags'] = category_tags('staff-directory-other-things')
     p['thanks'] = Praise.objects.filter(recipient=person). \
         order_by('-date_added'). \
         select_related('praise_nominator',
                        'praise_nominator__person')
 
 
-def _query_profile_what_i_do_tags(req, person):
-    tags = _query_profile_tags(req, 'staff-directory-my-expertise',
-                               person.id)
-    tags = _set_remove_tag_permission(req, person, tags)
-    tags = _set_taggers(req, person, tags, 'staff-directory-my-expertise')
-
-    return tags
-
-
-def _query_profile_current_projects_tags(req, person):
-    tags = _query_profile_tags(req, 'staff-directory-my-projects',
-                               person.id)
-    tags = _set_remove_tag_permission(req, person, tags)
-    tags = _set_taggers(req, person, tags, 'staff-directory-my-projects')
-
-    return tags
-
-
-def _query_profile_other_tags(req, person):
-    tags = _query_profile_tags(req, 'staff-directory-other-things',
-                               person.id)
-    tags = _set_remove_tag_permission(req, person, tags)
-    tags = _set_taggers(req, person, tags, 'staff-directory-other-things')
-    return tags
+def _removable_tags(req, person):
+    """
+        the viewer's part of a profile: the (tag slug, category slug) pairs
+        they tagged the person with and so may remove
+    """
+    return list(TaggedItem.objects.filter(
+        content_type=tag_index.person_content_type(), object_id=person.pk,
+        tag_creator=req.user.pk)
+        .values_list('tag__slug', 'tag_category__slug'))
 
 
+@instrumented
 @login_required
 @registration_required
-@cache_page(60 * 2)
 def index(req, format='html'):
     """
     index of fedmash, display photos of new staff, teams and popular tags
     """
-    if not user_has_profile(req.user):
+    if current_person(req) is None:
         return HttpResponseRedirect(reverse('core:register'))
     p = _create_params(req)
-    people = _apply_profile_filters(Person.objects)
-    p['recent_photos'] = people.filter(
-        ~Q(photo_file="avatars/default.jpg")).order_by('-updated_at')[:20]
-    p['divisions'] = OrgGroup.objects.filter(parent=None).order_by('title')
-    p['offices'] = OrgGroup.objects.exclude(parent=None).order_by(
-        'parent__title', 'title')
-    p['tags'] = Tag.objects.filter(
-        person__user__is_active=True,
-        taggit_taggeditem_items__content_type__name='person'). \
-        annotate(tag_count=Count('taggit_taggeditem_items')). \
-        filter(tag_count__gte=20).order_by('-tag_count', 'name')
-    return render_to_response(TEMPLATE_PATH + 'directory.html', p,
-                              context_instance=RequestContext(req))
-
-
+    # shared by every viewer, only the page around them is per user
+    p['recent_photos'] = recent_photos.get_feed()
+    groups = org_tree.get_tree()['groups'].values()
+    p['divisions'] = sorted((g for g in groups if g.parent_id is None),
+                            key=lambda g: g.title)
+    p['offices'] = sorted((g for g in groups if g.parent_id is not None),
+                          key=lambda g: (g.parent.title, g.title))
+    p['org_tree_version'] = group_versions([org_tree.ORG_TREE_GROUP])
+    p['tags'] = tag_counts.popular_tags(20)
+    return _render(req, TEMPLATE_PATH + 'directory.html', p)
+
+
+@instrumented
 @login_required
-@never_cache
+@always_revalidate
+@condition(etag_func=validators.profile_etag,
+           last_modified_func=validators.profile_last_modified)
 def person_profile(req, stub):
     """
         display user's profile page
     """
 
-    user = get_object_or_404(get_user_model(), person__stub=stub)
+    try:
+        person = person_by_stub(req, stub)
+    except Person.DoesNotExist:
+        raise Http404
+    user = person.user
 
     p = _create_params(req)
 
-    person = user.get_profile()
-
     if not user.is_active or person.hide_profile:
         raise Http404
 
@@ -132,14 +149,13 @@ def person_profile(req, stub):
 
     p['tagging_allowed'] = (person.allow_tagging) or (user == req.user)
     p['draft_thanks'] = req.GET.get('draft_thanks') or None
+    if not p['is_owner']:
+        p['removable_tags'] = json.dumps(_removable_tags(req, person))
 
-    return render_to_response(
-        TEMPLATE_PATH + 'profile.html',
-        p,
-        context_instance=RequestContext(req)
-    )
+    return _render(req, TEMPLATE_PATH + 'profile.html', p)
 
 
+@instrumented
 @csrf_protect
 @login_required
 def add_person_to_tag(req, tag=''):
@@ -147,11 +163,86 @@ def add_person_to_tag(req, tag=''):
         person_stub = req.POST.get('person_stub', '').strip()
         tag_category = req.POST.get('tag_category',
                                     'staff-directory-other-things').strip()
-        expire_cache_group('tags')
         return add_tag(req, person_stub, tag,
                        tag_category, True, True)
 
 
+def _tagged_notification(req, person, tag):
+    """
+        an unsaved queue entry telling person they were tagged with tag
+    """
+    url = reverse('staff_directory:person', args=[person.stub])
+    email_info = EmailInfo(
+        subject='You were tagged in the staff directory!',
+        text_template='staff_directory/email/user_tagged.txt',
+        html_template='staff_directory/email/user_tagged.html',
+        to_address=person.user.email,
+    )
+    title = '%s %s tagged you with "%s"' % \
+        (req.user.first_name, req.user.last_name, tag)
+    return QueuedNotification.objects.build(
+        req.user, req.user, "tagged", tag, person.user, title, url,
+        email_info)
+
+
+@instrumented
+@csrf_protect
+@login_required
+def bulk_add_tag(req):
+    """
+        tags many people with one tag in a single request and transaction,
+        skipping people who do not allow tagging
+    """
+    if req.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    tag = req.POST.get('tag', '').strip()
+    category_slug = req.POST.get('tag_category',
+                                 'staff-directory-other-things').strip()
+    stubs = []
+    for value in req.POST.getlist('person_stubs'):
+        stubs.extend(stub.strip() for stub in value.split(',')
+                     if stub.strip())
+
+    if tag == '':
+        return json_response({'error':
+                             'Please enter a tag that is not blank.'})
+    elif not stubs:
+        return json_response({'error': 'Person not found.'})
+
+    people = list(Person.objects.filter(stub__in=stubs)
+                  .select_related('user'))
+    allowed = [person for person in people
+               if person.allow_tagging or person.user_id == req.user.id]
+
+    try:
+        tag_obj, tagged = tagging.bulk_add_tag(allowed, tag, category_slug,
+                                               req.user)
+    except TagCategory.DoesNotExist:
+        return json_response({'error': 'Tag category not found.'})
+
+    # tagging.bulk_add_tag expired the directory's groups of the tagged
+    # people in one pass, core keeps a cache of each person of its own
+    for person in tagged:
+        person.expire_cache()
+    QueuedNotification.objects.enqueue_many(
+        [_tagged_notification(req, person, tag) for person in tagged
+         if person.user_id != req.user.id])
+
+    found = set(person.stub for person in people)
+    allowed_stubs = set(person.stub for person in allowed)
+    tagged_stubs = set(person.stub for person in tagged)
+    return json_response({
+        'redirect': reverse('staff_directory:show_by_tag',
+                            args=[tag_obj.slug]),
+        'tagged': sorted(tagged_stubs),
+        'already_tagged': sorted(allowed_stubs - tagged_stubs),
+        'not_allowed': sorted(found - allowed_stubs),
+        'not_found': sorted(set(stubs) - found),
+    })
+
+
+@instrumented
 @csrf_protect
 @login_required
 @user_allows_tagging
@@ -171,31 +262,19 @@ def add_tag(req, person_stub='', tag='', category_slug='', is_ajax=False,
         elif person_stub == '':
             return json_response({'error':
                                  'Person not found.'})
-        person = Person.objects.get(stub=person_stub)
-        # make sure tag does not already exist
+        person = person_by_stub(req, person_stub)
         try:
-            taggeditem = TaggedItem.objects.get(
-                tag_category__slug=category_slug, object_id=person.id,
-                tag__name__iexact=tag)
-        except Exception:
-            taggeditem = add_tags(person, tag, category_slug, req.user,
-                                  'person')
+            taggeditem, created = tagging.add_tag(person, tag, category_slug,
+                                                  req.user)
+        except TagCategory.DoesNotExist:
+            return json_response({'error': 'Tag category not found.'})
+
+        # caches and the tagged person are left alone when already tagged
+        if created:
             person.expire_cache()
-            expire_cache_group('tags')
-
-        url = reverse('staff_directory:person', args=[person.stub])
-        if person.user != req.user:
-            email_info = EmailInfo(
-                subject='You were tagged in the staff directory!',
-                text_template='staff_directory/email/user_tagged.txt',
-                html_template='staff_directory/email/user_tagged.html',
-                to_address=person.user.email,
-            )
-            # set notification
-            title = '%s %s tagged you with "%s"' % \
-                (req.user.first_name, req.user.last_name, tag)
-            Notification.set_notification(req.user, req.user, "tagged", tag,
-                                          person.user, title, url, email_info)
+            if person.user != req.user:
+                QueuedNotification.objects.enqueue_many(
+                    [_tagged_notification(req, person, tag)])
         if is_ajax:
             if redirect_to_tags_page:
                 return json_response({'redirect':
@@ -208,21 +287,23 @@ def add_tag(req, person_stub='', tag='', category_slug='', is_ajax=False,
                                                 args=[person.stub]))
 
 
+@instrumented
 @login_required
 def remove_tag(req, person_stub, tag_slug, tag_category):
     """
         web service to remove tag from profile, users are only able to
         remove their own tags
     """
-    person = Person.objects.get(stub=person_stub)
-    tag = Tag.objects.get(slug=tag_slug)
-    taggeditem = TaggedItem.objects.get(tag_category__slug=tag_category,
-                                        object_id=person.id, tag=tag)
-    taggeditem.delete()
-    person.expire_cache()
-    expire_cache_group('tags')
+    person = person_by_stub(req, person_stub)
+    taggeditem = tagging.remove_tag(person, tag_slug, tag_category,
+                                    req.user)
 
     url = reverse('staff_directory:person', args=[person.stub])
+    if taggeditem is None:
+        return HttpResponseRedirect(url)
+
+    person.expire_cache()
+    tag = taggeditem.tag
 
     if person.user != req.user:
         # create email info
@@ -233,16 +314,31 @@ def remove_tag(req, person_stub, tag_slug, tag_category):
             to_address=person.user.email,
         )
 
-        # set notification
+        # queue notification
         title = '%s %s removed the "%s" tag from your profile' % \
             (req.user.first_name, req.user.last_name, tag)
-        Notification.set_notification(req.user, req.user, "untagged", tag,
-                                      person.user, title, url, email_info)
+        QueuedNotification.objects.enqueue(
+            req.user, req.user, "untagged", tag, person.user, title, url,
+            email_info)
     return HttpResponseRedirect(url)
 
 
+def _people_json(req, people):
+    """
+        a page of the people grid of a group page, following ?cursor=
+    """
+    try:
+        return json_response(
+            people_grid.page(people, req.GET.get('cursor')))
+    except ValueError:
+        return json_response({'error': 'Invalid cursor.'})
+
+
+@instrumented
 @login_required
 @registration_required
+@condition(etag_func=validators.org_group_etag,
+           last_modified_func=validators.org_group_last_modified)
 def org_group(req, title, tag_slugs=''):
     """
         team page, display users in a team
@@ -252,18 +348,14 @@ def org_group(req, title, tag_slugs=''):
     p = _create_params(req)
     p['title'] = title
 
-    org_groups = OrgGroup.objects.filter(title=title).select_related()
+    org_group = org_tree.get_by_title(title)
 
-    if len(org_groups) == 0:
+    if org_group is None:
         raise Http404
 
-    org_group = org_groups[0]
-    if not org_group.parent:
-        people = _apply_profile_filters(Person.objects)
-        people = people.filter(Q(org_group=org_group) |
-                    Q(org_group__parent=org_group))
-    else:
-        people = _apply_profile_filters(org_group.person_set)
+    # the group itself and every office below it, at any depth
+    people = _apply_profile_filters(Person.objects).filter(
+        org_group__in=org_tree.descendant_ids(org_group.pk))
 
     if tag_slugs != '':
         tag_slugs_list = [t for t in tag_slugs.split('/')]
@@ -271,35 +363,43 @@ def org_group(req, title, tag_slugs=''):
         selected_tag_pks = [t.pk for t in selected_tags]
         p['selected_tags'] = '/'.join([t.slug for t in selected_tags])
 
-        people = people.filter(tags__pk__in=selected_tag_pks).distinct()
+        people = tag_index.filter_people(people, any_of=selected_tag_pks)
 
         p['title'] = title + " tagged with: " + ', '.join(
             [t.name for t in selected_tags])
 
+    if req.GET.get('format') == people_grid.PEOPLE_JSON_FORMAT:
+        return _people_json(req, people)
+
     p['tags'] = _query_tags_for_people(people)
     p['tag_category_names'] = {
         'staff-directory-my-projects': 'Projects',
         'staff-directory-my-expertise': 'Expertise',
         'staff-directory-other-things': 'Other Things',
     }
-    p['people'] = people
+    # the first page, only rendered when the fragment is not cached
+    p['people_page'] = partial(people_grid.page, people)
     p['org_group'] = org_group
+    p['cache_version'] = group_versions([org_group_group(org_group.pk)])
 
-    if req.GET.get('format', '') == 'csv':
-        emails = people.values_list('user__email', flat=True)
-        emails_text = '; '.join(emails)
-        return HttpResponse(emails_text)
+    export_format = req.GET.get('format', '')
+    if export_format in (export.EMAILS_FORMAT, export.PEOPLE_CSV_FORMAT):
+        return export.export_response(people, export_format,
+                                      slugify(p['title']))
     else:
-        return render_to_response(TEMPLATE_PATH + 'display_group.html', p,
-                                  context_instance=RequestContext(req))
+        return _render(req, TEMPLATE_PATH + 'display_group.html', p)
 
 
+@instrumented
 @login_required
 @csrf_protect
 def thanks(req, stub):
     if req.method == 'POST':
         praise = Praise()
-        praise.recipient = get_object_or_404(Person, stub=stub)
+        try:
+            praise.recipient = person_by_stub(req, stub)
+        except Person.DoesNotExist:
+            raise Http404
         praise.praise_nominator = req.user
         praise.cfpb_value = req.POST.get('value_type', '').lower()
         praise.reason = req.POST.get('reason', '')
@@ -310,48 +410,83 @@ def thanks(req, stub):
         raise Http404
 
 
+@instrumented
 @login_required
 def show_thanks(req):
     p = _create_params(req)
-    thanks_list = Praise.objects.all().order_by('-date_added'). \
+    thanks_list = Praise.objects.all().order_by(*THANKS_ORDER). \
         select_related('praise_nominator', 'recipient',
                        'praise_nominator__person', 'recipient__user')
     items_per_page = getattr(settings, 'STAFF_THANKS_PAGINATION_LIMIT', 10)
-    paginator = Paginator(thanks_list, items_per_page)
+    paginator = CachedCountPaginator(thanks_list, items_per_page)
     page_num = req.GET.get('page_num')
 
+    page = None
+    before = req.GET.get('before', '')
+    after = req.GET.get('after', '')
+    if before.isdigit() or after.isdigit():
+        # cursor links carry the page number along only for display
+        number = int(page_num) if (page_num or '').isdigit() else 1
+        page = thanks_page(thanks_list, items_per_page,
+                           before=int(before) if before.isdigit() else None,
+                           after=int(after) if after.isdigit() else None,
+                           number=number)
+
     # Parse the page number, if any.  Copied from this guide:
     # https://docs.djangoproject.com/en/1.6/topics/pagination/
-    try:
-        page = paginator.page(page_num)
-    except PageNotAnInteger:
-        # If page is not an integer, deliver first page.
-        page = paginator.page(1)
-    except EmptyPage:
-        # If page is out of range (e.g. 9999), deliver last page of results.
-        page = paginator.page(paginator.num_pages)
-
-    total_pages = page.paginator.num_pages
-    mypage = page.number
-    bottom_limit = 15
-    # flex_range is an array of 15 (or less) numbers centered around the
-    # current page.  For example, if there are 100 pages and the current
-    # page is 35, the range will be [28 ... 42]
-    if mypage <= bottom_limit/2:
-        flex_range = range(1, min(bottom_limit, total_pages)+1)
-    elif mypage > (total_pages - bottom_limit/2):
-        flex_range = range(total_pages-bottom_limit, total_pages+1)
-    else:
-        flex_range = range(mypage - bottom_limit/2, mypage + bottom_limit/2 + 1)
+    if page is None:
+        try:
+            page = paginator.page(page_num)
+        except PageNotAnInteger:
+            # If page is not an integer, deliver first page.
+            page = paginator.page(1)
+        except EmptyPage:
+            # If page is out of range (e.g. 9999), deliver last page of
+            # results.
+            page = paginator.page(paginator.num_pages)
+        page.object_list = list(page.object_list)
+
+    total_pages = paginator.num_pages
+    mypage = min(page.number, total_pages)
 
     p['thanks_list'] = page
-    p['flex_page_range'] = flex_range
-    return render_to_response('staff_directory/show_thanks.html', p,
-                              context_instance=RequestContext(req))
+    p['flex_page_range'] = flex_page_range(mypage, total_pages)
+    if page.object_list:
+        p['previous_cursor'] = page.object_list[0].pk
+        p['next_cursor'] = page.object_list[-1].pk
+    return _render(req, 'staff_directory/show_thanks.html', p)
 
 
+@instrumented
 @login_required
-@never_cache
+def thanks_stats(req):
+    """
+        staff thanks totals by value, office and month and the top
+        recipients, as a page or as JSON with ?format=json
+    """
+    try:
+        months = min(max(int(req.GET.get('months', 12)), 1),
+                     THANKS_STATS_MAX_MONTHS)
+    except ValueError:
+        months = 12
+    today = date.today()
+    # the first day of the month months - 1 months ago
+    first = today.year * 12 + today.month - months
+    stats = praise_stats.stats(since=date(first // 12, first % 12 + 1, 1))
+
+    if req.GET.get('format') == 'json':
+        return json_response(stats)
+
+    p = _create_params(req)
+    p['stats'] = stats
+    p['months'] = months
+    return _render(req, TEMPLATE_PATH + 'thanks_stats.html', p)
+
+@instrumented
+@login_required
+@always_revalidate
+@condition(etag_func=validators.tag_page_etag,
+           last_modified_func=validators.tag_page_last_modified)
 #define show by tag with 3 parameters, req, tag_slugs, and new_tag_slug
 def show_by_tag(req, tag_slugs='', new_tag_slug=''):
 
@@ -363,30 +498,22 @@ def show_by_tag(req, tag_slugs='', new_tag_slug=''):
         if len(tag_slugs_list) == 0:
             return HttpResponseRedirect(reverse('staff_directory:index'))
 
-        selected_tags = Tag.objects.filter(slug__in=tag_slugs_list)
+        selected_tags = list(Tag.objects.filter(slug__in=tag_slugs_list))
 
-        if selected_tags.count() == 0:
+        if len(selected_tags) == 0:
             return HttpResponseRedirect(reverse('staff_directory:index'))
         # if only a single tag, show 'add tag to person' block
-        if selected_tags.count() == 1:
+        if len(selected_tags) == 1:
             p['single_tag'] = selected_tags[0]
 
-        selected_tag_pks = Tag.objects.filter(
-            slug__in=tag_slugs_list).values_list('pk', flat=True)
-
-        people = _apply_profile_filters(Person.objects)
+        selected_tag_pks = [t.pk for t in selected_tags]
 
-        for pk in selected_tag_pks:
-            people = people.filter(tags__pk=pk).distinct()
+        person_ids = tag_index.person_ids(all_of=selected_tag_pks)
+        people = tag_index.filter_people(
+            _apply_profile_filters(Person.objects), all_of=selected_tag_pks)
 
-        tags = Tag.objects.filter(
-            person__in=people,
-            person__user__is_active=True,
-            taggit_taggeditem_items__tag_category__slug__in=
-            STAFF_DIR_TAG_CATEGORIES).annotate(
-                tag_count=Count('taggit_taggeditem_items'),
-            ). \
-            order_by('-tag_count', 'slug')
+        if req.GET.get('format') == people_grid.PEOPLE_JSON_FORMAT:
+            return _people_json(req, people)
 
         title_tags = ','.join(t.name for t in selected_tags)
 
@@ -397,28 +524,33 @@ def show_by_tag(req, tag_slugs='', new_tag_slug=''):
 
         selected_tags_list.sort()
 
-        # this array is to limit returns of non-selected tags
-        passed_tags = []
-        for t in tags:
-            if t.slug in selected_tags_list:
-                #do nothing
-                pass
-            elif len(passed_tags) < 30:
-                passed_tags.append(t)
+        # everyone listed carries all of the selected tags
+        tags = []
+        if person_ids:
+            tags = sorted(selected_tags, key=lambda t: t.slug)
+            people_count = people.count()
+            for t in tags:
+                t.tag_count = people_count
+
+        # the 30 tags most often found together with the selected ones
+        passed_tags = tag_cooccurrence.related_tags(
+            selected_tag_pks, 30, person_ids) if person_ids else []
 
         p['title'] = "Tagged with %s" % title_tags
-        p['people'] = people
+        p['people_page'] = partial(people_grid.page, people)
         p['tags'] = tags
         p['selected_tags'] = tag_slugs
         p['passed_tags'] = passed_tags
+        p['cache_version'] = group_versions(
+            [tag_group(pk) for pk in selected_tag_pks])
 
         # Pass a list to the page so we can compare whether selected tag already exists
         p['selected_tags_list'] = selected_tags_list
 
         # TODO: should show page that no one is tagged with that tag
-        return render_to_response(TEMPLATE_PATH + 'display_group.html', p,
-                                  context_instance=RequestContext(req))
+        return _render(req, TEMPLATE_PATH + 'display_group.html', p)
 
+@instrumented
 @login_required
 def show_tag_emails(req, tag_slugs=''):
     tag_slugs_list = []
@@ -426,31 +558,90 @@ def show_tag_emails(req, tag_slugs=''):
         if not t.strip() == '':
             tag_slugs_list.append(t)
 
-    emails = _get_emails_for_tag(tag_slugs_list)
+    people = _get_people_for_tag(tag_slugs_list)
 
-    if len(emails) == 0:
+    if not people.exists():
         return HttpResponse("There are no active users with this tag.")
 
-    emails_text = '; '.join(emails)
-    return HttpResponse(emails_text)
+    export_format = req.GET.get('format', export.EMAILS_FORMAT)
+    return export.export_response(people, export_format,
+                                  slugify('-'.join(tag_slugs_list)))
 
 
+@instrumented
 @login_required
 @never_cache
 def lookup(req):
     if req.method != 'GET':
         return HttpResponseNotAllowed(['GET'])
 
-    email = req.GET.get('email') or ''
-
-    try:
-        person = Person.objects.get(user__email__iexact=email)
-    except Person.DoesNotExist:
+    stub = email_lookup.resolve_one(req.GET.get('email'))
+    if stub is None:
         raise Http404
 
-    url = reverse('staff_directory:person', args=(person.stub,))
+    url = reverse('staff_directory:person', args=(stub,))
 
     params = dict(req.GET.items())
     params.pop('email')
 
     return HttpResponseRedirect(url + '?' + urlencode(params))
+
+
+@instrumented
+@login_required
+@never_cache
+@csrf_protect
+def lookup_many(req):
+    """
+        resolves many email addresses to profile urls in one request, given
+        as repeated email parameters or a comma separated emails parameter,
+        GET or POST. answers {"people": {email: url or null}}
+    """
+    if req.method not in ('GET', 'POST'):
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    data = req.POST if req.method == 'POST' else req.GET
+    addresses = data.getlist('email') + \
+        [email for email in data.get('emails', '').split(',')]
+    addresses = [email.strip() for email in addresses if email.strip()]
+    if len(addresses) > LOOKUP_BATCH_LIMIT:
+        return json_response({'error': 'At most %d email addresses can be '
+                              'looked up at once.' % LOOKUP_BATCH_LIMIT})
+
+    stubs = email_lookup.resolve(addresses)
+    people = {}
+    for email in addresses:
+        stub = stubs.get(email_lookup.normalize(email))
+        people[email] = stub and \
+            reverse('staff_directory:person', args=(stub,))
+    return json_response({'people': people})
+
+
+@instrumented
+@login_required
+def autocomplete_json(req, kind):
+    """
+        jQuery UI autocomplete source for people or tags, answered from
+        the in-memory prefix index
+    """
+    kind = {'people': autocomplete.PERSON, 'tags': autocomplete.TAG}[kind]
+    try:
+        limit = min(int(req.GET.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+    results = autocomplete.search(req.GET.get('term', ''), kind, limit)
+    return HttpResponse(json.dumps(results), content_type='application/json')
+
+
+@login_required
+def stats(req):
+    """
+        per view timings, query counts and cache hits of this process,
+        recorded when STAFF_DIR_INSTRUMENTATION is on, and the counters of
+        the cached fragments, always recorded
+    """
+    if not req.user.is_staff:
+        raise Http404
+    return json_response({'enabled': instrumentation.enabled(),
+                          'views': instrumentation.get_stats(),
+                          'caches': caching.cache_stats()})
@@ -0,0 +1,169 @@
+"""
+Cache warming of the directory pages.
+
+After a deploy or a broad expiry the first readers of the index, of the
+org group pages and of the most popular tag pages would each rebuild them
+from the database at the same time.  ``warm`` renders those pages ahead
+of them, so their shared cached fragments and the recent photos feed are
+stored once.  The pages' views are called directly, without going through
+the middleware, on a thread pool, at most STAFF_DIR_WARM_RATE a second, as
+an ordinary active user.  It can be called from code after an expiry as
+well as through the ``warm_caches`` management command.
+"""
+import threading
+import time
+from importlib import import_module
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection
+from django.http import Http404, HttpRequest
+
+from core.models import Person
+from staff_directory import org_tree, recent_photos, tag_counts
+
+WARM_THREADS = getattr(settings, 'STAFF_DIR_WARM_THREADS', 4)
+WARM_RATE = getattr(settings, 'STAFF_DIR_WARM_RATE', 10)
+WARM_TAGS = getattr(settings, 'STAFF_DIR_WARM_TAGS', 50)
+
+
+class WarmingError(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """
+        spaces the calls to wait of all threads at least 1 / rate seconds
+        apart, a rate of 0 does not wait
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def warm_components():
+    """
+        loads the parts of the index kept in the shared cache outside of
+        its template.  the org tree and the autocomplete index are per
+        process copies and are left to the processes serving the pages
+    """
+    recent_photos.get_feed()
+
+
+def urls(tags=WARM_TAGS):
+    """
+        the index, every division and office page and the pages of the
+        tags most people carry
+    """
+    groups = sorted(org_tree.get_tree()['groups'].values(),
+                    key=lambda g: (g.parent_id is not None, g.title))
+    popular = tag_counts.popular_tags(1)[:tags]
+    return ([reverse('staff_directory:index')] +
+            [reverse('staff_directory:org_group', args=(group.title,))
+             for group in groups] +
+            [reverse('staff_directory:show_by_tag', args=(tag.slug,))
+             for tag in popular])
+
+
+def _host():
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def _request(url, user):
+    """
+        a GET of url by user, as the middleware hands it to the view.  the
+        user is not logged in: nothing updates their last_login and the
+        session is never saved
+    """
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = url
+    request.META = {'REQUEST_METHOD': 'GET', 'SERVER_NAME': _host(),
+                    'SERVER_PORT': '80'}
+    request.user = user
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+    return request
+
+
+def render(url, user):
+    """
+        calls the view of url as user and renders its response, returns
+        the status code
+    """
+    match = resolve(url)
+    try:
+        response = match.func(_request(url, user), *match.args,
+                              **match.kwargs)
+    except Http404:
+        return 404
+    except PermissionDenied:
+        return 403
+    if hasattr(response, 'render'):
+        response.render()
+    return response.status_code
+
+
+def _default_user():
+    # pages are cached as ordinary users see them
+    person = Person.objects.filter(user__is_active=True,
+                                   user__is_staff=False,
+                                   user__is_superuser=False) \
+        .select_related('user').order_by('pk').first()
+    if person is None:
+        raise WarmingError('There is no active person without staff or '
+                           'superuser rights to warm the pages as.')
+    return person.user
+
+
+def warm(user=None, threads=WARM_THREADS, rate=WARM_RATE, tags=WARM_TAGS):
+    """
+        renders the pages as user, by default the first active person who
+        is neither staff nor superuser, returns the number of pages warmed,
+        the (url, status) of those that failed and the seconds it took
+    """
+    start = time.time()
+    warm_components()
+    user = user or _default_user()
+    limiter = RateLimiter(rate)
+
+    def fetch(url):
+        limiter.wait()
+        return url, render(url, user)
+
+    def fetch_in_thread(url):
+        try:
+            return fetch(url)
+        finally:
+            # each pool thread opens its own connection
+            connection.close()
+
+    if threads <= 1:
+        statuses = [fetch(url) for url in urls(tags)]
+    else:
+        pool = ThreadPool(threads)
+        try:
+            statuses = pool.map(fetch_in_thread, urls(tags))
+        finally:
+            pool.close()
+            pool.join()
+
+    failed = [(url, status) for url, status in statuses if status != 200]
+    return {'pages': len(statuses) - len(failed), 'failed': failed,
+            'seconds': time.time() - start}